@@ -0,0 +1,57 @@
+"""Measures per-response cost of setting CSP Header.
+
+Compares rebuilding the header value on every response (before) with the
+precompiled value by ``compile_csp_header`` (after).
+
+    (venv) % python benchmarks/csp_header.py
+"""
+import timeit
+
+from pyramid.response import Response
+
+from pyramid_secure_response.csp_coverage import (
+    HEADER_KEY,
+    build_csp_header,
+    compile_csp_header,
+)
+from pyramid_secure_response.util import get_config
+
+
+SETTINGS = {
+    'pyramid_secure_response.csp_coverage.default_src': 'self',
+    'pyramid_secure_response.csp_coverage.script_src':
+        'self https://cdn.example.org https://www.example.com',
+    'pyramid_secure_response.csp_coverage.style_src':
+        'self unsafe-inline https://cdn.example.org',
+    'pyramid_secure_response.csp_coverage.img_src': 'self data: https:',
+    'pyramid_secure_response.csp_coverage.frame_ancestors': 'none',
+    'pyramid_secure_response.csp_coverage.plugin_types': 'application/pdf',
+    'pyramid_secure_response.csp_coverage.report_uri':
+        'https://example.org/csp-report',
+    'pyramid_secure_response.csp_coverage.upgrade_insecure_requests': 'True',
+}
+
+
+class DummyRegistry(object):  # pylint: disable=too-few-public-methods
+    settings = SETTINGS
+
+
+def main(number=100000):
+    csp_coverage = get_config(DummyRegistry()).csp_coverage
+    header = compile_csp_header(csp_coverage)
+    res = Response()
+
+    def before():
+        res.headers[HEADER_KEY] = build_csp_header(csp_coverage)
+
+    def after():
+        res.headers[HEADER_KEY] = header.value
+
+    for name, f in (('before', before), ('after', after)):
+        elapsed = min(timeit.repeat(f, number=number, repeat=5))
+        print('{:8s} {:10.1f} ns/response'.format(
+            name, elapsed / number * 1e9))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""Measures throughput of hashing inline scripts in streamed HTML.
+
+Feeds multi-megabyte pages to ``InlineScriptHasher`` chunk by chunk, and
+compares with the regex based extraction on the whole decoded body (which
+needs whole-body buffering).
+
+    (venv) % python benchmarks/inline_hashes.py
+"""
+import timeit
+
+from pyramid_secure_response.csp_hashes import (
+    InlineScriptHasher,
+    extract_hash_sources,
+)
+
+BLOCK = (
+    u'<div class="item"><p>Lorem ipsum dolor sit amet, consectetur '
+    u'adipiscing elit, sed do eiusmod tempor incididunt.</p></div>\n' * 50 +
+    u'<script>window.items.push({id: 1, name: "item"});</script>\n'
+    u'<script src="/static/app.js"></script>\n'
+)
+
+
+def build_page(size):  # type: (int) -> bytes
+    body = BLOCK * (size // len(BLOCK) + 1)
+    return (u'<html><body>' + body + u'</body></html>').encode('utf-8')
+
+
+def main(number=5):
+    for size in (1 << 20, 8 << 20):
+        page = build_page(size)
+        mb = len(page) / float(1 << 20)
+
+        for chunk_size in (4096, 65536):
+            chunks = [page[i:i + chunk_size]
+                      for i in range(0, len(page), chunk_size)]
+
+            def streaming(c=chunks):
+                hasher = InlineScriptHasher()
+                for chunk in c:
+                    hasher.feed(chunk)
+                return hasher.close()
+
+            elapsed = min(timeit.repeat(streaming, number=number, repeat=3))
+            print('{:4.0f} MB streaming ({:5d} B chunks) {:8.1f} MB/s'.format(
+                mb, chunk_size, mb * number / elapsed))
+
+        def buffered(p=page):
+            return extract_hash_sources(p.decode('utf-8'))
+
+        elapsed = min(timeit.repeat(buffered, number=number, repeat=3))
+        print('{:4.0f} MB buffered (regex)           {:8.1f} MB/s'.format(
+            mb, mb * number / elapsed))
+
+
+if __name__ == '__main__':
+    main()
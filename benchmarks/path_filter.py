@@ -0,0 +1,61 @@
+"""Measures ignore paths matching cost by number of paths.
+
+Compares ``str.startswith()`` over all paths (linear) with ``PathFilter``
+(segment trie), both with and without the per-path decision cache.
+
+    (venv) % python benchmarks/path_filter.py
+"""
+import timeit
+
+from pyramid_secure_response.util import PathFilter
+
+
+def build_paths(count):  # type: (int) -> tuple
+    paths = ['/_ah/health', '/static/', '/robots.txt']
+    paths.extend('/webhooks/tenant-{:d}/'.format(i)
+                 for i in range(count - len(paths)))
+    return tuple(paths[:count])
+
+
+REQUEST_PATHS = (
+    '/',
+    '/users/42/profile',
+    '/static/css/app.css',
+    '/webhooks/tenant-7/events',
+    '/webhooks/unknown/events',
+    '/api/v1/items?page=2',
+)
+
+
+def main(number=2000):
+    print('{:>6s} {:>14s} {:>14s} {:>14s}'.format(
+        'paths', 'linear', 'trie', 'trie+cache'))
+
+    for count in (1, 10, 100, 1000, 10000):
+        paths = build_paths(count)
+        trie = PathFilter(paths, cache_size=0)
+        cached = PathFilter(paths)
+
+        def linear():
+            for path in REQUEST_PATHS:
+                any([path.startswith(p) for p in paths])  # noqa
+
+        def trie_match():
+            for path in REQUEST_PATHS:
+                trie.match(path)
+
+        def cached_match():
+            for path in REQUEST_PATHS:
+                cached.match(path)
+
+        results = []
+        for f in (linear, trie_match, cached_match):
+            elapsed = min(timeit.repeat(f, number=number, repeat=3))
+            results.append(elapsed / number / len(REQUEST_PATHS) * 1e9)
+
+        print('{:6d} {:11.1f} ns {:11.1f} ns {:11.1f} ns'.format(
+            count, *results))
+
+
+if __name__ == '__main__':
+    main()
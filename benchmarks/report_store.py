@@ -0,0 +1,53 @@
+"""Measures ingestion rate of CSP reports into ``ReportStore``.
+
+Writes reports in batches (as ``ReportQueue`` does) into a temporary SQLite
+database, and prints reports per second.
+
+    (venv) % python benchmarks/report_store.py
+"""
+import os
+import shutil
+import tempfile
+import time
+
+from pyramid_secure_response.csp_store import ReportStore
+
+
+def build_reports(count):  # type: (int) -> list
+    now = int(time.time())
+    return [{
+        'violated_directive': ('script-src-elem', 'img-src', 'style-src')[
+            i % 3],
+        'blocked_uri': 'https://cdn{:d}.example.org/a.js'.format(i % 50),
+        'document_uri': 'https://example.org/items/{:d}'.format(i % 1000),
+        'time': now - i % 3600,
+    } for i in range(count)]
+
+
+def main(count=100000):
+    reports = build_reports(count)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for batch_size in (100, 500, 2000):
+            store = ReportStore(os.path.join(
+                tmpdir, 'reports-{:d}.sqlite'.format(batch_size)))
+
+            started = time.time()
+            for i in range(0, count, batch_size):
+                store(reports[i:i + batch_size])
+            elapsed = time.time() - started
+
+            started = time.time()
+            store.top(10, since=3600)
+            query = time.time() - started
+            store.close()
+
+            print('{:d} reports ({:4d} per batch) {:10.0f} reports/s, '
+                  'top: {:.1f} ms'.format(
+                      count, batch_size, count / elapsed, query * 1000))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
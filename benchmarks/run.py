@@ -0,0 +1,446 @@
+"""Microbenchmark suite for the hot paths of the tweens.
+
+Each case runs over a mix of requests (secure/insecure, ignored/not ignored,
+small/large policies and many ignore paths), then reports:
+
+* ns/op (median of repeats)
+* B/op (peak bytes allocated by tracemalloc during an operation)
+* blocks/op (memory blocks allocated during an operation and still alive at
+  its end, by tracemalloc snapshot statistics)
+
+Results can be saved as JSON baseline, and compared with it. This exits with
+status 1 if any metric of a case exceeds the baseline over the threshold.
+
+    (venv) % python benchmarks/run.py --save benchmarks/baseline.json
+    (venv) % python benchmarks/run.py --baseline benchmarks/baseline.json \
+        --threshold 0.2
+
+The baseline depends on the machine, so create it on the same machine (e.g.
+CI runner) where it's compared.
+"""
+import argparse
+from contextlib import ExitStack
+import gc
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+from pyramid.registry import Registry
+from pyramid.request import Request
+from pyramid.response import Response
+
+from pyramid_secure_response import (
+    csp_coverage,
+    hsts_support,
+    secure_response,
+    security_headers,
+    ssl_redirect,
+)
+from pyramid_secure_response.csp_override import (
+    apply_csp_overrides,
+    build_csp_overrides,
+    get_csp_override,
+)
+from pyramid_secure_response.policy_reload import get_policy_watcher
+from pyramid_secure_response.util import (
+    HostMap,
+    PathFilter,
+    apply_path_filter,
+    build_criteria,
+    compile_config,
+    is_secure_request,
+    logger,
+    parse_config,
+)
+
+PREFIX = 'pyramid_secure_response'
+
+SMALL_POLICY = {
+    PREFIX + '.csp_coverage.default_src': 'self',
+}
+
+LARGE_POLICY = {
+    PREFIX + '.csp_coverage.default_src': 'none',
+    PREFIX + '.csp_coverage.connect_src':
+        'self https://api.example.org wss://ws.example.org',
+    PREFIX + '.csp_coverage.font_src': 'self https://fonts.gstatic.com',
+    PREFIX + '.csp_coverage.frame_ancestors': 'none',
+    PREFIX + '.csp_coverage.img_src':
+        'self data: https: https://img.example.org https://cdn.example.org',
+    PREFIX + '.csp_coverage.script_src': ' '.join(
+        ['self', 'strict-dynamic'] +
+        ['https://cdn{:d}.example.org'.format(i) for i in range(20)]),
+    PREFIX + '.csp_coverage.style_src':
+        'self unsafe-inline https://fonts.googleapis.com',
+    PREFIX + '.csp_coverage.plugin_types': 'application/pdf',
+    PREFIX + '.csp_coverage.report_uri': 'https://example.org/csp-report',
+    PREFIX + '.csp_coverage.upgrade_insecure_requests': 'True',
+}
+
+
+BUNDLE_POLICY = {
+    PREFIX + '.security_headers.x_content_type_options': 'nosniff',
+    PREFIX + '.security_headers.referrer_policy':
+        'strict-origin-when-cross-origin',
+    PREFIX + '.security_headers.permissions_policy':
+        'camera=(), geolocation=(), microphone=()',
+    PREFIX + '.security_headers.cross_origin_opener_policy': 'same-origin',
+    PREFIX + '.security_headers.cross_origin_embedder_policy':
+        'require-corp',
+    PREFIX + '.security_headers.reporting_endpoints':
+        'csp="https://example.org/csp-report"',
+}
+
+
+def build_ignore_paths(count):  # type: (int) -> str
+    paths = ['/_ah/health', '/static/'] + [
+        '/webhooks/tenant-{:d}/'.format(i) for i in range(count)]
+    return '\n' + '\n'.join(paths[:count]) + '\n'
+
+
+# (path, scheme, x-forwarded-proto)
+MIXES = {
+    'secure': [('/', 'https', 'https')],
+    'insecure': [('/', 'http', 'http')],
+    'ignored': [('/_ah/health', 'http', 'http')],
+    # 70% secure, 20% insecure, 10% ignored
+    'mixed': (
+        [('/users/{:d}'.format(i), 'https', 'https') for i in range(7)] +
+        [('/users/{:d}'.format(i), 'http', 'http') for i in range(2)] +
+        [('/_ah/health', 'http', 'http')]),
+}
+
+
+def build_environs(mix):  # type: (str) -> list
+    environs = []
+    for path, scheme, proto in MIXES[mix]:
+        environs.append(Request.blank(
+            path, base_url='{:s}://example.org'.format(scheme), headers={
+                'Host': 'example.org',
+                'X-Forwarded-Proto': proto,
+            }).environ)
+    return environs
+
+
+def build_registry(settings):  # type: (dict) -> Registry
+    registry = Registry()
+    registry.settings = settings
+    return registry
+
+
+def handler(req):  # pylint: disable=unused-argument
+    return Response()
+
+
+def tween_case(module, mix, settings):
+    """Returns an operation calls the tween with fresh request/response.
+
+    Creating request and response is included also into the baseline case
+    (`handler`), so the tween overhead is ``ns/op - handler ns/op``.
+    """
+    registry = build_registry(settings)
+    tween = module.tween(handler, registry) if module else handler
+    environs = build_environs(mix)
+    state = {'i': 0}
+
+    def op():
+        i = state['i'] = (state['i'] + 1) % len(environs)
+        req = Request(dict(environs[i]))
+        req.registry = registry
+        tween(req)
+
+    op.registry = registry
+    return op
+
+
+def build_append_headers_cases():  # type: () -> list
+    """Appends 6 headers by one scan, or checks each header (as tweens)."""
+    bundle = compile_config(BUNDLE_POLICY).security_headers.headers
+    append_headers = security_headers.build_append_headers_f(bundle)
+
+    def _append_each(res):
+        for name, value in bundle:
+            if name not in res.headers:
+                res.headers[name] = value
+
+    return [('append_headers[{:s}]'.format(kind), lambda o=op: o(Response()))
+            for kind, op in (
+                ('bundle', lambda r: append_headers(r.headerlist)),
+                ('each', _append_each))]
+
+
+def build_host_map_cases():  # type: () -> list
+    """Resolves exact hosts and wildcard domains of many tenants."""
+    cases = []
+    for count in (10, 10000):
+        hosts = HostMap(default=0)
+        for i in range(count):
+            hosts.add('tenant-{:d}.example.org'.format(i), i)
+            hosts.add('*.tenant-{:d}.example.com'.format(i), i)
+        names = [n.format(i) for i in range(0, count, max(1, count // 10))
+                 for n in ('tenant-{:d}.example.org',
+                           'www.tenant-{:d}.example.com', 'example.net')]
+        cases.append(('host_map.resolve[{:d}]'.format(count),
+                      lambda h=hosts, n=names: [h.resolve(x) for x in n]))
+    return cases
+
+
+def build_policy_store_cases(stack):  # type: (ExitStack) -> list
+    """Gets cached policies, or compiles one from file (as cold start)."""
+    path = stack.enter_context(tempfile.TemporaryDirectory())
+    for i in range(1000):
+        with open(os.path.join(path, 'tenant-{:d}.example.org.json'.format(
+                i)), 'w') as f:
+            json.dump({'csp_coverage': {
+                'script_src': 'self https://cdn{:d}.example.org'.format(
+                    i % 10)}}, f)
+    store = compile_config(dict(LARGE_POLICY, **{
+        PREFIX + '.policy_store.path': path,
+    })).policy_store
+    hosts = ['tenant-{:d}.example.org'.format(i) for i in range(1000)]
+    for host in hosts:
+        store.get(host)
+
+    def _compile():
+        store.clear()
+        store.get(hosts[0])
+
+    return [('policy_store.get[hit]', lambda: [store.get(h) for h in hosts]),
+            ('policy_store.get[compile]', _compile)]
+
+
+def build_policy_reload_cases(stack):  # type: (ExitStack) -> list
+    """Calls tweens which read the reloadable policy (one attribute read)."""
+    path = os.path.join(
+        stack.enter_context(tempfile.TemporaryDirectory()), 'policy.json')
+    with open(path, 'w') as f:
+        json.dump({'csp_coverage': {'default_src': 'self'}}, f)
+
+    settings = dict(SMALL_POLICY, **{
+        PREFIX + '.proto_header': 'X-Forwarded-Proto',
+        PREFIX + '.policy_reload.path': path,
+        PREFIX + '.policy_reload.interval': '60',
+    })
+    cases = []
+    for name, module in (('hsts_support', hsts_support),
+                         ('csp_coverage', csp_coverage),
+                         ('secure_response', secure_response)):
+        op = tween_case(module, 'mixed', settings)
+        # started by the tween (stopped before the directory is removed)
+        stack.callback(get_policy_watcher(op.registry).stop)
+        cases.append(('tween.{:s}[reload]'.format(name), op))
+    return cases
+
+
+def build_csp_override_cases():  # type: () -> list
+    """Calls the tween with overrides by view, or rebuilds the policy."""
+    settings = dict(SMALL_POLICY, **{
+        PREFIX + '.proto_header': 'X-Forwarded-Proto',
+    })
+    registry = build_registry(settings)
+    overrides = build_csp_overrides(
+        add={'connect_src': 'https://api.example.org'})
+
+    def _view(req):
+        get_csp_override(req).extend(overrides)
+        return Response()
+
+    tween = csp_coverage.tween(_view, registry)
+    environ = build_environs('secure')[0]
+
+    def _override():
+        req = Request(dict(environ))
+        req.registry = registry
+        tween(req)
+
+    directives = compile_config(settings).csp_coverage.directives
+
+    def _rebuild():
+        res = Response()
+        res.headers[csp_coverage.HEADER_KEY] = csp_coverage.compile_csp_header(
+            apply_csp_overrides(directives, overrides)).value
+
+    return [('tween.csp_coverage[override]', _override),
+            ('csp_override[rebuild]', _rebuild)]
+
+
+def build_cases(stack):  # type: (ExitStack) -> list
+    """Returns cases as list of (name, op).
+
+    Temporary files and watcher threads are cleaned up by the stack.
+    """
+    settings = {
+        PREFIX + '.proto_header': 'X-Forwarded-Proto',
+        PREFIX + '.ignore_paths': build_ignore_paths(2),
+    }
+    large = dict(settings, **LARGE_POLICY)
+    large[PREFIX + '.ignore_paths'] = build_ignore_paths(1000)
+
+    cases = [('handler', tween_case(None, 'secure', settings))]
+    for name, module, policy in (
+            ('ssl_redirect', ssl_redirect, SMALL_POLICY),
+            ('hsts_support', hsts_support, SMALL_POLICY),
+            ('csp_coverage', csp_coverage, SMALL_POLICY),
+            ('security_headers', security_headers, BUNDLE_POLICY),
+            ('secure_response', secure_response, SMALL_POLICY)):
+        for mix in ('secure', 'insecure', 'ignored', 'mixed'):
+            cases.append(('tween.{:s}[{:s}]'.format(name, mix),
+                          tween_case(module, mix, dict(settings, **policy))))
+        cases.append(('tween.{:s}[large]'.format(name),
+                      tween_case(module, 'mixed', dict(large,
+                                                       **BUNDLE_POLICY))))
+    cases.extend(build_append_headers_cases())
+    cases.extend(build_host_map_cases())
+    cases.extend(build_policy_store_cases(stack))
+    cases.extend(build_policy_reload_cases(stack))
+    cases.extend(build_csp_override_cases())
+
+    for size, policy in (('small', SMALL_POLICY), ('large', LARGE_POLICY)):
+        config = parse_config(policy).csp_coverage
+        cases.append(('build_csp_header[{:s}]'.format(size),
+                      lambda c=config: csp_coverage.build_csp_header(c)))
+
+    hsts = compile_config({}).hsts_support
+    cases.append(('build_hsts_header',
+                  lambda: hsts_support.build_hsts_header(hsts)))
+
+    reqs = [Request(e) for e in build_environs('mixed')]
+    for count in (10, 1000):
+        raw = tuple(build_ignore_paths(count).split())
+        for kind, paths in (('tuple', raw),
+                            ('trie', PathFilter(raw, cache_size=0)),
+                            ('cache', PathFilter(raw))):
+            cases.append((
+                'apply_path_filter[{:d},{:s}]'.format(count, kind),
+                lambda p=paths: [apply_path_filter(q, p) for q in reqs]))
+
+    for mix in ('secure', 'insecure'):
+        req = Request(build_environs(mix)[0])
+        cases.append((
+            'build_criteria[{:s}]'.format(mix),
+            lambda r=req: build_criteria(r, proto_header='X-Forwarded-Proto')))
+        cases.append((
+            'is_secure_request[{:s}]'.format(mix),
+            lambda r=req: is_secure_request(r, 'HTTP_X_FORWARDED_PROTO')))
+    return cases
+
+
+def measure(op, number, repeat):  # type: (function, int, int) -> dict
+    op()  # warm up
+
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        times = timeit.repeat(op, number=number, repeat=repeat)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    ns_per_op = sorted(times)[len(times) // 2] / number * 1e9
+
+    tracemalloc.start()
+    try:
+        peaks, blocks = [], []
+        for _ in range(10):
+            tracemalloc.clear_traces()
+            before, _ = tracemalloc.get_traced_memory()
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            op()
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(max(peak - before, 0))
+            blocks.append(count_blocks(tracemalloc.take_snapshot()))
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'ns_per_op': round(ns_per_op, 1),
+        'bytes_per_op': sorted(peaks)[len(peaks) // 2],
+        'blocks_per_op': sorted(blocks)[len(blocks) // 2],
+    }
+
+
+def count_blocks(snapshot):  # type: (tracemalloc.Snapshot) -> int
+    """Returns the number of traced blocks (except tracemalloc's own)."""
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),))
+    return sum(stat.count for stat in snapshot.statistics('filename'))
+
+
+# metrics compared with the baseline (and their units)
+METRICS = (
+    ('ns_per_op', 'ns/op'),
+    ('bytes_per_op', 'B/op'),
+    ('blocks_per_op', 'blocks/op'),
+)
+
+
+def compare(results, baseline, threshold):  # type: (dict, dict, float) -> list
+    """Returns regressions as list of (name, metric, result, base).
+
+    Metrics which are not in the baseline (e.g. saved by an older version)
+    are not compared.
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        base = baseline.get('cases', {}).get(name) or {}
+        for metric, _ in METRICS:
+            if metric in base and \
+               result[metric] > base[metric] * (1 + threshold):
+                regressions.append((name, metric, result, base))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--baseline', help='JSON baseline to compare with')
+    parser.add_argument('--save', help='save results as JSON baseline')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed slowdown ratio (default: 0.2)')
+    parser.add_argument('--number', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('-k', dest='keyword', default='',
+                        help='run only cases which contain keyword')
+    args = parser.parse_args(argv)
+
+    logger.setLevel(logging.ERROR)
+
+    results = {}
+    with ExitStack() as stack:
+        for name, op in build_cases(stack):
+            if args.keyword not in name:
+                continue
+            results[name] = measure(op, args.number, args.repeat)
+            print('{:40s} {:12.1f} ns/op {:8d} B/op {:6d} blocks/op'.format(
+                name, results[name]['ns_per_op'],
+                results[name]['bytes_per_op'],
+                results[name]['blocks_per_op']))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'cases': results,
+            }, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        units = dict(METRICS)
+        for name, metric, result, base in regressions:
+            print('REGRESSION {:s}: {} {:s} (baseline {} {:s})'.format(
+                name, result[metric], units[metric], base[metric],
+                units[metric]))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
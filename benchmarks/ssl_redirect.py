@@ -0,0 +1,74 @@
+"""Measures cost of redirect for insecure requests through Pyramid router.
+
+Compares raising ``HTTPMovedPermanently`` (goes through the exception view
+lookup by excview tween) with returning the prebuilt redirect response.
+
+    (venv) % python benchmarks/ssl_redirect.py
+"""
+import logging
+import timeit
+
+from pyramid import tweens
+from pyramid.config import Configurator
+from pyramid.httpexceptions import HTTPMovedPermanently
+from pyramid.response import Response
+
+from pyramid_secure_response.util import logger
+
+
+def raise_tween(handler, registry):  # pylint: disable=unused-argument
+    def _raise_tween(req):
+        if req.environ['wsgi.url_scheme'] == 'https':
+            return handler(req)
+        raise HTTPMovedPermanently(location='https://{:s}{:s}'.format(
+            req.host, req.path))
+    return _raise_tween
+
+
+def make_app(tween_name):  # type: (str) -> Router
+    config = Configurator(settings={
+        'pyramid_secure_response.hsts_support.enabled': 'False',
+        'pyramid_secure_response.csp_coverage.enabled': 'False',
+    })
+    config.add_tween(tween_name, over=tweens.MAIN)
+    config.add_route('index', '/')
+    config.add_view(lambda _: Response('OK'), route_name='index')
+    return config.make_wsgi_app()
+
+
+def start_response(status, headers, exc_info=None):
+    # pylint: disable=unused-argument
+    return None
+
+
+def main(number=20000):
+    logger.setLevel(logging.ERROR)
+
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': '/',
+        'SCRIPT_NAME': '',
+        'QUERY_STRING': '',
+        'SERVER_NAME': 'example.org',
+        'SERVER_PORT': '80',
+        'HTTP_HOST': 'example.org',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'wsgi.url_scheme': 'http',
+    }
+
+    for name, tween_name in (
+            ('raise', '{:s}.raise_tween'.format(__name__)),
+            ('return', 'pyramid_secure_response.ssl_redirect.tween')):
+        app = make_app(tween_name)
+
+        def request():
+            for _ in app(dict(environ), start_response):  # noqa
+                pass
+
+        elapsed = min(timeit.repeat(request, number=number, repeat=3))
+        print('{:8s} {:10.1f} us/request'.format(
+            name, elapsed / number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
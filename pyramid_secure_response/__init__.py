@@ -1,4 +1,6 @@
 from pyramid import tweens
+from pyramid.events import ApplicationCreated
+from pyramid.settings import asbool
 
 __all__ = (
     '__version__',
@@ -21,9 +23,47 @@ def includeme(config):
     >>> config.add_tween('pyramid_secure_response.ssl_redirect.tween')
     >>> config.add_tween('pyramid_secure_response.hsts_support.tween')
     >>> config.add_tween('pyramid_secure_response.csp_coverage.tween')
+    >>> config.add_tween('pyramid_secure_response.security_headers.tween')
+
+    If `pyramid_secure_response.fused` is true, a tween which applies all of
+    these in one pass is included instead.
+
+    >>> config.add_tween('pyramid_secure_response.secure_response.tween')
+
+    The `request.secure_context` (see `SecureContext`) is also added, which is
+    shared by tweens and views. And the `request.csp_nonce` is added for the
+    nonce source in Content-Security-Policy, `request.sri()` for the integrity
+    metadata of static assets, and `request.static_sri()` for the URL and
+    the integrity metadata of them.
+
+    The `request.csp` (see `CSPOverride`) and the ``csp_add`` and
+    ``csp_remove`` view options are added for overrides of the policy per
+    view.
     """
+    config.add_request_method(
+        '{:s}.secure_context.secure_context'.format(__name__),
+        'secure_context', reify=True)
+    config.add_request_method(
+        '{:s}.csp_nonce.csp_nonce'.format(__name__),
+        'csp_nonce', reify=True)
+    config.add_request_method(
+        '{:s}.sri.sri'.format(__name__), 'sri')
+    config.add_request_method(
+        '{:s}.sri.static_sri'.format(__name__), 'static_sri')
+    config.add_request_method(
+        '{:s}.csp_override.csp'.format(__name__), 'csp', reify=True)
+    config.add_view_deriver(
+        '{:s}.csp_override.csp_view_deriver'.format(__name__))
+    config.add_subscriber(
+        '{:s}.sri.prewarm'.format(__name__), ApplicationCreated)
+
     tween_name = (lambda name: '{:s}.{:s}.tween'.format(__name__, name))
 
+    settings = config.get_settings() or {}
+    if asbool(settings.get('{:s}.fused'.format(__name__), False)):
+        config.add_tween(tween_name('secure_response'), over=tweens.MAIN)
+        return
+
     config.add_tween(tween_name('ssl_redirect'),
                      over=tweens.MAIN)
 
@@ -32,3 +72,6 @@ def includeme(config):
 
     config.add_tween(tween_name('csp_coverage'),
                      over=tweens.MAIN, under=tween_name('ssl_redirect'))
+
+    config.add_tween(tween_name('security_headers'),
+                     over=tweens.MAIN, under=tween_name('ssl_redirect'))
@@ -0,0 +1,175 @@
+from itertools import product
+from urllib.parse import quote
+
+from pyramid_secure_response import csp_coverage, hsts_support
+from pyramid_secure_response.secure_response import build_plan
+from pyramid_secure_response.util import (
+    logger,
+    match_path,
+    compile_config,
+    LRUCache,
+)
+from pyramid_secure_response.wsgi import PATH_SAFE
+
+
+def get_path(scope):  # type: (dict) -> str
+    """Returns quoted path as same as ``webob.request.BaseRequest.path``."""
+    path = scope.get('root_path', '') + scope['path']
+    return quote(path.encode('utf-8'), PATH_SAFE)
+
+
+def get_header(scope, name):  # type: (dict, bytes) -> Union[bytes, None]
+    """Returns value of the header (lowercased name) in scope, or None."""
+    for key, value in scope.get('headers', ()):
+        if key == name or key.lower() == name:
+            return value
+    return None
+
+
+def get_host(scope):  # type: (dict) -> str
+    """Returns host from Host header or server in scope."""
+    host = get_header(scope, b'host')
+    if host is not None:
+        return host.decode('latin-1')
+    server = scope.get('server') or ('localhost', 80)
+    return '{:s}:{:d}'.format(server[0], server[1])
+
+
+def is_secure_scope(scope, proto_name=b''):  # type: (dict, bytes) -> bool
+    """Returns True if the request is on https, from ASGI scope.
+
+    The `proto_name` is the lowercased header name (e.g.
+    ``b'x-forwarded-proto'``). Its value must be ``https`` in addition to
+    the scheme, if given.
+    """
+    if scope.get('scheme', 'http') != 'https':
+        return False
+    if proto_name:
+        return get_header(scope, proto_name) == b'https'
+    return True
+
+
+def _to_proto_name(proto_key):  # type: (str) -> bytes
+    # HTTP_X_FORWARDED_PROTO -> b'x-forwarded-proto'
+    if not proto_key:
+        return b''
+    return proto_key[5:].replace('_', '-').lower().encode('latin-1')
+
+
+class SecureResponseMiddleware(object):
+    """ASGI middleware applies all policies except for report-only CSP.
+
+    This works with the same settings as the tweens (Python 3.5+ only).
+
+    * insecure HTTP scope is answered with a redirect
+    * HSTS/CSP header byte-pairs are appended into the headers of
+      ``http.response.start`` message
+    * ``http.response.body`` messages are passed through without buffering
+    """
+
+    def __init__(self, app, settings=None):  # type: (object, dict) -> None
+        self.app = app
+
+        plan = build_plan(compile_config(settings))
+        self.redirect = plan.ssl_redirect
+        self.hsts = plan.hsts_support
+        self.csp = plan.csp_coverage
+        self.bundle = plan.security_headers
+
+        if self.redirect:
+            self.redirect_status = self.redirect.value
+            self.redirect_proto_name = _to_proto_name(self.redirect.proto_key)
+            self.redirect_headers = LRUCache(maxsize=1024)
+
+        if self.hsts:
+            self.hsts_proto_name = _to_proto_name(self.hsts.proto_key)
+
+        # header byte-pairs to append (and their names) by
+        # (hsts, csp, security_headers)
+        hsts_header = (hsts_support.HEADER_KEY.lower().encode('latin-1'),
+                       self.hsts.value.encode('latin-1')) \
+            if self.hsts else None
+        csp_header = (csp_coverage.HEADER_KEY.lower().encode('latin-1'),
+                      self.csp.value.encode('latin-1')) \
+            if self.csp and self.csp.value else None
+        bundle_headers = tuple(
+            (k.lower().encode('latin-1'), v.encode('latin-1'))
+            for k, v in self.bundle.value) if self.bundle else ()
+        self.headers = {}
+        for use_hsts, use_csp, use_bundle in product((True, False), repeat=3):
+            headers = tuple(h for h, use in ((hsts_header, use_hsts),
+                                             (csp_header, use_csp))
+                            if h and use)
+            if use_bundle:
+                headers += bundle_headers
+            self.headers[(use_hsts, use_csp, use_bundle)] = (
+                headers, frozenset(h[0] for h in headers))
+
+        self.enabled = any((self.redirect, self.hsts, self.csp, self.bundle))
+
+    def _build_redirect_headers(self, host, path):
+        # type: (str, str) -> tuple
+        key = (host, path)
+        headers = self.redirect_headers.get(key)
+        if headers is None:
+            headers = self.redirect_headers[key] = (
+                (b'location',
+                 'https://{:s}{:s}'.format(host, path).encode('latin-1')),
+                (b'content-length', b'0'),
+            )
+        return headers
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not self.enabled:
+            return await self.app(scope, receive, send)
+
+        path = get_path(scope)
+        redirect, hsts, csp, bundle = \
+            self.redirect, self.hsts, self.csp, self.bundle
+
+        # decisions are cached in compiled ignore paths
+        if redirect and not match_path(path, redirect.ignore_paths) and \
+           not is_secure_scope(scope, self.redirect_proto_name):
+            logger.warning('(%s) Insecure request %s', 'asgi', path)
+            await send({
+                'type': 'http.response.start',
+                'status': self.redirect_status,
+                'headers': list(
+                    self._build_redirect_headers(get_host(scope), path)),
+            })
+            await send({'type': 'http.response.body', 'body': b''})
+            return None
+
+        headers, names = self.headers[(
+            bool(hsts and not match_path(path, hsts.ignore_paths) and
+                 is_secure_scope(scope, self.hsts_proto_name)),
+            bool(csp and not match_path(path, csp.ignore_paths)),
+            bool(bundle and not match_path(path, bundle.ignore_paths)),
+        )]
+        if not headers:
+            return await self.app(scope, receive, send)
+
+        return await self.app(scope, receive, _wrap_send(send, headers, names))
+
+
+def _wrap_send(send, headers, names):
+    # type: (function, tuple, frozenset) -> function
+    """Returns send which appends headers into ``http.response.start``."""
+    async def _send(message):
+        if message['type'] == 'http.response.start':
+            response_headers = message.setdefault('headers', [])
+            if not isinstance(response_headers, list):
+                response_headers = message['headers'] = list(response_headers)
+
+            found = None
+            for name, _ in response_headers:
+                if name.lower() in names:
+                    found = (found or ()) + (name.lower(),)
+            if found is None:
+                response_headers.extend(headers)
+            else:  # ignore if already exists
+                response_headers.extend(
+                    h for h in headers if h[0] not in found)
+        await send(message)
+
+    return _send
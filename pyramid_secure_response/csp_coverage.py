@@ -1,11 +1,37 @@
+from collections import namedtuple
+from functools import partial
 import re
+from zlib import crc32
+
+from pyramid_secure_response.csp_hashes import (
+    hash_app_iter,
+    hash_inline_scripts,
+    merge_hash_sources,
+)
+from pyramid_secure_response.csp_nonce import find_csp_nonce
+from pyramid_secure_response.csp_override import (
+    apply_csp_overrides,
+    find_csp_override,
+)
+from pyramid_secure_response.secure_context import get_secure_context
 from pyramid_secure_response.util import (
+    LRUCache,
     logger,
-    apply_path_filter,
-    get_config,
+    load_config,
 )
 
 HEADER_KEY = 'Content-Security-Policy'
+REPORT_ONLY_HEADER_KEY = 'Content-Security-Policy-Report-Only'
+
+# options in csp_coverage
+NON_DIRECTIVES = (
+    'enabled',
+    'ignore_paths',
+    'minify',
+    'content_types',
+    'minimal_content_types',
+    'minimal_policy',
+)
 
 # MIME types
 # * https://developer.mozilla.org/en-US/docs/Web/HTTP/\
@@ -50,6 +76,23 @@ BOOLEAN_DIRECTIVES = (
     'block-all-mixed-content', 'upgrade-insecure-requests'
 )
 
+# characters which can not appear in a token (they separate directives or
+# policies in the header value)
+INVALID_TOKEN_CHARS = (';', ',')
+
+# nonce
+# `nonce` in directive values (e.g. `script_src = self nonce`) is rendered as
+# the 'nonce-...' source with a nonce generated per response.
+NONCE_TOKEN = 'nonce'
+NONCE_MARKER = '{nonce}'
+NONCE_SOURCE = "'nonce-{:s}'".format(NONCE_MARKER)
+
+# clients are hashed into buckets for sampling of report-only header
+SAMPLE_BUCKETS = 10000
+
+# precompiled header value as both str and latin-1 bytes
+CSPHeader = namedtuple('CSPHeader', ('value', 'encoded'))
+
 
 def _build_csp_header_value(directive, texts):
     """Creates CSP Header values for directive from texts.
@@ -64,6 +107,11 @@ def _build_csp_header_value(directive, texts):
         else:
             values = []
             for text in texts.split(' '):
+                if text == NONCE_TOKEN and \
+                   directive not in NO_QUOTE_DIRECTIVES:
+                    values.append(NONCE_SOURCE)
+                    continue
+
                 # schemes <scheme-source>, mime type <type>/<subtype> and
                 # sandbox <value> shouldn't be surrounded with single
                 # quotes
@@ -81,9 +129,9 @@ def _build_csp_header_value(directive, texts):
     return ''
 
 
-def build_csp_header(config):  # type: (Union[namedtuple, dict]) -> str
-    """Returns CSP Header values."""
-    policy_text = ''
+def _build_csp_policies(config):  # type: (Union[namedtuple, dict]) -> list
+    """Returns CSP Header values for each directive as list."""
+    policies = []
 
     config_dict = config
 
@@ -95,15 +143,357 @@ def build_csp_header(config):  # type: (Union[namedtuple, dict]) -> str
         raise ValueError
 
     for name in config_dict:
-        if name in ('enabled', 'ignore_paths'):  # not directive
+        if name in NON_DIRECTIVES:
             continue
 
         value = _build_csp_header_value(
             name.replace('_', '-'), str(config_dict[name]))
         if value:
-            policy_text += '; {:s}'.format(value)
+            policies.append(value)
+
+    return policies
+
+
+def _strip_nonce_source(value):  # type: (str) -> str
+    return value.replace(' ' + NONCE_SOURCE, '')
+
+
+def build_csp_header(config):  # type: (Union[namedtuple, dict]) -> str
+    """Returns CSP Header values (without the nonce source)."""
+    return _strip_nonce_source('; '.join(_build_csp_policies(config)))
 
-    return policy_text[2:]
+
+def _compile_csp_value(config):  # type: (Union[namedtuple, dict]) -> str
+    """Returns CSP Header value with the nonce marker after validation."""
+    policies = _build_csp_policies(config)
+    for policy in policies:
+        for token in policy.split(' '):
+            if any(c in token for c in INVALID_TOKEN_CHARS):
+                raise ValueError('invalid token {!r} in CSP'.format(token))
+
+    value = '; '.join(policies)
+    # UnicodeEncodeError (ValueError) is raised for non latin-1 value
+    value.encode('latin-1')
+    return value
+
+
+def compile_csp_header(config):  # type: (Union[namedtuple, dict]) -> tuple
+    """Returns CSPHeader contains precompiled CSP Header value.
+
+    This validates all tokens at once, then the value can be set to response
+    without any rebuild. The value does not contain the nonce source.
+
+    >>> compile_csp_header({'default_src': 'self'})
+    CSPHeader(value="default-src 'self'", encoded=b"default-src 'self'")
+    """
+    value = _strip_nonce_source(_compile_csp_value(config))
+    return CSPHeader(value, value.encode('latin-1'))
+
+
+def compile_csp_template(config):  # type: (Union[namedtuple, dict]) -> tuple
+    """Returns CSP Header value split at the nonce as tuple.
+
+    The template contains only a part if the nonce source is not used in the
+    config.
+
+    >>> compile_csp_template({'script_src': 'self nonce'})
+    ("script-src 'self' 'nonce-", "'")
+    """
+    return tuple(_compile_csp_value(config).split(NONCE_MARKER))
+
+
+def render_csp_header(template, nonce=None):  # type: (tuple, str) -> str
+    """Returns CSP Header value from the template.
+
+    The nonce is spliced into the template without any rebuild. If the nonce
+    is not given, the value does not contain the nonce source.
+    """
+    if nonce:
+        return nonce.join(template)
+    return _strip_nonce_source(NONCE_MARKER.join(template))
+
+
+def _set_hash_header(res, key, value, replace):
+    # type: (Response, str, str, bool) -> None
+    if replace:
+        res.headers[key] = value
+    else:  # as another report-only policy
+        res.headers.add(REPORT_ONLY_HEADER_KEY, value)
+
+
+def build_inline_hashes_f(directives, cache_size=256, report_only=False,
+                          enforce=False):
+    # type: (OrderedDict, int, bool, bool) -> function
+    """Returns function sets hash-sources of inline scripts in HTML response.
+
+    The body is hashed chunk by chunk. Headers can't be changed after the body
+    is started to be sent, so:
+
+    * buffered response (app_iter is list or tuple) has them in the header
+    * streamed response has hash-sources learned from the last response for
+      the same path in ``Content-Security-Policy-Report-Only`` header
+
+    If ``report_only`` is True, the directives are of the report-only policy,
+    and its header is replaced in both cases. Otherwise the policy with
+    hash-sources is added as another report-only policy, and it replaces the
+    enforced one for buffered response only if ``enforce`` is True.
+
+    NOTE: Rendered inline scripts include the injected ones (XSS), so that
+    enforcing their hash-sources allows them as ``'unsafe-inline'``.
+
+    Headers are cached by hash-sources, and learned hash-sources by path.
+    """
+    templates = LRUCache(cache_size)
+    learned = LRUCache(cache_size)
+    header_key = REPORT_ONLY_HEADER_KEY if report_only else HEADER_KEY
+
+    def _render(sources, nonce):  # type: (tuple, str) -> str
+        template = templates.get(sources)
+        if template is None:
+            template = templates[sources] = compile_csp_template(
+                merge_hash_sources(directives, sources, []))
+        return render_csp_header(template, nonce)
+
+    def _apply_inline_hashes(res, path, nonce=None):
+        # type: (Response, str, str) -> None
+        if res.content_type != 'text/html':
+            return
+
+        app_iter = res.app_iter
+        if isinstance(app_iter, (list, tuple)):
+            sources = tuple(hash_inline_scripts(app_iter))
+            if sources:
+                _set_hash_header(res, header_key, _render(sources, nonce),
+                                 replace=report_only or enforce)
+            return
+
+        sources = learned.get(path)
+        if sources:
+            _set_hash_header(res, header_key, _render(sources, nonce),
+                             replace=report_only)
+        res.app_iter = hash_app_iter(
+            app_iter, partial(learned.__setitem__, path))
+
+    return _apply_inline_hashes
+
+
+def _get_client_addr(environ):  # type: (dict) -> str
+    # the first one of X-Forwarded-For is the client (behind proxies)
+    forwarded = environ.get('HTTP_X_FORWARDED_FOR')
+    if forwarded:
+        return forwarded.split(',')[0].strip()
+    return environ.get('REMOTE_ADDR', '')
+
+
+def build_sample_f(rate, cookie_name=''):  # type: (float, str) -> function
+    """Returns function decides whether the client is in the sample.
+
+    Clients are hashed into `SAMPLE_BUCKETS` buckets by the value of the
+    cookie (or the client address if it's not given), so the decision is
+    stable for each client across requests and processes. Sampling is not a
+    security boundary, thus ``X-Forwarded-For`` is trusted.
+    """
+    threshold = int(round(rate * SAMPLE_BUCKETS))
+
+    def _is_sampled(req):  # type: (Request) -> bool
+        if threshold >= SAMPLE_BUCKETS:
+            return True
+        key = (cookie_name and req.cookies.get(cookie_name)) or \
+            _get_client_addr(req.environ)
+        bucket = (crc32(key.encode('utf-8')) & 0xffffffff) % SAMPLE_BUCKETS
+        return bucket < threshold
+
+    return _is_sampled
+
+
+def _build_header_f(key, directives, add=False):
+    # type: (str, OrderedDict, bool) -> Union[function, None]
+    """Returns function sets the precompiled header (or None if empty)."""
+    if not any(directives.values()):
+        return None
+
+    template = compile_csp_template(directives)
+    value = render_csp_header(template)
+    if not value:
+        return None
+
+    if len(template) == 1:  # without nonce
+        template = None
+
+    def _set_header(res, nonce):  # type: (Response, str) -> None
+        v = render_csp_header(template, nonce) if template and nonce \
+            else value
+        if add:
+            res.headers.add(key, v)
+        else:
+            res.headers[key] = v
+
+    return _set_header
+
+
+def _select_by_content_type(set_csp_header, config, is_sampled):
+    # type: (function, CSPCoverageConfig, function) -> function
+    content_types = config.content_types
+    # the minimal policy is set in the same mode (headers) as the full one
+    enforced = any(config.directives.values())
+    reported = any(config.report_only_directives.values())
+
+    def _set_csp_header(req, res, path):
+        # type: (Request, Response, str) -> None
+        policy = content_types.resolve(res.headers.get('Content-Type', ''))
+        if policy is True:
+            set_csp_header(req, res, path)
+        elif policy:  # minimal policy
+            if enforced:
+                res.headers[HEADER_KEY] = policy
+            if reported and is_sampled(req):
+                res.headers[REPORT_ONLY_HEADER_KEY] = policy
+
+    return _set_csp_header
+
+
+def _build_policy_f(config, directives, report_only_directives, is_sampled):
+    # type: (CSPCoverageConfig, OrderedDict, OrderedDict, function) -> function
+    """Returns function sets CSP Headers of the policy (or None if empty)."""
+    set_enforced = _build_header_f(HEADER_KEY, directives)
+    # added, because there may be the one with learned hash-sources
+    set_report_only = _build_header_f(
+        REPORT_ONLY_HEADER_KEY, report_only_directives,
+        add=set_enforced is not None)
+    if not (set_enforced or set_report_only):
+        return None
+
+    apply_inline_hashes = None
+    if config.hash_responses:
+        apply_inline_hashes = build_inline_hashes_f(
+            directives, report_only=False,
+            enforce=config.enforce_hash_responses) if set_enforced else \
+            build_inline_hashes_f(report_only_directives, report_only=True)
+
+    def _set_csp_header(req, res, path):
+        # type: (Request, Response, str) -> None
+        nonce = find_csp_nonce(req)
+        sampled = set_report_only is not None and is_sampled(req)
+        if set_enforced:
+            set_enforced(res, nonce)
+        if sampled:
+            set_report_only(res, nonce)
+        if apply_inline_hashes and (set_enforced or sampled):
+            apply_inline_hashes(res, path, nonce)
+
+    return _set_csp_header
+
+
+def _build_override_f(config, set_csp_header, is_sampled, cache_size=256):
+    # type: (CSPCoverageConfig, function, function, int) -> function
+    """Returns function applies ``request.csp`` (see `CSPOverride`).
+
+    The merged policies are memoized by the overrides per compiled policy, so
+    a view which has the same overrides costs only a lookup.
+    """
+    policy_fs = LRUCache(cache_size)
+
+    def _apply(directives, overrides):
+        # type: (OrderedDict, tuple) -> OrderedDict
+        # empty policy (e.g. enforced one in report_only mode) is kept
+        if not any(directives.values()):
+            return directives
+        return apply_csp_overrides(directives, overrides)
+
+    def _merge(overrides):  # type: (tuple) -> function
+        return _build_policy_f(
+            config,
+            _apply(config.directives, overrides),
+            _apply(config.report_only_directives, overrides),
+            is_sampled)
+
+    def _set_overridden_csp_header(req, res, path):
+        # type: (Request, Response, str) -> None
+        override = find_csp_override(req)
+        if not override:
+            set_csp_header(req, res, path)
+            return
+        key = override.key
+        set_policy = policy_fs.get(key)
+        if set_policy is None:
+            set_policy = policy_fs[key] = _merge(key)
+        set_policy(req, res, path)
+
+    return _set_overridden_csp_header
+
+
+def build_csp_header_f(config):  # type: (CSPCoverageConfig) -> function
+    """Returns function sets CSP Header into response (or None if empty).
+
+    If the nonce source is configured and ``request.csp_nonce`` is read by the
+    view (or template), the nonce is spliced into the header. Otherwise the
+    header without the nonce source is set.
+
+    The report-only policy (by ``csp_report_only.mode``) is set as
+    ``Content-Security-Policy-Report-Only`` only for the sampled clients (see
+    `build_sample_f`). Both headers are precompiled.
+
+    If ``csp_hashes.responses`` is enabled, the hash-sources of inline scripts
+    in HTML responses are also set (see `build_inline_hashes_f`), only into
+    the report-only policy unless ``csp_hashes.enforce_responses`` is enabled.
+
+    If the view overrides sources by ``request.csp`` (see `CSPOverride`), they
+    are merged into the copy of the policy.
+
+    If ``content_types`` (or ``minimal_content_types``) is configured, the
+    policy is selected by the Content-Type of response: the full one, the
+    minimal one (``minimal_policy``) or nothing (e.g. for static assets).
+    The minimal one is set in the same header(s) as the full one by the mode.
+    """
+    is_sampled = build_sample_f(config.sample_rate, config.sample_cookie)
+    set_csp_header = _build_policy_f(
+        config, config.directives, config.report_only_directives, is_sampled)
+    if set_csp_header is None:
+        return None
+
+    set_csp_header = _build_override_f(config, set_csp_header, is_sampled)
+    if config.content_types is None:
+        return set_csp_header
+    return _select_by_content_type(set_csp_header, config, is_sampled)
+
+
+def build_host_csp_header_fs(config):  # type: (Config) -> HostMap
+    """Returns HostMap of `build_csp_header_f` for ``host_policies``.
+
+    The value is None for the hosts which disable ``csp_coverage`` (or have
+    empty policy).
+    """
+    return config.host_policies.map(
+        lambda c: build_csp_header_f(c.csp_coverage)
+        if c.csp_coverage.enabled else None,
+        default=build_csp_header_f(config.csp_coverage))
+
+
+def build_csp_header_resolver(config):
+    # type: (Config) -> Union[function, None]
+    """Returns function returns `build_csp_header_f` (or None) for the host.
+
+    The function is looked up in ``policy_store`` and ``host_policies`` in
+    this order, and the global one is the fallback. Returns None if there is
+    no policy at all.
+    """
+    set_csp_header = build_csp_header_f(config.csp_coverage)
+    host_set_csp_headers = build_host_csp_header_fs(config) \
+        if config.host_policies else None
+    store = config.policy_store
+    if store is None:
+        if host_set_csp_headers:
+            return host_set_csp_headers.resolve
+        return (lambda _: set_csp_header) if set_csp_header else None
+
+    def _resolve(host):  # type: (str) -> Union[function, None]
+        policy = store.get(host)
+        if policy is not None:
+            return policy.set_csp_header
+        return host_set_csp_headers.resolve(host) \
+            if host_set_csp_headers else set_csp_header
+
+    return _resolve
 
 
 def tween(handler, registry):
@@ -114,31 +504,40 @@ def tween(handler, registry):
     * https://developer.mozilla.org/en-US/docs/Web/HTTP/CSP
     * https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/\
         Content-Security-Policy
-    """
-    config = get_config(registry)
 
+    See `build_csp_header_f` about the nonce and hash-sources. The policy can
+    be overridden per host (see `HostMap` and `PolicyStore`), and reloaded
+    from the policy file (see `PolicyWatcher`).
+    """
+    config = load_config(registry)
     csp_coverage = config.csp_coverage
+    if not csp_coverage.enabled:
+        return handler
+
+    ignore_paths = csp_coverage.ignore_paths
 
-    ignore_paths = config.ignore_paths
-    if csp_coverage.ignore_paths:
-        ignore_paths = csp_coverage.ignore_paths
+    # pylint: disable=import-outside-toplevel,cyclic-import
+    from pyramid_secure_response.policy_reload import get_policy_watcher
+
+    watcher = get_policy_watcher(registry)
+    resolve_header_f = watcher.resolve_csp_header_f if watcher else \
+        build_csp_header_resolver(config)
+    if resolve_header_f is None:
+        return handler
 
     tween_name = 'csp_coverage'
 
     def _csp_coverage_tween(req):
-        if not config.csp_coverage.enabled:
-            return handler(req)
-
-        if apply_path_filter(req, ignore_paths):
-            logger.info('(%s) Ignore path %s', tween_name, req.path)
+        ctx = get_secure_context(req)
+        if ctx.is_ignored(ignore_paths):
+            logger.info('(%s) Ignore path %s', tween_name, ctx.path)
             return handler(req)
 
         res = handler(req)
-        if HEADER_KEY not in res.headers:
+        set_header = resolve_header_f(ctx.host)
+        if set_header and HEADER_KEY not in res.headers:
             # ignore if already exists
-            header_value = build_csp_header(csp_coverage)
-            if header_value:
-                res.headers[HEADER_KEY] = header_value
+            set_header(req, res, ctx.path)
 
         return res
 
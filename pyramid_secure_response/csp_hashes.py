@@ -0,0 +1,305 @@
+from base64 import b64encode
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+
+from pyramid_secure_response.util import logger
+
+MANIFEST_VERSION = 1
+
+INLINE_SCRIPT_PATTERN = re.compile(
+    r'<script\b([^>]*)>(.*?)</script\s*>', re.IGNORECASE | re.DOTALL)
+INLINE_STYLE_PATTERN = re.compile(
+    r'<style\b([^>]*)>(.*?)</style\s*>', re.IGNORECASE | re.DOTALL)
+
+SRC_ATTRIBUTE_PATTERN = re.compile(r'\bsrc\s*=', re.IGNORECASE)
+
+# blocks which contain template expressions (of Chameleon, Mako, Jinja2 and
+# so on) are skipped, because those are changed at render time (TAL is in
+# attributes of tags, and e.g. `{total: 1}` in scripts is not an expression)
+TEMPLATE_EXPRESSIONS = ('${', '{{', '{%', '<%', '<?')
+
+DEFAULT_EXTENSIONS = ('.html', '.htm', '.pt', '.jinja2', '.mako')
+
+
+def build_hash_source(text):  # type: (str) -> str
+    """Returns 'sha256-...' hash-source of the text (in UTF-8).
+
+    >>> build_hash_source('alert(1);')
+    "'sha256-5jFwrAK0UV47oFbVg/iCCBbxD8X1w+QvoOUepu4C2YA='"
+    """
+    digest = hashlib.sha256(text.encode('utf-8')).digest()
+    return "'sha256-{:s}'".format(b64encode(digest).decode('ascii'))
+
+
+def _extract(pattern, html):  # type: (re.Pattern, str) -> list
+    sources = []
+    for attrs, body in pattern.findall(html):
+        if SRC_ATTRIBUTE_PATTERN.search(attrs) or not body.strip():
+            continue
+        if any(e in body for e in TEMPLATE_EXPRESSIONS):
+            logger.debug('(%s) Skip block with template expression: %.40r',
+                         'csp_hashes', body)
+            continue
+        sources.append(build_hash_source(body))
+    return sources
+
+
+def extract_hash_sources(html):  # type: (str) -> tuple
+    """Returns hash-sources of inline scripts and styles as 2 lists."""
+    return (_extract(INLINE_SCRIPT_PATTERN, html),
+            _extract(INLINE_STYLE_PATTERN, html))
+
+
+def scan_file(path):  # type: (str) -> tuple
+    """Returns (path, script sources, style sources) of the file.
+
+    This runs in the worker process.
+    """
+    try:
+        with open(path, 'rb') as f:
+            html = f.read().decode('utf-8')
+    except (IOError, OSError, UnicodeDecodeError) as e:
+        logger.warning('(%s) Skip %s: %s', 'csp_hashes', path, e)
+        return path, [], []
+    script, style = extract_hash_sources(html)
+    return path, script, style
+
+
+def find_files(dirs, extensions=DEFAULT_EXTENSIONS):
+    # type: (tuple, tuple) -> dict
+    """Returns files in dirs with their (mtime, size) as dict."""
+    files = {}
+    for d in dirs:
+        for root, _, names in os.walk(d):
+            for name in names:
+                if not name.endswith(tuple(extensions)):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files[path] = (stat.st_mtime, stat.st_size)
+    return files
+
+
+def load_manifest(path):  # type: (str) -> dict
+    """Returns cached entries in the manifest file (or empty dict)."""
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (IOError, OSError, ValueError) as e:
+        logger.warning('(%s) Broken manifest %s: %s', 'csp_hashes', path, e)
+        return {}
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    return manifest.get('files', {})
+
+
+def save_manifest(path, entries):  # type: (str, dict) -> None
+    """Writes entries into the manifest file atomically."""
+    tmp = '{:s}.{:d}.tmp'.format(path, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump({'version': MANIFEST_VERSION, 'files': entries}, f,
+                  indent=1, sort_keys=True)
+    os.rename(tmp, path)
+
+
+def scan(dirs, extensions=DEFAULT_EXTENSIONS, manifest='', workers=None):
+    # type: (tuple, tuple, str, int) -> tuple
+    """Returns hash-sources of inline scripts and styles in dirs.
+
+    The inline ``<script>`` and ``<style>`` blocks in files are scanned at
+    startup, and their ``'sha256-...'`` sources are merged into ``script-src``
+    and ``style-src`` of csp_coverage.
+
+    Only files which are changed (by mtime and size) from the manifest are
+    scanned by the process pool, then the manifest is updated. So restarts of
+    workers don't rescan unchanged files.
+    """
+    files = find_files(dirs, extensions)
+    cached = load_manifest(manifest)
+
+    entries = {}
+    changed = []
+    for path, (mtime, size) in files.items():
+        entry = cached.get(path)
+        if entry and entry['mtime'] == mtime and entry['size'] == size:
+            entries[path] = entry
+        else:
+            changed.append(path)
+
+    if changed:
+        workers = workers or multiprocessing.cpu_count()
+        if workers > 1 and len(changed) > 1:
+            pool = multiprocessing.Pool(min(workers, len(changed)))
+            try:
+                results = pool.map(scan_file, sorted(changed))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [scan_file(p) for p in sorted(changed)]
+
+        for path, script, style in results:
+            mtime, size = files[path]
+            entries[path] = {
+                'mtime': mtime, 'size': size,
+                'script': script, 'style': style,
+            }
+
+    if manifest and (changed or len(entries) != len(cached)):
+        save_manifest(manifest, entries)
+
+    script_sources, style_sources = [], []
+    for path in sorted(entries):
+        script_sources.extend(entries[path]['script'])
+        style_sources.extend(entries[path]['style'])
+    return _unique(script_sources), _unique(style_sources)
+
+
+def _unique(values):  # type: (list) -> list
+    seen = set()
+    return [v for v in values if not (v in seen or seen.add(v))]
+
+
+class InlineScriptHasher(object):
+    """Incremental tokenizer hashes inline scripts in HTML chunks.
+
+    Chunks (bytes in UTF-8) are fed as they are streamed, and the contents of
+    inline ``<script>`` elements are hashed chunk by chunk. Only a tail of the
+    chunk (which may contain a tag split across chunks) is kept, so the memory
+    is bounded regardless of the size of the body.
+
+    >>> hasher = InlineScriptHasher()
+    >>> hasher.feed(b'<p>a</p><scr')
+    >>> hasher.feed(b'ipt>alert(1);</sc')
+    >>> hasher.feed(b'ript>')
+    >>> hasher.close()
+    ["'sha256-5jFwrAK0UV47oFbVg/iCCBbxD8X1w+QvoOUepu4C2YA='"]
+    """
+
+    OPEN_TAG_PATTERN = re.compile(br'<script(?=[\s/>])', re.IGNORECASE)
+    CLOSE_TAG_PATTERN = re.compile(br'</script', re.IGNORECASE)
+    SRC_ATTRIBUTE_PATTERN = re.compile(br'\bsrc\s*=', re.IGNORECASE)
+
+    # open tags longer than this are skipped
+    MAX_TAG_SIZE = 1024
+
+    __slots__ = ('sources', '_buffer', '_digest', '_size')
+
+    def __init__(self):
+        self.sources = []
+
+        self._buffer = b''
+        self._digest = None  # in script if not None
+        self._size = 0
+
+    def feed(self, chunk):  # type: (bytes) -> None
+        buf = self._buffer + chunk if self._buffer else chunk
+        self._buffer = b''
+        pos, size = 0, len(buf)
+        while pos < size:
+            if self._digest is None:
+                pos = self._feed_text(buf, pos)
+            else:
+                pos = self._feed_script(buf, pos)
+
+    def _feed_text(self, buf, pos):  # type: (bytes, int) -> int
+        m = self.OPEN_TAG_PATTERN.search(buf, pos)
+        if m is None:
+            # keep a part of the open tag at the end
+            self._buffer = buf[max(pos, len(buf) - len(b'<script')):]
+            return len(buf)
+
+        end = buf.find(b'>', m.end())
+        if end == -1:
+            if len(buf) - m.start() > self.MAX_TAG_SIZE:
+                return m.end()  # skip
+            self._buffer = buf[m.start():]
+            return len(buf)
+
+        if self.SRC_ATTRIBUTE_PATTERN.search(buf, m.end(), end):
+            # external script is not hashed (but its content is skipped)
+            self._digest = False
+        else:
+            self._digest = hashlib.sha256()
+            self._size = 0
+        return end + 1
+
+    def _feed_script(self, buf, pos):  # type: (bytes, int) -> int
+        m = self.CLOSE_TAG_PATTERN.search(buf, pos)
+        if m is None:
+            # keep a part of the close tag at the end
+            keep = max(pos, len(buf) - len(b'</script'))
+            self._update(buf[pos:keep])
+            self._buffer = buf[keep:]
+            return len(buf)
+
+        self._update(buf[pos:m.start()])
+        if self._digest and self._size:
+            self.sources.append("'sha256-{:s}'".format(
+                b64encode(self._digest.digest()).decode('ascii')))
+        self._digest = None
+        return m.end()
+
+    def _update(self, data):  # type: (bytes) -> None
+        if self._digest and data:
+            self._digest.update(data)
+            self._size += len(data)
+
+    def close(self):  # type: () -> list
+        """Returns hash-sources of inline scripts (unclosed one is ignored)."""
+        self._buffer = b''
+        self._digest = None
+        return _unique(self.sources)
+
+
+def hash_inline_scripts(chunks):  # type: (Iterable) -> list
+    """Returns hash-sources of inline scripts in chunks."""
+    hasher = InlineScriptHasher()
+    for chunk in chunks:
+        hasher.feed(chunk)
+    return hasher.close()
+
+
+def hash_app_iter(app_iter, callback):  # type: (Iterable, function) -> None
+    """Yields chunks of app_iter as they are, with hashing inline scripts.
+
+    The callback is called with hash-sources (tuple) after all chunks are
+    yielded.
+    """
+    hasher = InlineScriptHasher()
+    try:
+        for chunk in app_iter:
+            hasher.feed(chunk)
+            yield chunk
+        callback(tuple(hasher.close()))
+    finally:
+        if hasattr(app_iter, 'close'):
+            app_iter.close()
+
+
+def merge_hash_sources(directives, script_sources, style_sources):
+    # type: (OrderedDict, list, list) -> OrderedDict
+    """Appends hash-sources to script_src and style_src of directives.
+
+    If the directive is not set, the value of default_src is used as its base
+    to keep the policy. If both are not set, there is no restriction, then
+    nothing is appended.
+    """
+    directives = directives.copy()
+    for name, sources in (('script_src', script_sources),
+                          ('style_src', style_sources)):
+        base = directives.get(name) or directives.get('default_src')
+        if not (base and sources):
+            continue
+        # 'none' can't be combined with other sources
+        tokens = [t for t in str(base).split(' ') if t not in ('none', '')]
+        directives[name] = ' '.join(tokens + list(sources))
+    return directives
@@ -0,0 +1,197 @@
+from collections import namedtuple, OrderedDict
+
+from pyramid_secure_response.csp_coverage import (
+    BOOLEAN_DIRECTIVES,
+    NONCE_TOKEN,
+    build_csp_header,
+)
+from pyramid_secure_response.util import FETCH_FALLBACKS
+
+# directives which have no effect in browsers (obsolete)
+OBSOLETE_DIRECTIVES = ('plugin_types', 'referrer')
+
+# directives which are ignored in Content-Security-Policy-Report-Only
+NON_REPORT_ONLY_DIRECTIVES = ('sandbox',)
+
+# keywords (without quotes) ignored in some cases
+NONE_KEYWORD = 'none'
+UNSAFE_INLINE_KEYWORD = 'unsafe-inline'
+STRICT_DYNAMIC_KEYWORD = 'strict-dynamic'
+
+# bytes of the header value before and after minification, and warnings
+MinifyReport = namedtuple('MinifyReport', ('before', 'after', 'warnings'))
+
+
+def _key(token):  # type: (str) -> str
+    # keywords may be given with or without quotes (hashes are case-sensitive)
+    return token.strip("'")
+
+
+def _is_nonce_or_hash(token):  # type: (str) -> bool
+    key = _key(token).lower()
+    return key == NONCE_TOKEN or key.startswith(
+        ('nonce-', 'sha256-', 'sha384-', 'sha512-'))
+
+
+def _is_host_or_scheme(token):  # type: (str) -> bool
+    return ':' in token and not _is_nonce_or_hash(token)
+
+
+def _scheme_of(token):  # type: (str) -> str
+    # `https://cdn.example.org` -> `https:` (`https:` itself -> '')
+    head, sep, _ = token.partition('://')
+    return '{:s}:'.format(head.lower()) if sep else ''
+
+
+def _minify_sources(name, sources, warnings):
+    # type: (str, list, list) -> list
+    """Returns sources without duplicates and subsumed ones."""
+    seen = set()
+    result = []
+    for token in sources:
+        key = _key(token)
+        if key not in seen:
+            seen.add(key)
+            result.append(token)
+
+    # host sources are covered by the scheme source (e.g. `https:`)
+    schemes = set(t.lower() for t in result if t.endswith(':'))
+    result = [t for t in result if _scheme_of(t) not in schemes]
+
+    if NONE_KEYWORD in seen and len(result) > 1:
+        warnings.append("'none' in {:s} is ignored with other sources".format(
+            name))
+        result = [t for t in result if _key(t) != NONE_KEYWORD]
+    return result
+
+
+def _warn_ignored_sources(name, sources, warnings):
+    # type: (str, list, list) -> None
+    """Warns sources ignored by CSP Level 2+ browsers.
+
+    These are kept, because they are fallbacks for old browsers.
+    """
+    if name not in ('script_src', 'style_src', 'default_src'):
+        return
+
+    keys = set(_key(t) for t in sources)
+    if UNSAFE_INLINE_KEYWORD in keys and any(map(_is_nonce_or_hash, sources)):
+        warnings.append(
+            "'unsafe-inline' in {:s} is ignored with nonce or hash".format(
+                name))
+    if STRICT_DYNAMIC_KEYWORD in keys and \
+       any(map(_is_host_or_scheme, sources)):
+        warnings.append(
+            "host and scheme sources in {:s} are ignored with "
+            "'strict-dynamic'".format(name))
+
+
+def _warn_ignored_directives(directives, report_only, warnings):
+    # type: (OrderedDict, bool, list) -> None
+    """Warns directives which have no effect.
+
+    These are kept as well as ignored sources.
+    """
+    for name, value in directives.items():
+        if not value:
+            continue
+        if name in OBSOLETE_DIRECTIVES:
+            warnings.append('{:s} has no effect (obsolete)'.format(name))
+        elif report_only and name in NON_REPORT_ONLY_DIRECTIVES:
+            warnings.append('{:s} has no effect in report-only policy'.format(
+                name))
+
+
+def _effective(sources, name):  # type: (dict, str) -> frozenset
+    # returns None if the fetch directive is not restricted
+    for n in (name,) + FETCH_FALLBACKS[name]:
+        if n in sources:
+            return sources[n]
+    return None
+
+
+def _remove_redundant_fetch_directives(sources, warnings):
+    # type: (OrderedDict, list) -> None
+    """Removes fetch directives which are same as their fallbacks.
+
+    A directive is removed only if the effective sources of every fetch
+    directive are unchanged. ``default-src`` is never added (nor changed),
+    because browsers have also fetch directives which are not modelled here
+    (e.g. ``fenced-frame-src``), and they fall back to it.
+    """
+    def _snapshot(s):
+        return dict((n, _effective(s, n)) for n in FETCH_FALLBACKS)
+
+    sets = OrderedDict(
+        (n, frozenset(map(_key, v))) for n, v in sources.items()
+        if n in FETCH_FALLBACKS or n == 'default_src')
+    expected = _snapshot(sets)
+
+    for name in list(sets):
+        if name == 'default_src':
+            continue
+        candidate = OrderedDict((n, v) for n, v in sets.items() if n != name)
+        if _snapshot(candidate) == expected:
+            del sets[name]
+            del sources[name]
+            warnings.append('{:s} is same as its fallback'.format(name))
+
+
+def minify_csp_directives(directives, report_only=False):
+    # type: (OrderedDict, bool) -> Tuple[OrderedDict, MinifyReport]
+    """Returns semantically equivalent but smaller directives with report.
+
+    * duplicate sources are removed
+    * host sources are removed if the scheme source (e.g. ``https:``) exists
+    * ``'none'`` with other sources is removed
+    * fetch directives same as their fallbacks (e.g. ``default-src``) are
+      removed
+
+    Sources and directives which have no effect (e.g. obsolete ones, or
+    ``sandbox`` in the report-only policy) are kept, but warned in report.
+
+    >>> d, report = minify_csp_directives(OrderedDict((
+    ...     ('img_src', 'self https: https://cdn.example.org self'),
+    ...     ('script_src', 'self'), ('default_src', 'self'))))
+    >>> d
+    OrderedDict([('img_src', 'self https:'), ('default_src', 'self')])
+    >>> report.before - report.after
+    50
+    """
+    warnings = []
+    fetch = OrderedDict()
+    others = OrderedDict()
+    for name, value in directives.items():
+        if name.replace('_', '-') in BOOLEAN_DIRECTIVES or not value:
+            others[name] = value
+            continue
+
+        sources = _minify_sources(name, str(value).split(), warnings)
+        _warn_ignored_sources(name, sources, warnings)
+        if name in FETCH_FALLBACKS or name == 'default_src':
+            fetch[name] = sources
+        else:
+            others[name] = ' '.join(sources)
+
+    _warn_ignored_directives(directives, report_only, warnings)
+    _remove_redundant_fetch_directives(fetch, warnings)
+
+    block_all_mixed_content = directives.get('block_all_mixed_content')
+    if str(block_all_mixed_content).lower() == 'true' and \
+       str(directives.get('upgrade_insecure_requests')).lower() == 'true':
+        warnings.append('block-all-mixed-content is ignored with '
+                        'upgrade-insecure-requests')
+        others['block_all_mixed_content'] = False
+
+    minified = OrderedDict()
+    for name in directives:
+        if name in fetch:
+            minified[name] = ' '.join(fetch[name])
+        elif name in others:
+            minified[name] = others[name]
+    if 'default_src' in fetch and 'default_src' not in minified:
+        minified['default_src'] = ' '.join(fetch['default_src'])
+
+    report = MinifyReport(len(build_csp_header(directives)),
+                          len(build_csp_header(minified)), warnings)
+    return minified, report
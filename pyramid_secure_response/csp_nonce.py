@@ -0,0 +1,101 @@
+from base64 import b64encode
+from collections import deque
+import os
+
+# attribute name of the request
+ATTR_NAME = 'csp_nonce'
+
+# bytes of a nonce (128 bits, it's encoded as 24 chars in base64)
+NONCE_SIZE = 16
+
+# nonces per os.urandom() read
+BATCH_SIZE = 256
+
+
+class NoncePool(object):
+    """Pool of random nonces encoded in base64.
+
+    The pool is refilled with a large `os.urandom()` read for a batch of
+    nonces, instead of a read per request. A nonce is never returned twice.
+    (`deque.popleft()` is atomic, and a nonce lives only in a pool)
+
+    The pool is cleared in the child after `os.fork()` (if supported), so
+    that workers don't share the same nonces.
+    """
+
+    def __init__(self, nonce_size=NONCE_SIZE, batch_size=BATCH_SIZE):
+        # type: (int, int) -> None
+        self.nonce_size = nonce_size
+        self.batch_size = batch_size
+
+        self._nonces = deque()
+
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(  # pylint: disable=no-member
+                after_in_child=self.clear)
+
+    def __len__(self):  # type: () -> int
+        return len(self._nonces)
+
+    def clear(self):  # type: () -> None
+        self._nonces.clear()
+
+    def refill(self):  # type: () -> None
+        size = self.nonce_size
+        data = os.urandom(size * self.batch_size)
+        self._nonces.extend(
+            b64encode(data[i:i + size]).decode('ascii')
+            for i in range(0, len(data), size))
+
+    def get(self):  # type: () -> str
+        """Returns a new nonce."""
+        while True:
+            try:
+                return self._nonces.popleft()
+            except IndexError:
+                self.refill()
+
+
+_pool = NoncePool()  # pylint: disable=invalid-name
+
+
+def generate_nonce():  # type: () -> str
+    """Returns a new nonce from the shared pool."""
+    return _pool.get()
+
+
+def find_csp_nonce(req):  # type: (Request) -> Union[str, None]
+    """Returns the nonce of the request only if it's already generated.
+
+    This does not generate a nonce, then tweens can tell whether the nonce is
+    used by the view (or template) or not.
+    """
+    return vars(req).get(ATTR_NAME)
+
+
+def get_csp_nonce(req):  # type: (Request) -> str
+    """Returns the nonce of the request.
+
+    If ``request.csp_nonce`` is not available (e.g. tweens are added without
+    ``config.include()``), it's generated and set to the request.
+    """
+    try:
+        return getattr(req, ATTR_NAME)
+    except AttributeError:
+        nonce = generate_nonce()
+        setattr(req, ATTR_NAME, nonce)
+        return nonce
+
+
+def csp_nonce(request):  # type: (Request) -> str
+    """Generates a nonce for the request.
+
+    This is added as ``request.csp_nonce`` (reified) by ``config.include()``.
+    The nonce is generated at the first access, and set into the
+    ``'nonce-...'`` source of Content-Security-Policy Header by the tween.
+
+    .. code:: html
+
+        <script nonce="${request.csp_nonce}">...</script>
+    """
+    return generate_nonce()
@@ -0,0 +1,209 @@
+from pyramid_secure_response.util import (
+    CSP_DIRECTIVES,
+    FETCH_FALLBACKS,
+)
+
+# attribute name of the request
+ATTR_NAME = 'csp'
+
+# directives which take sources (boolean ones can't be overridden)
+SOURCE_DIRECTIVES = tuple(
+    name for name, default in CSP_DIRECTIVES if not isinstance(default, bool))
+
+# non-fetch directives which can be 'none'
+NONE_DIRECTIVES = ('base_uri', 'form_action', 'frame_ancestors')
+
+# view options (see `csp_view_deriver`)
+VIEW_OPTIONS = ('csp_add', 'csp_remove')
+
+OP_ADD = '+'
+OP_REMOVE = '-'
+
+
+def _build_op(op, directive, sources):
+    # type: (str, str, Union[str, tuple]) -> tuple
+    name = directive.replace('-', '_')
+    if name not in SOURCE_DIRECTIVES:
+        raise ValueError('unknown directive {!r}'.format(directive))
+
+    tokens = []
+    for source in sources:
+        tokens.extend(str(source).split())
+    for token in tokens:
+        if ';' in token or ',' in token:
+            raise ValueError('invalid token {!r} in CSP'.format(token))
+    if not tokens:
+        raise ValueError('no sources for {!r}'.format(directive))
+    return (op, name, tuple(tokens))
+
+
+def build_csp_overrides(add=None, remove=None):  # type: (dict, dict) -> tuple
+    """Returns overrides as tuple of (op, directive, sources).
+
+    The values of ``add`` and ``remove`` are sources in the same form of the
+    settings (e.g. ``{'connect_src': 'https://api.example.org'}``). Raises
+    ValueError for unknown directive or invalid source.
+    """
+    overrides = []
+    for op, directives in ((OP_ADD, add), (OP_REMOVE, remove)):
+        for directive, sources in sorted((directives or {}).items()):
+            if hasattr(sources, 'split'):
+                sources = (sources,)
+            overrides.append(_build_op(op, directive, sources))
+    return tuple(overrides)
+
+
+def _fetch_base(directives, name):  # type: (OrderedDict, str) -> str
+    # the value of the first one set in the fallback list (or '')
+    for n in (name,) + FETCH_FALLBACKS.get(name, ()):
+        if directives.get(n):
+            return directives[n]
+    return ''
+
+
+def apply_csp_overrides(directives, overrides):
+    # type: (OrderedDict, tuple) -> OrderedDict
+    """Returns copy of directives which the overrides are applied.
+
+    If a fetch directive is not set, the value of its fallback (e.g.
+    ``child_src`` then ``default_src`` for ``frame_src``) is used as its base.
+    If none of them is set, there is no restriction, then nothing is changed.
+    Other directives (e.g. ``frame_ancestors``) have only the added sources if
+    not set.
+
+    The fetch directive (or ``base_uri``, ``form_action`` and
+    ``frame_ancestors``) which all sources are removed from is set to
+    ``none``, and other ones (e.g. ``sandbox``) are kept unchanged, because
+    they can't be empty.
+    """
+    directives = directives.copy()
+    for op, name, sources in overrides:
+        is_fetch = name in FETCH_FALLBACKS or name == 'default_src'
+        base = _fetch_base(directives, name) if is_fetch else \
+            directives.get(name)
+        if not base and (is_fetch or op == OP_REMOVE):
+            continue
+        tokens = [t for t in str(base or '').split(' ')
+                  if t not in ('none', '')]
+        if op == OP_ADD:
+            tokens.extend(s for s in sources if s not in tokens)
+        else:
+            tokens = [t for t in tokens if t not in sources]
+        if tokens:
+            directives[name] = ' '.join(tokens)
+        elif is_fetch or name in NONE_DIRECTIVES:
+            directives[name] = 'none'
+    return directives
+
+
+class CSPOverride(object):
+    """Overrides of Content-Security-Policy for a response.
+
+    This is ``request.csp``. The view adds (or removes) sources to the
+    compiled policy, which is never changed (copy-on-write).
+
+    >>> request.csp.add('connect_src', 'https://api.example.org')
+    >>> request.csp.remove('script_src', 'unsafe-inline')
+
+    Only the overrides are recorded, and the tween merges them into the
+    policy. Merged policies are memoized by the overrides (see
+    `build_csp_header_f`), so the same overrides aren't merged twice.
+    """
+
+    __slots__ = ('_overrides',)
+
+    def __init__(self):  # type: () -> None
+        self._overrides = ()
+
+    def __len__(self):  # type: () -> int
+        return len(self._overrides)
+
+    @property
+    def key(self):  # type: () -> tuple
+        """Returns the overrides as tuple of (op, directive, sources)."""
+        return self._overrides
+
+    def add(self, directive, *sources):  # type: (str, *str) -> None
+        """Adds sources to the directive."""
+        self._overrides += (_build_op(OP_ADD, directive, sources),)
+
+    def remove(self, directive, *sources):  # type: (str, *str) -> None
+        """Removes sources from the directive."""
+        self._overrides += (_build_op(OP_REMOVE, directive, sources),)
+
+    def extend(self, overrides):  # type: (tuple) -> None
+        """Appends the overrides built by `build_csp_overrides`."""
+        self._overrides += overrides
+
+
+def find_csp_override(req):  # type: (Request) -> Union[CSPOverride, None]
+    """Returns the overrides of the request only if it's already created."""
+    return vars(req).get(ATTR_NAME)
+
+
+def get_csp_override(req):  # type: (Request) -> CSPOverride
+    """Returns the overrides of the request.
+
+    If ``request.csp`` is not available (e.g. tweens are added without
+    ``config.include()``), it's created and set to the request.
+    """
+    try:
+        return getattr(req, ATTR_NAME)
+    except AttributeError:
+        override = CSPOverride()
+        setattr(req, ATTR_NAME, override)
+        return override
+
+
+def csp(request):  # type: (Request) -> CSPOverride
+    """Creates the overrides for the request.
+
+    This is added as ``request.csp`` (reified) by ``config.include()``.
+    """
+    return CSPOverride()
+
+
+def csp_override(add=None, remove=None):  # type: (dict, dict) -> function
+    """Returns view decorator which overrides CSP of the response.
+
+    .. code:: python
+
+        @view_config(route_name='chat', decorator=csp_override(
+            add={'connect_src': 'https://chat.example.org'}))
+        def chat(request):
+            ...
+    """
+    overrides = build_csp_overrides(add, remove)
+
+    def _decorator(view):  # type: (function) -> function
+        if not overrides:
+            return view
+
+        def _view(context, request):
+            get_csp_override(request).extend(overrides)
+            return view(context, request)
+
+        return _view
+
+    return _decorator
+
+
+def csp_view_deriver(view, info):
+    # type: (function, ViewDeriverInfo) -> function
+    """Applies ``csp_add`` and ``csp_remove`` options of view.
+
+    This is added by ``config.include()``.
+
+    .. code:: python
+
+        @view_config(route_name='chat',
+                     csp_add={'connect_src': 'https://chat.example.org'})
+        def chat(request):
+            ...
+    """
+    options = info.options
+    return csp_override(
+        add=options.get('csp_add'), remove=options.get('csp_remove'))(view)
+
+
+csp_view_deriver.options = VIEW_OPTIONS
@@ -0,0 +1,262 @@
+import json
+import os
+import threading
+import time
+
+try:
+    from queue import Empty, Full, Queue
+except ImportError:  # Python 2.7
+    from Queue import Empty, Full, Queue
+
+from pyramid.response import Response
+
+from pyramid_secure_response.csp_rollup import ReportAggregator
+from pyramid_secure_response.csp_store import ReportStore
+from pyramid_secure_response.util import (
+    load_config,
+    logger,
+)
+
+# content types of reports
+CSP_REPORT_TYPE = 'application/csp-report'
+REPORTS_TYPE = 'application/reports+json'
+
+# fields of report (application/csp-report, application/reports+json)
+REPORT_FIELDS = (
+    ('document_uri', 'document-uri', 'documentURL'),
+    ('referrer', 'referrer', 'referrer'),
+    ('violated_directive', 'violated-directive', 'effectiveDirective'),
+    ('effective_directive', 'effective-directive', 'effectiveDirective'),
+    ('blocked_uri', 'blocked-uri', 'blockedURL'),
+    ('source_file', 'source-file', 'sourceFile'),
+    ('line_number', 'line-number', 'lineNumber'),
+    ('disposition', 'disposition', 'disposition'),
+)
+
+
+def _normalize(body, index):  # type: (dict, int) -> dict
+    if not isinstance(body, dict):
+        raise ValueError('invalid report')
+    report = {}
+    for field in REPORT_FIELDS:
+        value = body.get(field[index])
+        if value is not None:
+            report[field[0]] = value
+    return report
+
+
+def parse_reports(body, content_type):  # type: (bytes, str) -> list
+    """Returns normalized reports in the body as list.
+
+    Raises ValueError for invalid body.
+
+    >>> parse_reports(b'{"csp-report": {"blocked-uri": "inline"}}',
+    ...               'application/csp-report')
+    [{'blocked_uri': 'inline'}]
+    """
+    data = json.loads(body.decode('utf-8'))
+    if content_type == CSP_REPORT_TYPE:
+        if not isinstance(data, dict):
+            raise ValueError('invalid report')
+        return [_normalize(data.get('csp-report'), 1)]
+
+    if content_type == REPORTS_TYPE:
+        if not isinstance(data, list):
+            raise ValueError('invalid reports')
+        return [_normalize(r.get('body'), 2) for r in data
+                if isinstance(r, dict) and r.get('type') == 'csp-violation']
+
+    raise ValueError('unknown content type {!r}'.format(content_type))
+
+
+class SpoolFile(object):  # pylint: disable=too-few-public-methods
+    """Sink appends reports into the file as JSON lines."""
+
+    def __init__(self, path):  # type: (str) -> None
+        self.path = path
+
+    def __call__(self, reports):  # type: (list) -> None
+        data = ''.join(json.dumps(r, sort_keys=True) + '\n' for r in reports)
+        # a write in append mode is not interleaved by other processes
+        with open(self.path, 'a') as f:
+            f.write(data)
+
+
+class ReportQueue(object):
+    """Bounded queue of reports written by a background thread in batches.
+
+    `put()` never blocks. If the queue is full, the report is dropped (and
+    counted). The thread is started at the first `put()` in each process, so
+    it works with prefork servers.
+
+    If the sink has ``tick()`` and ``flush()`` (e.g. `ReportAggregator`),
+    they are called after each wait for a batch and at stop.
+    """
+
+    def __init__(self, sink, maxsize=10000, batch_size=500, interval=1.0):
+        # type: (function, int, int, float) -> None
+        self.sink = sink
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.interval = interval
+
+        self.dropped = 0
+
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):  # type: () -> None
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # queue and thread of the parent are not usable after fork
+            self._queue = Queue(self.maxsize)
+            self._thread = threading.Thread(
+                target=self._run, args=(self._queue,),
+                name='pyramid_secure_response.csp_report')
+            self._thread.daemon = True
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def put(self, report):  # type: (dict) -> bool
+        """Enqueues the report. Returns False if it's dropped."""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(report)
+            return True
+        except Full:
+            self.dropped += 1
+            return False
+
+    def stop(self, timeout=None):  # type: (float) -> None
+        """Writes remaining reports, and stops the thread."""
+        if self._pid != os.getpid():
+            return
+        self._queue.put(None)  # sentinel
+        self._thread.join(timeout)
+        self._pid = None
+
+    def _run(self, queue):  # type: (Queue) -> None
+        tick = getattr(self.sink, 'tick', None)
+        running = True
+        while running:
+            batch = []
+            deadline = time.time() + self.interval
+            while len(batch) < self.batch_size:
+                try:
+                    report = queue.get(
+                        timeout=max(0, deadline - time.time()))
+                except Empty:
+                    break
+                if report is None:
+                    running = False
+                    break
+                batch.append(report)
+
+            if batch:
+                self._write(batch)
+            elif tick:
+                tick()
+
+        flush = getattr(self.sink, 'flush', None)
+        if flush:
+            flush()
+
+    def _write(self, batch):  # type: (list) -> None
+        try:
+            self.sink(batch)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception('(%s) Failed to write %d reports',
+                             'csp_report', len(batch))
+
+
+def get_report_queue(registry):  # type: (Registry) -> ReportQueue
+    """Returns ReportQueue which is cached on registry (per config)."""
+    report_config = load_config(registry).csp_report
+    cached = getattr(registry, '_pyramid_secure_response_report_queue', None)
+    if cached is not None and cached[0] is report_config:
+        return cached[1]
+
+    if report_config.store:
+        sink = ReportStore(report_config.store,
+                           retention=report_config.retention or None)
+    else:
+        sink = SpoolFile(report_config.spool)
+    if report_config.rollup:
+        sink = ReportAggregator(sink, maxsize=report_config.rollup_size,
+                                interval=report_config.rollup_interval)
+
+    queue = ReportQueue(
+        sink,
+        maxsize=report_config.queue_size,
+        batch_size=report_config.batch_size,
+        interval=report_config.interval)
+    # pylint: disable=protected-access
+    registry._pyramid_secure_response_report_queue = (report_config, queue)
+    return queue
+
+
+def get_report_aggregator(registry):
+    # type: (Registry) -> Union[ReportAggregator, None]
+    """Returns ReportAggregator if ``csp_report.rollup`` is enabled.
+
+    >>> get_report_aggregator(request.registry).top(3)  # doctest: +SKIP
+    [('script-src-elem', 1200), ('img-src', 31), ('style-src', 4)]
+    """
+    sink = get_report_queue(registry).sink
+    return sink if isinstance(sink, ReportAggregator) else None
+
+
+def csp_report_view(request):  # type: (Request) -> Response
+    """Receives CSP violation reports.
+
+    Responds 204 also if the queue is full (reports are dropped), so that
+    report storms don't block the request threads.
+    """
+    report_config = load_config(request.registry).csp_report
+
+    content_type = request.content_type
+    if content_type not in (CSP_REPORT_TYPE, REPORTS_TYPE):
+        return Response(status=415)
+
+    max_size = report_config.max_body_size
+    if (request.content_length or 0) > max_size:
+        return Response(status=413)
+    body = request.body_file.read(max_size + 1)
+    if len(body) > max_size:
+        return Response(status=413)
+
+    try:
+        reports = parse_reports(body, content_type)
+    except (ValueError, AttributeError):
+        return Response(status=400)
+
+    queue = get_report_queue(request.registry)
+    now = int(time.time())
+    for report in reports:
+        report['time'] = now
+        if not queue.put(report):
+            break  # shed load
+
+    return Response(status=204)
+
+
+def includeme(config):
+    """Adds the view receives CSP violation reports at ``csp_report.path``.
+
+    >>> config.include('pyramid_secure_response.csp_report')
+
+    Set the path to ``csp_coverage.report_uri`` (or ``report_to``).
+    """
+    report_config = load_config(config.registry).csp_report
+    if not (report_config.spool or report_config.store):
+        raise ValueError('csp_report.spool or csp_report.store is required')
+
+    route_name = '{:s}.csp_report'.format(__name__.split('.')[0])
+    config.add_route(route_name, report_config.path)
+    config.add_view(csp_report_view, route_name=route_name,
+                    request_method='POST', require_csrf=False)
@@ -0,0 +1,192 @@
+from collections import OrderedDict
+import threading
+import time
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:  # Python 2.7
+    from urlparse import urlsplit
+
+from pyramid_secure_response.util import logger
+
+# fields of fingerprint
+FINGERPRINT_FIELDS = ('directive', 'blocked_uri', 'document_path')
+
+# max length of each normalized field
+MAX_FIELD_SIZE = 256
+
+
+def _truncate(value):  # type: (str) -> str
+    return value[:MAX_FIELD_SIZE]
+
+
+def fingerprint(report):  # type: (dict) -> tuple
+    """Returns normalized (directive, blocked uri, document path) of report.
+
+    >>> fingerprint({
+    ...     'violated_directive': "script-src-elem 'self'",
+    ...     'blocked_uri': 'https://cdn.example.org/a.js?v=1',
+    ...     'document_uri': 'https://example.org/users/1?tab=a',
+    ... })
+    ('script-src-elem', 'https://cdn.example.org', '/users/1')
+    """
+    directive = str(report.get('effective_directive') or
+                    report.get('violated_directive') or '')
+    directive = directive.split(' ')[0].lower()
+
+    # keywords such as inline, eval and data are kept
+    blocked_uri = str(report.get('blocked_uri') or '')
+    if '://' in blocked_uri:
+        try:
+            u = urlsplit(blocked_uri)
+            blocked_uri = '{:s}://{:s}'.format(u.scheme, u.netloc)
+        except ValueError:
+            pass
+    elif ':' in blocked_uri:
+        blocked_uri = blocked_uri.split(':')[0]
+
+    try:
+        document_path = urlsplit(str(report.get('document_uri') or '')).path
+    except ValueError:
+        document_path = ''
+
+    return (_truncate(directive), _truncate(blocked_uri.lower()),
+            _truncate(document_path))
+
+
+class CountMinSketch(object):
+    """Fixed-size frequency table which never underestimates counts.
+
+    Hashes are salted per process (`hash()`), so collisions can't be chosen
+    by reporters.
+    """
+
+    def __init__(self, width=4096, depth=4):  # type: (int, int) -> None
+        self.width = width
+        self.depth = depth
+
+        self._tables = [[0] * width for _ in range(depth)]
+
+    def _indices(self, key):  # type: (tuple) -> Iterator
+        width = self.width
+        return (hash((i, key)) % width for i in range(self.depth))
+
+    def add(self, key, count=1):  # type: (tuple, int) -> None
+        for table, i in zip(self._tables, self._indices(key)):
+            table[i] += count
+
+    def estimate(self, key):  # type: (tuple) -> int
+        return min(table[i]
+                   for table, i in zip(self._tables, self._indices(key)))
+
+
+class ReportAggregator(object):
+    """Deduplicates reports by fingerprint, and rolls them up.
+
+    This works as sink of `ReportQueue` (called with batches in the writer
+    thread). The counts, first-seen and last-seen times of fingerprints are
+    kept in a bounded LRU map. Rollups (counts since the last flush) are
+    written into the sink every ``interval`` seconds, and evicted ones are
+    written at the end of the batch.
+
+    The total counts of evicted fingerprints are kept approximately in
+    `CountMinSketch`, and restored when they are seen again. Memory is bounded
+    for any number of distinct fingerprints.
+    """
+
+    def __init__(self, sink=None, maxsize=10000, interval=60.0, sketch=None):
+        # type: (function, int, float, CountMinSketch) -> None
+        self.sink = sink
+        self.maxsize = maxsize
+        self.interval = interval
+
+        self.evicted = 0
+
+        self._sketch = sketch or CountMinSketch()
+        # fingerprint: [total, count since flush, first seen, last seen]
+        self._entries = OrderedDict()
+        self._pending = []
+        self._flushed_at = time.time()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __call__(self, reports):  # type: (list) -> None
+        now = int(time.time())
+        with self._lock:
+            for report in reports:
+                self._add(fingerprint(report), report.get('time') or now)
+        self.tick()
+
+    def _add(self, key, seen):  # type: (tuple, int) -> None
+        entries = self._entries
+        entry = entries.pop(key, None)
+        if entry is None:
+            entry = [self._sketch.estimate(key), 0, seen, seen]
+        entries[key] = entry  # as most recently used
+
+        entry[0] += 1
+        entry[1] += 1
+        entry[3] = max(entry[3], seen)
+        self._sketch.add(key)
+
+        while len(entries) > self.maxsize:
+            evicted_key, evicted = entries.popitem(last=False)
+            self.evicted += 1
+            if evicted[1]:
+                self._pending.append(_build_rollup(evicted_key, evicted))
+
+    def tick(self):  # type: () -> None
+        """Flushes if the interval is passed or there are evicted ones."""
+        if self._pending or time.time() - self._flushed_at >= self.interval:
+            self.flush()
+
+    def flush(self):  # type: () -> list
+        """Writes rollups since the last flush into the sink."""
+        with self._lock:
+            rollups, self._pending = self._pending, []
+            for key, entry in self._entries.items():
+                if entry[1]:
+                    rollups.append(_build_rollup(key, entry))
+                    entry[1] = 0
+            self._flushed_at = time.time()
+
+        if rollups and self.sink:
+            try:
+                self.sink(rollups)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('(%s) Failed to write %d rollups',
+                                 'csp_rollup', len(rollups))
+        return rollups
+
+    def estimate(self, report):  # type: (dict) -> int
+        """Returns the total count of the fingerprint (may overestimate)."""
+        return self._sketch.estimate(fingerprint(report))
+
+    def top(self, n=10, field='directive'):  # type: (int, str) -> list
+        """Returns the top n values of the field with total counts.
+
+        The field is one of `FINGERPRINT_FIELDS` or ``fingerprint``.
+
+        >>> aggregator.top(3)  # doctest: +SKIP
+        [('script-src-elem', 1200), ('img-src', 31), ('style-src', 4)]
+        """
+        if field == 'fingerprint':
+            index = None
+        else:
+            index = FINGERPRINT_FIELDS.index(field)
+
+        counts = {}
+        with self._lock:
+            for key, entry in self._entries.items():
+                value = key if index is None else key[index]
+                counts[value] = counts.get(value, 0) + entry[0]
+
+        return sorted(counts.items(), key=lambda kv: (-kv[1], kv[0]))[:n]
+
+
+def _build_rollup(key, entry):  # type: (tuple, list) -> dict
+    rollup = dict(zip(FINGERPRINT_FIELDS, key))
+    rollup.update(count=entry[1], first_seen=entry[2], last_seen=entry[3])
+    return rollup
@@ -0,0 +1,186 @@
+import argparse
+import sqlite3
+import sys
+import threading
+import time
+
+from pyramid_secure_response.csp_rollup import fingerprint
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS reports (
+        id INTEGER PRIMARY KEY,
+        time INTEGER NOT NULL,
+        bucket INTEGER NOT NULL,
+        directive TEXT NOT NULL,
+        blocked_origin TEXT NOT NULL,
+        document_path TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 1
+    )
+    """,
+    'CREATE INDEX IF NOT EXISTS reports_directive ON reports (directive)',
+    'CREATE INDEX IF NOT EXISTS reports_blocked_origin ON reports '
+    '(blocked_origin)',
+    'CREATE INDEX IF NOT EXISTS reports_bucket ON reports (bucket)',
+)
+
+INSERT = (
+    'INSERT INTO reports '
+    '(time, bucket, directive, blocked_origin, document_path, count) '
+    'VALUES (?, ?, ?, ?, ?, ?)'
+)
+
+# columns to group by
+TOP_FIELDS = {
+    'violation': 'directive, blocked_origin',
+    'directive': 'directive',
+    'blocked_origin': 'blocked_origin',
+    'document_path': 'document_path',
+}
+
+
+class ReportStore(object):
+    """Stores reports (or rollups) into SQLite database in WAL mode.
+
+    This works as sink of `ReportQueue` (or `ReportAggregator`), and inserts
+    a batch in a transaction with ``executemany``. Reports are indexed by
+    directive, origin of blocked uri (``scheme://host[:port]``, or keyword
+    such as ``inline``) and time bucket (``bucket_size`` seconds).
+
+    Reports older than ``retention`` seconds (if given) are pruned at most
+    every ``prune_interval`` seconds on write.
+    """
+
+    def __init__(self, path, bucket_size=60, retention=None,
+                 prune_interval=600):
+        # type: (str, int, int, int) -> None
+        self.path = path
+        self.bucket_size = bucket_size
+        self.retention = retention
+        self.prune_interval = prune_interval
+
+        self._local = threading.local()
+        self._pruned_at = 0
+
+        with self.connection as conn:
+            for statement in SCHEMA:
+                conn.execute(statement)
+
+    @property
+    def connection(self):  # type: () -> sqlite3.Connection
+        """Returns connection for the current thread."""
+        conn = getattr(self._local, 'connection', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = conn
+        return conn
+
+    def _build_row(self, report, now):  # type: (dict, int) -> tuple
+        seen = int(report.get('last_seen') or report.get('time') or now)
+        if 'document_path' in report:  # rollup
+            key = (report.get('directive', ''),
+                   report.get('blocked_uri', ''),
+                   report['document_path'])
+        else:
+            key = fingerprint(report)
+        return (seen, seen - seen % self.bucket_size) + key + (
+            int(report.get('count', 1)),)
+
+    def __call__(self, reports):  # type: (list) -> None
+        now = int(time.time())
+        rows = [self._build_row(r, now) for r in reports]
+        with self.connection as conn:  # in a transaction
+            conn.executemany(INSERT, rows)
+
+        if self.retention and now - self._pruned_at >= self.prune_interval:
+            self.prune(self.retention, now)
+
+    def prune(self, retention, now=None):  # type: (int, int) -> int
+        """Deletes reports older than retention seconds.
+
+        Returns the number of deleted rows.
+        """
+        now = int(now or time.time())
+        bucket = now - retention
+        bucket -= bucket % self.bucket_size
+        with self.connection as conn:
+            cursor = conn.execute(
+                'DELETE FROM reports WHERE bucket < ?', (bucket,))
+        self._pruned_at = now
+        return cursor.rowcount
+
+    def top(self, n=10, since=3600, field='violation', now=None):
+        # type: (int, int, str, int) -> list
+        """Returns top n values of the field in the last since seconds.
+
+        Each row is a tuple of the values (e.g. directive and blocked origin
+        for ``violation``) and the total count.
+        """
+        columns = TOP_FIELDS[field]
+        now = int(now or time.time())
+        bucket = now - since
+        bucket -= bucket % self.bucket_size
+        cursor = self.connection.execute(
+            'SELECT {0:s}, SUM(count) AS total FROM reports '
+            'WHERE bucket >= ? GROUP BY {0:s} '
+            'ORDER BY total DESC, {0:s} LIMIT ?'.format(columns),
+            (bucket, n))
+        return cursor.fetchall()
+
+    def close(self):  # type: () -> None
+        conn = getattr(self._local, 'connection', None)
+        if conn is not None:
+            conn.close()
+            self._local.connection = None
+
+
+def main(argv=None):  # type: (list) -> int
+    r"""Queries or prunes the report store.
+
+    .. code:: zsh
+
+        % python -m pyramid_secure_response.csp_store top reports.sqlite
+        % python -m pyramid_secure_response.csp_store prune reports.sqlite \
+            --retention 604800
+    """
+    parser = argparse.ArgumentParser(
+        prog='python -m pyramid_secure_response.csp_store',
+        description='Queries CSP violation reports in SQLite database.')
+    commands = parser.add_subparsers(dest='command')
+
+    top = commands.add_parser('top', help='top N violations')
+    top.add_argument('path')
+    top.add_argument('--last', type=int, default=3600,
+                     help='seconds (default: 3600)')
+    top.add_argument('-n', type=int, default=10)
+    top.add_argument('--field', choices=sorted(TOP_FIELDS),
+                     default='violation')
+
+    prune = commands.add_parser('prune', help='delete old reports')
+    prune.add_argument('path')
+    prune.add_argument('--retention', type=int, required=True,
+                       help='seconds')
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_usage()
+        return 2
+
+    store = ReportStore(args.path)
+    try:
+        if args.command == 'top':
+            for row in store.top(args.n, since=args.last, field=args.field):
+                print('{:>10d}  {:s}'.format(
+                    row[-1], '  '.join(str(v) for v in row[:-1])))
+        else:
+            print('{:d} reports deleted'.format(
+                store.prune(args.retention)))
+    finally:
+        store.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
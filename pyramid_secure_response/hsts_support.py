@@ -1,8 +1,7 @@
+from pyramid_secure_response.secure_context import get_secure_context
 from pyramid_secure_response.util import (
     logger,
-    apply_path_filter,
-    get_config,
-    build_criteria,
+    load_config,
 )
 
 HEADER_KEY = 'Strict-Transport-Security'
@@ -18,6 +17,51 @@ def build_hsts_header(config):
     return value
 
 
+def build_content_type_f(content_types):
+    # type: (Union[ContentTypeMap, None]) -> function
+    """Returns function checks if the header is set for the response type."""
+    if content_types is None:
+        return lambda res: True
+
+    def _is_selected(res):  # type: (Response) -> bool
+        return bool(content_types.resolve(res.headers.get('Content-Type', '')))
+
+    return _is_selected
+
+
+def build_host_hsts_headers(config):  # type: (Config) -> HostMap
+    """Returns HostMap of HSTS Header values for ``host_policies``.
+
+    The value is None for the hosts which disable ``hsts_support``.
+    """
+    return config.host_policies.map(
+        lambda c: build_hsts_header(c.hsts_support)
+        if c.hsts_support.enabled else None,
+        default=build_hsts_header(config.hsts_support))
+
+
+def build_hsts_header_resolver(config):  # type: (Config) -> function
+    """Returns function returns HSTS Header value (or None) for the host.
+
+    The value is looked up in ``policy_store`` and ``host_policies`` in this
+    order, and the global one is the fallback.
+    """
+    header = build_hsts_header(config.hsts_support)
+    host_headers = build_host_hsts_headers(config) \
+        if config.host_policies else None
+    store = config.policy_store
+    if store is None:
+        return host_headers.resolve if host_headers else (lambda _: header)
+
+    def _resolve(host):  # type: (str) -> Union[str, None]
+        policy = store.get(host)
+        if policy is not None:
+            return policy.hsts_header
+        return host_headers.resolve(host) if host_headers else header
+
+    return _resolve
+
+
 def tween(handler, registry):
     r"""Sets HTTP Strict Transport Security Header as configured.
 
@@ -26,43 +70,50 @@ def tween(handler, registry):
     * https://hstspreload.org/
     * https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/\
         Strict-Transport-Security#Preloading_Strict_Transport_Security
-    """
-    config = get_config(registry)
 
+    The header value can be overridden per host (see `HostMap` and
+    `PolicyStore`), and reloaded from the policy file (see `PolicyWatcher`).
+
+    If ``content_types`` is configured, the header is set only for these
+    types (e.g. ``text/html``), because browsers keep it for max-age.
+    """
+    config = load_config(registry)
     hsts_support = config.hsts_support
+    if not hsts_support.enabled:
+        return handler
+
+    ignore_paths = hsts_support.ignore_paths
+    proto_key = hsts_support.proto_key
+    is_selected = build_content_type_f(hsts_support.content_types)
 
-    ignore_paths = config.ignore_paths
-    if hsts_support.ignore_paths:
-        ignore_paths = hsts_support.ignore_paths
+    # pylint: disable=import-outside-toplevel,cyclic-import
+    from pyramid_secure_response.policy_reload import get_policy_watcher
 
-    proto_header = config.proto_header
-    if hsts_support.proto_header:
-        proto_header = hsts_support.proto_header
+    watcher = get_policy_watcher(registry)
+    resolve_header = watcher.resolve_hsts_header if watcher else \
+        build_hsts_header_resolver(config)
 
     tween_name = 'hsts_support'
 
     def _hsts_support_tween(req):
-        if not hsts_support.enabled:
-            return handler(req)
+        ctx = get_secure_context(req)
 
         # ignore
-        if apply_path_filter(req, ignore_paths):
-            logger.info('(%s) Ignore path %s', tween_name, req.path)
+        if ctx.is_ignored(ignore_paths):
+            logger.info('(%s) Ignore path %s', tween_name, ctx.path)
             return handler(req)
 
-        criteria = build_criteria(req, proto_header=proto_header)
-        secure = all(criteria)
-
-        if not secure:
+        if not ctx.is_secure(proto_key):
             # sets the header only for https
-            logger.warning('(%s) Insecure request %s', tween_name, req.url)
+            logger.warning('(%s) Insecure request %s', tween_name, ctx.path)
             return handler(req)
 
         res = handler(req)
 
-        if HEADER_KEY not in res.headers:
+        value = resolve_header(ctx.host)
+        if value and HEADER_KEY not in res.headers and is_selected(res):
             # ignore if already exists
-            res.headers[HEADER_KEY] = build_hsts_header(hsts_support)
+            res.headers[HEADER_KEY] = value
 
         return res
 
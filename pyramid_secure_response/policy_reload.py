@@ -0,0 +1,187 @@
+from collections import namedtuple
+import os
+import threading
+
+from pyramid_secure_response.csp_coverage import build_csp_header_resolver
+from pyramid_secure_response.hsts_support import build_hsts_header_resolver
+from pyramid_secure_response.policy_store import (
+    load_policy_file,
+    merge_policy,
+)
+from pyramid_secure_response.util import (
+    compile_config,
+    logger,
+    load_config,
+)
+
+# compiled resolvers which are swapped at once
+Policy = namedtuple('Policy', (
+    'config',
+    'resolve_hsts_header',  # host -> value or None
+    'resolve_csp_header_f',  # host -> function or None
+))
+
+
+def _none(_):  # type: (str) -> None
+    return None
+
+
+def compile_policy(settings, path, base=None):
+    # type: (dict, str, Config) -> Policy
+    """Returns Policy compiled from settings overridden by the policy file.
+
+    If the base Config is given, its scanned hash-sources and policy store
+    are reused (see `compile_config`). Raises IOError (or OSError) and
+    ValueError for invalid file.
+    """
+    config = compile_config(
+        merge_policy(settings, load_policy_file(path)), base=base)
+
+    resolve_hsts_header = build_hsts_header_resolver(config) \
+        if config.hsts_support.enabled else None
+    resolve_csp_header_f = build_csp_header_resolver(config) \
+        if config.csp_coverage.enabled else None
+    return Policy(config, resolve_hsts_header or _none,
+                  resolve_csp_header_f or _none)
+
+
+def _stat(path):  # type: (str) -> Union[tuple, None]
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size, st.st_ino)
+
+
+class PolicyWatcher(object):
+    """Watches the policy file, and swaps the compiled policy when changed.
+
+    The mtime (and size) of the file is checked by a background thread at
+    every interval, and the new policy is compiled off the request path. It's
+    published by an assignment of `current`, so requests read either the old
+    or the new one without any lock. If the new one can't be compiled, the
+    error is logged and the previous one is kept.
+
+    The first policy is compiled at the initialization, and it raises error
+    for invalid file as other settings.
+
+    Only the header policies are compiled on reload. The hash-sources (of
+    ``csp_hashes``) and ``policy_store`` of the base Config (compiled from
+    the settings if not given) are shared, so the thread never scans files
+    and tenants in the store are kept (they inherit the settings, not the
+    watched file). Only the listing of the store is refreshed.
+    """
+
+    def __init__(self, path, settings, interval=2.0, base=None):
+        # type: (str, dict, float, Config) -> None
+        if interval <= 0:
+            raise ValueError('interval must be positive')
+
+        self.path = path
+        self.interval = interval
+        self.reloaded = 0
+
+        self._settings = settings
+        self._base = compile_config(settings) if base is None else base
+        self._stat = _stat(path)
+        self.current = compile_policy(settings, path, base=self._base)
+
+        self._stopped = None
+        self._thread = None
+        self._at_fork = False
+
+    def resolve_hsts_header(self, host):  # type: (str) -> Union[str, None]
+        """Returns HSTS Header value for the host by the current policy."""
+        return self.current.resolve_hsts_header(host)
+
+    def resolve_csp_header_f(self, host):
+        # type: (str) -> Union[function, None]
+        """Returns `build_csp_header_f` for the host by the current policy."""
+        return self.current.resolve_csp_header_f(host)
+
+    def check(self):  # type: () -> bool
+        """Reloads the policy if the file is changed (True if swapped)."""
+        stat = _stat(self.path)
+        if stat is None:
+            # e.g. in the middle of replacement by an editor (checked again)
+            logger.warning('(%s) Missing %s', 'policy_reload', self.path)
+            return False
+        if stat == self._stat:
+            return False
+
+        self._stat = stat
+        try:
+            policy = compile_policy(self._settings, self.path,
+                                    base=self._base)
+        except (IOError, OSError, ValueError) as e:
+            logger.error('(%s) Failed to reload %s (the previous policy is '
+                         'kept): %s', 'policy_reload', self.path, e)
+            return False
+
+        self.current = policy  # atomic reference swap
+        self.reloaded += 1
+        if policy.config.policy_store is not None:
+            # tenant files added (or fixed) since the last listing
+            policy.config.policy_store.refresh()
+        logger.info('(%s) Reloaded %s', 'policy_reload', self.path)
+        return True
+
+    def start(self):  # type: () -> None
+        """Starts the thread (also in the child process after fork)."""
+        stopped = self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, args=(stopped,),
+            name='pyramid_secure_response.policy_reload')
+        self._thread.daemon = True
+        self._thread.start()
+
+        register_at_fork = getattr(os, 'register_at_fork', None)
+        if register_at_fork and not self._at_fork:
+            # threads of the parent are not copied into children
+            register_at_fork(after_in_child=self._restart)
+            self._at_fork = True
+
+    def stop(self, timeout=None):  # type: (float) -> None
+        """Stops the thread."""
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _restart(self):  # type: () -> None
+        if self._thread is not None:
+            self.start()
+
+    def _run(self, stopped):  # type: (threading.Event) -> None
+        while not stopped.wait(self.interval):
+            try:
+                self.check()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('(%s) Failed to check %s',
+                                 'policy_reload', self.path)
+
+
+def get_policy_watcher(registry):
+    # type: (Registry) -> Union[PolicyWatcher, None]
+    """Returns started PolicyWatcher which is cached on registry (per config).
+
+    Returns None if ``policy_reload.path`` is not configured.
+    """
+    config = load_config(registry)
+    cached = getattr(registry, '_pyramid_secure_response_policy_watcher',
+                     None)
+    if cached is not None and cached[0] is config:
+        return cached[1]
+    if cached is not None and cached[1] is not None:
+        cached[1].stop()
+
+    watcher = None
+    policy_reload = config.policy_reload
+    if policy_reload.path:
+        watcher = PolicyWatcher(policy_reload.path, registry.settings,
+                                interval=policy_reload.interval, base=config)
+        watcher.start()
+    # pylint: disable=protected-access
+    registry._pyramid_secure_response_policy_watcher = (config, watcher)
+    return watcher
@@ -0,0 +1,281 @@
+from collections import namedtuple
+import errno
+import io
+import json
+import os
+import re
+
+try:
+    from configparser import Error as ConfigParserError, RawConfigParser
+except ImportError:  # Python 2.7
+    from ConfigParser import Error as ConfigParserError, RawConfigParser
+
+try:
+    from sys import intern
+except ImportError:  # Python 2.7 (builtin)
+    pass
+
+from pyramid_secure_response.csp_coverage import build_csp_header_f
+from pyramid_secure_response.hsts_support import build_hsts_header
+from pyramid_secure_response.util import (
+    HOST_POLICY_GLOBAL_FIELDS,
+    HOST_POLICY_SECTIONS,
+    PACKAGE_NAME,
+    LRUCache,
+    logger,
+    normalize_host,
+)
+
+# hosts which can be a file name (without port, IPv6 is not supported)
+HOST_PATTERN = re.compile(r'\A[a-z0-9](?:[a-z0-9.-]*[a-z0-9])?\Z')
+
+# extensions of policy files (in the order of lookup)
+POLICY_FILE_EXTENSIONS = ('.json', '.ini')
+
+# compiled policy for a tenant (None if the header is disabled)
+TenantPolicy = namedtuple('TenantPolicy', ('hsts_header', 'set_csp_header'))
+
+CacheInfo = namedtuple('CacheInfo', ('hits', 'misses', 'maxsize', 'currsize'))
+
+_MISSING = object()
+
+
+def _to_setting(key, value):  # type: (str, object) -> str
+    if isinstance(value, (list, tuple)):
+        if key == 'ignore_paths':  # multi-line value is parsed as tuple
+            return '\n' + '\n'.join(str(v) for v in value)
+        return ' '.join(str(v) for v in value)  # sources
+    return str(value)
+
+
+def _intern_items(directives):  # type: (OrderedDict) -> tuple
+    # e.g. (('script_src', ('self', 'https://cdn.example.org')),)
+    items = []
+    for name, value in directives.items():
+        if isinstance(value, bool) or not value:
+            if value:
+                items.append((name, value))
+            continue
+        tokens = value.split() if hasattr(value, 'split') else value
+        items.append((name, tuple(intern(str(t)) for t in tokens)))
+    return tuple(items)
+
+
+def _content_types_key(content_types):
+    # type: (Union[ContentTypeMap, None]) -> Union[tuple, None]
+    if content_types is None:
+        return None
+    return (content_types.default, tuple(content_types.items()))
+
+
+def parse_json_policy(text):  # type: (str) -> dict
+    """Returns overrides {section: {key: value}} from JSON text.
+
+    >>> parse_json_policy('{"hsts_support": {"preload": false}}')
+    {'hsts_support': {'preload': 'False'}}
+    """
+    data = json.loads(text)
+    if not isinstance(data, dict) or \
+       not all(isinstance(v, dict) for v in data.values()):
+        raise ValueError('policy must be an object of sections')
+    return dict(
+        (section, dict((k, _to_setting(k, v)) for k, v in values.items()))
+        for section, values in data.items())
+
+
+def parse_ini_policy(text):  # type: (str) -> dict
+    """Returns overrides {section: {key: value}} from INI text."""
+    parser = RawConfigParser()
+    read_file = getattr(parser, 'read_file', None) or parser.readfp
+    try:
+        read_file(io.StringIO(text))
+    except ConfigParserError as e:
+        raise ValueError(str(e))
+    return dict((section, dict(parser.items(section)))
+                for section in parser.sections())
+
+
+def load_policy_file(filename):  # type: (str) -> dict
+    """Returns overrides {section: {key: value}} from JSON or INI file."""
+    with io.open(filename, encoding='utf-8') as f:
+        text = f.read()
+    if filename.endswith('.json'):
+        return parse_json_policy(text)
+    return parse_ini_policy(text)
+
+
+def merge_policy(settings, overrides):  # type: (dict, dict) -> dict
+    """Returns new settings overridden by the policy sections.
+
+    Raises ValueError for the sections (and the fields applied only globally)
+    which can't be overridden.
+    """
+    settings = dict(settings or {})
+    for section, values in overrides.items():
+        if section not in HOST_POLICY_SECTIONS:
+            raise ValueError('{:s} can not be overridden'.format(section))
+        for k in values:
+            field = '{:s}.{:s}'.format(section, k)
+            if field in HOST_POLICY_GLOBAL_FIELDS:
+                raise ValueError('{:s} can not be overridden'.format(field))
+        settings.update(
+            ('{:s}.{:s}.{:s}'.format(PACKAGE_NAME, section, k), v)
+            for k, v in values.items())
+    return settings
+
+
+class PolicyStore(object):
+    """Per-tenant policies which are loaded from files on first use.
+
+    The file ``<path>/<host>.json`` (or ``<host>.ini``) overrides the values
+    of ``hsts_support`` and ``csp_coverage`` for the host, like
+    ``host_policy.xxx``. Policies are compiled with the global settings (see
+    `compile_config`) only when the host is requested, and kept in the LRU
+    cache with hit/miss counters.
+
+    Only the hosts in the directory listing (see `hosts`) are looked up, so
+    unknown ``Host`` headers never touch the file system. The listing is
+    refreshed on `refresh` (e.g. by ``policy_reload``). Listed hosts which
+    have no valid policy are kept in another bounded cache, so that they
+    don't evict tenants.
+
+    HSTS Header values and CSP source strings are interned, and tenants which
+    have the same CSP share one compiled setter (and its header values), so
+    that thousands of similar policies don't hold their own copies.
+
+    Override `load` (and `hosts`) to load policies from other sources.
+    """
+
+    def __init__(self, path, settings, cache_size=10000, scanned=None):
+        # type: (str, dict, int, dict) -> None
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+
+        self._settings = settings
+        self._scanned = {} if scanned is None else scanned
+        self._cache = LRUCache(maxsize=cache_size)
+        self._missing = LRUCache(maxsize=cache_size)
+        self._csp_header_fs = LRUCache(maxsize=cache_size)
+        self._hosts = _MISSING
+
+    def info(self):  # type: () -> CacheInfo
+        """Returns the counters and the size of cache."""
+        return CacheInfo(self.hits, self.misses, self._cache.maxsize,
+                         len(self._cache))
+
+    def clear(self):  # type: () -> None
+        """Clears cached policies (files are listed and loaded again)."""
+        self._cache.clear()
+        self._csp_header_fs.clear()
+        self.refresh()
+
+    def refresh(self):  # type: () -> None
+        """Lists hosts again, and forgets hosts which had no valid policy."""
+        self._hosts = _MISSING
+        self._missing.clear()
+
+    def hosts(self):  # type: () -> Union[frozenset, None]
+        """Returns hosts which have a policy file (or None if unknown).
+
+        None means that any valid host is looked up by `load`.
+        """
+        if not self.path:
+            return None
+        try:
+            names = os.listdir(self.path)
+        except (IOError, OSError) as e:
+            logger.error('(%s) Failed to list %s: %s',
+                         'policy_store', self.path, e)
+            return frozenset()
+        return frozenset(
+            name for name, ext in (os.path.splitext(n) for n in names)
+            if ext in POLICY_FILE_EXTENSIONS and HOST_PATTERN.match(name))
+
+    def load(self, host):  # type: (str) -> Union[dict, None]
+        """Returns overrides {section: {key: value}} for the host or None."""
+        for ext in POLICY_FILE_EXTENSIONS:
+            try:
+                return load_policy_file(os.path.join(self.path, host + ext))
+            except (IOError, OSError) as e:
+                if e.errno != errno.ENOENT:
+                    raise
+        return None
+
+    def get(self, host):  # type: (str) -> Union[TenantPolicy, None]
+        """Returns TenantPolicy for the host (``Host`` header), or None.
+
+        None means that the host doesn't have own policy. Invalid policy is
+        logged, and the host falls back to the global one.
+
+        Policies are cached by the normalized host (without port and case), and
+        hosts which can't be a file name or are not listed in `hosts` are not
+        cached, so that clients can't evict tenants by variants of the
+        ``Host`` header.
+        """
+        name = normalize_host(host)
+        # counters are not locked (approximate under threads)
+        policy = self._cache.get(name, _MISSING)
+        if policy is not _MISSING:
+            self.hits += 1
+            return policy
+        if name in self._missing:
+            self.hits += 1
+            return None
+
+        if not HOST_PATTERN.match(name) or '..' in name:
+            return None
+        hosts = self._hosts
+        if hosts is _MISSING:
+            hosts = self._hosts = self.hosts()
+        if hosts is not None and name not in hosts:
+            return None
+
+        self.misses += 1
+        policy = self._load(name)
+        if policy is None:
+            self._missing[name] = True
+        else:
+            self._cache[name] = policy
+        return policy
+
+    def _load(self, name):  # type: (str) -> Union[TenantPolicy, None]
+        try:
+            overrides = self.load(name)
+            if overrides is not None:
+                return self._compile(overrides)
+        except (IOError, OSError, ValueError) as e:
+            logger.error('(%s) Invalid policy for %s: %s',
+                         'policy_store', name, e)
+        return None
+
+    def _compile(self, overrides):  # type: (dict) -> TenantPolicy
+        # pylint: disable=import-outside-toplevel,cyclic-import
+        from pyramid_secure_response.util import _compile_config
+
+        config = _compile_config(
+            merge_policy(self._settings, overrides), self._scanned)
+
+        hsts_support = config.hsts_support
+        hsts_header = intern(str(build_hsts_header(hsts_support))) \
+            if hsts_support.enabled else None
+        set_csp_header = self._get_csp_header_f(config.csp_coverage) \
+            if config.csp_coverage.enabled else None
+        return TenantPolicy(hsts_header, set_csp_header)
+
+    def _get_csp_header_f(self, csp_coverage):
+        # type: (CSPCoverageConfig) -> Union[function, None]
+        key = (
+            _intern_items(csp_coverage.directives),
+            _intern_items(csp_coverage.report_only_directives),
+            csp_coverage.sample_rate,
+            csp_coverage.sample_cookie,
+            csp_coverage.hash_responses,
+            csp_coverage.enforce_hash_responses,
+            _content_types_key(csp_coverage.content_types),
+        )
+        set_csp_header = self._csp_header_fs.get(key, _MISSING)
+        if set_csp_header is _MISSING:
+            set_csp_header = self._csp_header_fs[key] = \
+                build_csp_header_f(csp_coverage)
+        return set_csp_header
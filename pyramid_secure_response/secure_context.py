@@ -0,0 +1,98 @@
+from pyramid_secure_response.util import (
+    PathFilter,
+    is_secure_environ,
+    load_config,
+    match_path,
+)
+
+
+class SecureContext(object):
+    """Security related values of a request.
+
+    This is computed once per request, and shared by tweens and views via
+    ``request.secure_context``. The decisions for the ignore paths and the
+    proto header of each tween are also cached.
+
+    * scheme (``wsgi.url_scheme``)
+    * forwarded_proto (value of the proto header if configured)
+    * host
+    * path
+    * secure (checked with the global proto header)
+    * ignored (checked with the global ignore paths)
+    """
+
+    __slots__ = (
+        'scheme',
+        'forwarded_proto',
+        'host',
+        'path',
+        '_environ',
+        '_proto_key',
+        '_ignore_paths',
+        '_secure',
+        '_ignored',
+    )
+
+    def __init__(self, req, proto_key='', ignore_paths=tuple()):
+        # type: (Request, str, tuple) -> None
+        environ = req.environ
+
+        self._environ = environ
+        self._proto_key = proto_key
+        self._ignore_paths = ignore_paths
+        self._secure = {}
+        self._ignored = {}
+
+        self.scheme = environ.get('wsgi.url_scheme', 'http')
+        self.forwarded_proto = environ.get(proto_key) if proto_key else None
+        self.host = req.host
+        self.path = req.path
+
+    @property
+    def secure(self):  # type: () -> bool
+        return self.is_secure(self._proto_key)
+
+    @property
+    def ignored(self):  # type: () -> bool
+        return self.is_ignored(self._ignore_paths)
+
+    def is_secure(self, proto_key=''):  # type: (str) -> bool
+        """Returns True if the request is on https (with the proto key)."""
+        try:
+            return self._secure[proto_key]
+        except KeyError:
+            secure = self._secure[proto_key] = is_secure_environ(
+                self._environ, proto_key)
+            return secure
+
+    def is_ignored(self, paths):  # type: (tuple) -> bool
+        """Returns True if the request path is matched with the paths."""
+        # compiled paths in config live as long as the application
+        key = id(paths) if isinstance(paths, PathFilter) else paths
+        try:
+            return self._ignored[key]
+        except KeyError:
+            ignored = self._ignored[key] = match_path(self.path, paths)
+            return ignored
+
+
+def get_secure_context(req):  # type: (Request) -> SecureContext
+    """Returns SecureContext of the request.
+
+    If ``request.secure_context`` is not available (e.g. tweens are added
+    without ``config.include()``), it's created and set to the request.
+    """
+    try:
+        return req.secure_context
+    except AttributeError:
+        ctx = req.secure_context = SecureContext(req)
+        return ctx
+
+
+def secure_context(request):  # type: (Request) -> SecureContext
+    """Creates SecureContext with the global values in config.
+
+    This is added as ``request.secure_context`` by ``config.include()``.
+    """
+    config = load_config(request.registry)
+    return SecureContext(request, config.proto_key, config.ignore_paths)
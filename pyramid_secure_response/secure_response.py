@@ -0,0 +1,158 @@
+from collections import namedtuple
+
+from pyramid_secure_response import (
+    csp_coverage,
+    hsts_support,
+    security_headers,
+)
+from pyramid_secure_response.policy_reload import get_policy_watcher
+from pyramid_secure_response.ssl_redirect import (
+    build_redirect_f,
+    parse_status_code,
+)
+from pyramid_secure_response.secure_context import get_secure_context
+from pyramid_secure_response.util import (
+    logger,
+    load_config,
+)
+
+# decision plan for all policies (disabled policy is None)
+Plan = namedtuple('Plan', (
+    'ssl_redirect', 'hsts_support', 'csp_coverage', 'security_headers'))
+
+# value is the header value, the status code for ssl_redirect, or the header
+# pairs for security_headers
+Policy = namedtuple('Policy', ('ignore_paths', 'proto_key', 'value'))
+
+
+def build_plan(config):  # type: (Config) -> Plan
+    """Builds decision plan for all policies from config.
+
+    The policies which share the same ignore paths and proto header share
+    also decisions in `SecureContext`.
+    """
+    values = {
+        'ssl_redirect': parse_status_code(config.ssl_redirect.status_code),
+        'hsts_support': hsts_support.build_hsts_header(config.hsts_support),
+        'csp_coverage': csp_coverage.compile_csp_header(
+            config.csp_coverage.directives).value,
+        'security_headers': config.security_headers.headers,
+    }
+    # csp_coverage may have only report-only policy, policies per host or
+    # reloaded policy (which are set by tweens)
+    reported = any(config.csp_coverage.report_only_directives.values()) or \
+        bool(config.host_policies) or config.policy_store is not None or \
+        bool(config.policy_reload.path)
+
+    policies = {}
+    for name, value in values.items():
+        policy = getattr(config, name)
+        if not policy.enabled or \
+           (not value and not (name == 'csp_coverage' and reported)):
+            policies[name] = None
+            continue
+
+        # csp_coverage and security_headers do not have proto_key
+        policies[name] = Policy(
+            policy.ignore_paths, getattr(policy, 'proto_key', None), value)
+
+    return Plan(**policies)
+
+
+def _is_ignored(ctx, ignore_paths, name):
+    # type: (SecureContext, tuple, str) -> bool
+    # logged per policy as same as its tween
+    if ctx.is_ignored(ignore_paths):
+        logger.info('(%s) Ignore path %s', name, ctx.path)
+        return True
+    return False
+
+
+def _build_hsts_header_f(config, hsts, watcher):
+    # type: (Config, Policy, PolicyWatcher) -> function
+    resolve_header = watcher.resolve_hsts_header if watcher else \
+        hsts_support.build_hsts_header_resolver(config)
+    is_selected = hsts_support.build_content_type_f(
+        config.hsts_support.content_types)
+
+    def _set_hsts_header(res, ctx):  # type: (Response, SecureContext) -> None
+        if _is_ignored(ctx, hsts.ignore_paths, 'hsts_support') or \
+           not ctx.is_secure(hsts.proto_key) or \
+           hsts_support.HEADER_KEY in res.headers or not is_selected(res):
+            return
+        value = resolve_header(ctx.host)
+        if value:
+            res.headers[hsts_support.HEADER_KEY] = value
+
+    return _set_hsts_header
+
+
+def _build_csp_header_f(config, csp, watcher):
+    # type: (Config, Policy, PolicyWatcher) -> function
+    resolve_header_f = watcher.resolve_csp_header_f if watcher else \
+        csp_coverage.build_csp_header_resolver(config)
+
+    def _set_csp_header(req, res, ctx):
+        # type: (Request, Response, SecureContext) -> None
+        if _is_ignored(ctx, csp.ignore_paths, 'csp_coverage') or \
+           csp_coverage.HEADER_KEY in res.headers:
+            return
+        set_header = resolve_header_f(ctx.host)
+        if set_header:
+            set_header(req, res, ctx.path)
+
+    return _set_csp_header
+
+
+def tween(handler, registry):
+    """Applies ssl_redirect, hsts_support, csp_coverage and security_headers.
+
+    This works as same as the 4 tweens, but per request the path filter and
+    the secure check are done only once for policies which share the same
+    ``ignore_paths`` and ``proto_header``.
+    """
+    config = load_config(registry)
+    plan = build_plan(config)
+
+    redirect = plan.ssl_redirect
+    bundle = plan.security_headers
+
+    if not (redirect or plan.hsts_support or plan.csp_coverage or bundle):
+        return handler
+
+    redirect_response = build_redirect_f(redirect.value) \
+        if redirect else None
+    watcher = get_policy_watcher(registry)
+    set_hsts_header = _build_hsts_header_f(
+        config, plan.hsts_support, watcher) if plan.hsts_support else None
+    set_csp_header = _build_csp_header_f(
+        config, plan.csp_coverage, watcher) if plan.csp_coverage else None
+    append_headers = security_headers.build_append_headers_f(bundle.value) \
+        if bundle else None
+
+    tween_name = 'secure_response'
+
+    def _secure_response_tween(req):
+        ctx = get_secure_context(req)
+
+        if redirect and \
+           not _is_ignored(ctx, redirect.ignore_paths, 'ssl_redirect') and \
+           not ctx.is_secure(redirect.proto_key):
+            logger.warning('(%s) Insecure request %s', tween_name, ctx.path)
+            return redirect_response(ctx.host, ctx.path)
+
+        res = handler(req)
+
+        if set_hsts_header:
+            set_hsts_header(res, ctx)
+
+        if set_csp_header:
+            set_csp_header(req, res, ctx)
+
+        if bundle and \
+           not _is_ignored(ctx, bundle.ignore_paths, 'security_headers'):
+            append_headers(res.headerlist)
+
+        return res
+
+    return _secure_response_tween
@@ -0,0 +1,109 @@
+from collections import OrderedDict
+
+from pyramid_secure_response.secure_context import get_secure_context
+from pyramid_secure_response.util import (
+    logger,
+    load_config,
+)
+
+# setting key: header name
+HEADERS = OrderedDict((
+    ('x_content_type_options', 'X-Content-Type-Options'),
+    ('referrer_policy', 'Referrer-Policy'),
+    ('permissions_policy', 'Permissions-Policy'),
+    ('cross_origin_opener_policy', 'Cross-Origin-Opener-Policy'),
+    ('cross_origin_embedder_policy', 'Cross-Origin-Embedder-Policy'),
+    ('reporting_endpoints', 'Reporting-Endpoints'),
+))
+
+
+def build_security_headers(config):  # type: (namedtuple) -> tuple
+    """Returns (name, value) pairs of the configured headers as tuple.
+
+    Multi-line value is joined as a list (e.g. endpoints of
+    ``Reporting-Endpoints``). Raises ValueError for invalid value.
+
+    >>> build_security_headers(parse_config({
+    ...     'pyramid_secure_response.security_headers.'
+    ...     'x_content_type_options': 'nosniff',
+    ... }).security_headers)
+    (('X-Content-Type-Options', 'nosniff'),)
+    """
+    headers = []
+    for key, name in HEADERS.items():
+        value = getattr(config, key)
+        if isinstance(value, tuple):
+            value = ', '.join(value)
+        if not value:
+            continue
+
+        value = str(value)
+        if '\r' in value or '\n' in value:
+            raise ValueError('invalid security_headers.{:s} {!r}'.format(
+                key, value))
+        # UnicodeEncodeError (ValueError) is raised for non latin-1 value
+        value.encode('latin-1')
+        headers.append((name, value))
+    return tuple(headers)
+
+
+def build_append_headers_f(headers):  # type: (tuple) -> function
+    """Returns function appends headers which are not set yet.
+
+    The header list is scanned once to find the names which are already set
+    (ignore case), and the rest of headers are appended by a single
+    ``extend()``. The rest is cached for each combination of found names.
+    """
+    names = frozenset(h[0].lower() for h in headers)
+    rests = {}
+
+    def _append_headers(headerlist):  # type: (list) -> None
+        found = None
+        for name, _ in headerlist:
+            if name.lower() in names:
+                found = (found or ()) + (name.lower(),)
+
+        if found is None:
+            headerlist.extend(headers)
+            return
+
+        found = frozenset(found)
+        rest = rests.get(found)
+        if rest is None:  # at most 2^len(headers) combinations
+            rest = rests[found] = tuple(
+                h for h in headers if h[0].lower() not in found)
+        headerlist.extend(rest)
+
+    return _append_headers
+
+
+def tween(handler, registry):
+    r"""Sets security headers (``security_headers.xxx``) as configured.
+
+    Headers which are already set by the application are not overwritten.
+
+    * https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/\
+        X-Content-Type-Options
+    * https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/\
+        Cross-Origin-Opener-Policy
+    """
+    security_headers = load_config(registry).security_headers
+    if not (security_headers.enabled and security_headers.headers):
+        return handler
+
+    ignore_paths = security_headers.ignore_paths
+    append_headers = build_append_headers_f(security_headers.headers)
+
+    tween_name = 'security_headers'
+
+    def _security_headers_tween(req):
+        ctx = get_secure_context(req)
+        if ctx.is_ignored(ignore_paths):
+            logger.info('(%s) Ignore path %s', tween_name, ctx.path)
+            return handler(req)
+
+        res = handler(req)
+        append_headers(res.headerlist)
+        return res
+
+    return _security_headers_tween
@@ -0,0 +1,167 @@
+from base64 import b64encode
+from collections import namedtuple
+import hashlib
+import mmap
+from multiprocessing.pool import ThreadPool
+import os
+
+from pyramid.path import AssetResolver
+
+from pyramid_secure_response.util import (
+    LRUCache,
+    load_config,
+    logger,
+)
+
+# URL of static asset and its integrity metadata (see `static_sri`)
+StaticAsset = namedtuple('StaticAsset', ('url', 'integrity'))
+
+
+def hash_file(path, algorithms=('sha384',)):  # type: (str, tuple) -> str
+    """Returns integrity metadata (e.g. ``sha384-...``) of the file.
+
+    The file is read via memory-mapping, and passed to the hash functions as
+    buffer. So large bundles are hashed without being copied into bytes
+    objects.
+    """
+    digests = [hashlib.new(a) for a in algorithms]
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size > 0:  # empty file can't be mapped
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for d in digests:
+                    d.update(m)
+            finally:
+                m.close()
+
+    return ' '.join(
+        '{:s}-{:s}'.format(a, b64encode(d.digest()).decode('ascii'))
+        for a, d in zip(algorithms, digests))
+
+
+def resolve_path(spec):  # type: (str) -> str
+    """Returns absolute path of the asset spec (e.g. ``myapp:static/a.js``).
+
+    The spec is resolved as same as ``config.add_static_view()``.
+    """
+    if os.path.isabs(spec):
+        return spec
+    return AssetResolver().resolve(spec).abspath()
+
+
+class SRIService(object):
+    """Computes integrity metadata of static files with cache.
+
+    The digests are cached in a bounded map, and invalidated if the inode,
+    mtime or size of the file is changed.
+    """
+
+    def __init__(self, algorithms=('sha384',), cache_size=1024):
+        # type: (tuple, int) -> None
+        self.algorithms = tuple(algorithms)
+
+        self._cache = LRUCache(cache_size)
+        self._paths = LRUCache(cache_size)
+
+    def integrity(self, spec):  # type: (str) -> str
+        """Returns integrity metadata of the asset spec (or path)."""
+        path = self._paths.get(spec)
+        if path is None:
+            path = self._paths[spec] = resolve_path(spec)
+
+        stat = os.stat(path)
+        key = (stat.st_ino, stat.st_mtime, stat.st_size)
+
+        cached = self._cache.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        value = hash_file(path, self.algorithms)
+        self._cache[path] = (key, value)
+        return value
+
+    def prewarm(self, specs, workers=4):  # type: (tuple, int) -> int
+        """Computes integrity metadata of all files in specs (directories).
+
+        Files are hashed by threads (hashlib releases GIL for large data).
+        Returns the number of the files.
+        """
+        paths = []
+        for spec in specs:
+            for root, _, names in os.walk(resolve_path(spec)):
+                paths.extend(os.path.join(root, n) for n in names)
+
+        # more files than the cache size would evict each other
+        paths = paths[:self._cache.maxsize]
+        if not paths:
+            return 0
+
+        pool = ThreadPool(max(1, min(workers, len(paths))))
+        try:
+            pool.map(self._prewarm_file, paths)
+        finally:
+            pool.close()
+            pool.join()
+        return len(paths)
+
+    def _prewarm_file(self, path):  # type: (str) -> None
+        try:
+            self.integrity(path)
+        except (IOError, OSError) as e:
+            logger.warning('(%s) Skip %s: %s', 'sri', path, e)
+
+
+def get_sri_service(registry):  # type: (Registry) -> SRIService
+    """Returns SRIService which is cached on registry (per config)."""
+    sri_config = load_config(registry).sri
+    cached = getattr(registry, '_pyramid_secure_response_sri', None)
+    if cached is not None and cached[0] is sri_config:
+        return cached[1]
+
+    service = SRIService(sri_config.algorithms, sri_config.cache_size)
+    # pylint: disable=protected-access
+    registry._pyramid_secure_response_sri = (sri_config, service)
+    return service
+
+
+def sri(request, spec):  # type: (Request, str) -> str
+    """Returns integrity metadata of the static asset.
+
+    This is added as ``request.sri()`` by ``config.include()``.
+
+    .. code:: html
+
+        <script src="${request.static_url('myapp:static/app.js')}"
+          integrity="${request.sri('myapp:static/app.js')}"
+          crossorigin="anonymous"></script>
+    """
+    return get_sri_service(request.registry).integrity(spec)
+
+
+def static_sri(request, spec, **kw):  # type: (Request, str, **str) -> tuple
+    """Returns StaticAsset (URL and integrity metadata) of the static asset.
+
+    This is added as ``request.static_sri()`` by ``config.include()``. The
+    spec is served by ``config.add_static_view()``, and the URL is generated
+    by ``request.static_url()`` with ``kw`` (e.g. ``_query``).
+
+    .. code:: html
+
+        <script tal:define="asset request.static_sri('myapp:static/app.js')"
+          src="${asset.url}" integrity="${asset.integrity}"
+          crossorigin="anonymous"></script>
+    """
+    return StaticAsset(request.static_url(spec, **kw), sri(request, spec))
+
+
+def prewarm(event):  # type: (ApplicationCreated) -> None
+    """Prewarms the cache for ``sri.prewarm`` at startup.
+
+    This is subscribed to ``ApplicationCreated`` by ``config.include()``.
+    """
+    registry = event.app.registry
+    sri_config = load_config(registry).sri
+    if sri_config.prewarm:
+        count = get_sri_service(registry).prewarm(
+            sri_config.prewarm, sri_config.workers)
+        logger.info('(%s) Prewarmed %d files', 'sri', count)
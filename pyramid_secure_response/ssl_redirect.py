@@ -1,50 +1,103 @@
-from pyramid.httpexceptions import HTTPMovedPermanently
+from pyramid.response import Response
 
+from pyramid_secure_response.secure_context import get_secure_context
 from pyramid_secure_response.util import (
     logger,
-    apply_path_filter,
-    get_config,
-    build_criteria,
+    load_config,
+    LRUCache,
 )
 
+REDIRECT_STATUSES = {
+    301: '301 Moved Permanently',
+    302: '302 Found',
+    307: '307 Temporary Redirect',
+    308: '308 Permanent Redirect',
+}
+
+
+def parse_status_code(status_code):  # type: (Union[int, str]) -> int
+    """Returns status code for redirect, or raises ValueError if invalid."""
+    try:
+        status_code = int(status_code)
+    except (TypeError, ValueError):
+        status_code = None
+    if status_code not in REDIRECT_STATUSES:
+        raise ValueError('invalid status_code for redirect')
+    return status_code
+
+
+def build_redirect_headers_f(cache_size=1024):  # type: (int) -> 'function'
+    """Returns a function which creates headers of redirect to https.
+
+    The headers are cached by (host, path) in LRU.
+    """
+    headers_cache = LRUCache(maxsize=cache_size)
+
+    def _redirect_headers(host, path):  # type: (str, str) -> tuple
+        key = (host, path)
+        headers = headers_cache.get(key)
+        if headers is None:
+            headers = headers_cache[key] = (
+                ('Location', 'https://{:s}{:s}'.format(host, path)),
+                ('Content-Length', '0'),
+            )
+        return headers
+
+    return _redirect_headers
+
+
+def build_redirect_f(status_code=301, cache_size=1024):
+    # type: (Union[int, str], int) -> 'function'
+    """Returns a function which creates redirect response to https.
+
+    The response is returned (not raised as HTTPException), so it does not go
+    through the exception view lookup.
+
+    >>> redirect = build_redirect_f(308)
+    >>> res = redirect('example.org', '/foo')
+    >>> res.status, res.location
+    ('308 Permanent Redirect', 'https://example.org/foo')
+    """
+    status = REDIRECT_STATUSES[parse_status_code(status_code)]
+    redirect_headers = build_redirect_headers_f(cache_size=cache_size)
+
+    def _redirect(host, path):  # type: (str, str) -> Response
+        return Response(status=status,
+                        headerlist=list(redirect_headers(host, path)),
+                        app_iter=[])
+
+    return _redirect
+
 
 def tween(handler, registry):
     """Redirects insecure HTTP request as configured.
 
     This tween does not handle request if insecure request comes.
     """
-    config = get_config(registry)
-
-    ssl_redirect = config.ssl_redirect
+    ssl_redirect = load_config(registry).ssl_redirect
+    if not ssl_redirect.enabled:
+        return handler
 
-    ignore_paths = config.ignore_paths
-    if ssl_redirect.ignore_paths:
-        ignore_paths = ssl_redirect.ignore_paths
+    ignore_paths = ssl_redirect.ignore_paths
+    proto_key = ssl_redirect.proto_key
 
-    proto_header = config.proto_header
-    if ssl_redirect.proto_header:
-        proto_header = ssl_redirect.proto_header
+    redirect = build_redirect_f(ssl_redirect.status_code)
 
     tween_name = 'ssl_redirect'
 
     def _ssl_redirect_tween(req):
-        if not ssl_redirect.enabled:
-            return handler(req)
+        ctx = get_secure_context(req)
 
         # ignore
-        if apply_path_filter(req, ignore_paths):
-            logger.info('(%s) Ignore path %s', tween_name, req.path)
+        if ctx.is_ignored(ignore_paths):
+            logger.info('(%s) Ignore path %s', tween_name, ctx.path)
             return handler(req)
 
-        criteria = build_criteria(req, proto_header=proto_header)
-        secure = all(criteria)
-
-        if secure:
+        if ctx.is_secure(proto_key):
             return handler(req)
 
-        logger.warning('(%s) Insecure request %s', tween_name, req.url)
+        logger.warning('(%s) Insecure request %s', tween_name, ctx.path)
 
-        raise HTTPMovedPermanently(location='https://{:s}{:s}'.format(
-            req.host, req.path))
+        return redirect(ctx.host, ctx.path)
 
     return _ssl_redirect_tween
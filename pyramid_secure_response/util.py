@@ -1,19 +1,98 @@
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+from fnmatch import translate
 import logging
+import re
 
 from pyramid_secure_response import __name__ as PACKAGE_NAME
 
 
 logger = logging.getLogger(PACKAGE_NAME)  # pylint: disable=invalid-name
 
+# hash algorithms for Subresource Integrity
+SRI_ALGORITHMS = ('sha256', 'sha384', 'sha512')
 
-def _get_config_value_f(registry, config_key=''):
-    # type: (Registry, str) -> 'function'
-    """Gets configured value from .ini file via registry."""
+# CSP directives (name, default) for csp_coverage and csp_report_only
+CSP_DIRECTIVES = (
+    # NOTE:
+    #   These directives are appended into header as alphabetical
+    #   order by directive sections.
+    # [fetch]
+    ('child_src', ''),  # (deprecated)
+    ('connect_src', ''),
+    ('default_src', ''),
+    ('font_src', ''),
+    ('frame_src', ''),
+    ('img_src', ''),
+    ('manifest_src', ''),
+    ('media_src', ''),
+    ('object_src', ''),
+    ('script_src', ''),
+    ('style_src', ''),
+    ('worker_src', ''),
+    # [document]
+    ('base_uri', ''),
+    ('plugin_types', ''),
+    ('sandbox', ''),
+    # [navigation]
+    ('form_action', ''),
+    ('frame_ancestors', ''),
+    # [reporting]
+    ('report_uri', ''),  # (deprecated)
+    ('report_to', ''),
+    # [other]
+    ('block_all_mixed_content', False),
+    ('referrer', ''),  # (obsolete)
+    ('require_sri_for', ''),
+    ('upgrade_insecure_requests', False),
+)
+
+# fallback lists of fetch directives (the first one which exists is used)
+FETCH_FALLBACKS = OrderedDict((
+    ('child_src', ('default_src',)),
+    ('connect_src', ('default_src',)),
+    ('font_src', ('default_src',)),
+    ('frame_src', ('child_src', 'default_src')),
+    ('img_src', ('default_src',)),
+    ('manifest_src', ('default_src',)),
+    ('media_src', ('default_src',)),
+    ('object_src', ('default_src',)),
+    ('script_src', ('default_src',)),
+    ('style_src', ('default_src',)),
+    ('worker_src', ('child_src', 'script_src', 'default_src')),
+))
+
+# modes of csp_report_only
+CSP_MODES = ('enforce', 'report_only', 'dual')
+
+# policies which can be overridden per host (host_policy.<name>.xxx)
+HOST_POLICY_SECTIONS = ('hsts_support', 'csp_coverage')
+
+# fields of these sections which are applied only by the global policies
+HOST_POLICY_GLOBAL_FIELDS = (
+    'hsts_support.ignore_paths',
+    'hsts_support.proto_header',
+    'hsts_support.content_types',
+    'csp_coverage.ignore_paths',
+)
+
+# media types (or `type/*`) of content_types
+MEDIA_TYPE_PATTERN = re.compile(r'\A[-\w.+]+/(?:\*|[-\w.+]+)\Z')
+
+# per-tenant policy files (policy_store.xxx)
+POLICY_STORE_DEFAULTS = (
+    ('path', ''),  # directory of <host>.json or <host>.ini
+    ('cache_size', '10000'),  # tenants in memory
+    ('factory', ''),  # dotted name of PolicyStore subclass
+)
+
+
+def _get_config_value_f(settings, config_key=''):
+    # type: (dict, str) -> 'function'
+    """Gets configured value from .ini file via settings."""
     if not config_key:
         raise ValueError
 
-    s = registry.settings
+    s = settings
 
     def _get_value_f(key, default):
         v = s.get('{:s}.{:s}'.format(config_key, key), default)
@@ -32,27 +111,47 @@ def _get_config_value_f(registry, config_key=''):
     return _get_value_f
 
 
-def _build_config(prefix='', defaults=tuple(), registry=None):
+_config_classes = {}
+
+
+def _build_config(prefix='', defaults=tuple(), settings=None):
     # pylint: disable=invalid-name
     if prefix:
         config_key = '{:s}.{:s}'.format(PACKAGE_NAME, prefix)
     else:
         config_key = PACKAGE_NAME
 
-    get_value_f = _get_config_value_f(registry, config_key=config_key)
+    get_value_f = _get_config_value_f(settings or {}, config_key=config_key)
+
+    values = dict([(k, get_value_f(k, v)) for k, v in defaults])
+    if 'ignore_paths' in values:
+        values['ignore_paths'] = compile_path_filter(values['ignore_paths'])
 
-    Config = namedtuple('Config', [k for k, _ in defaults])
-    return Config(**dict([(k, get_value_f(k, v)) for k, v in defaults]))
+    fields = tuple(k for k, _ in defaults)
+    try:
+        Config = _config_classes[fields]
+    except KeyError:  # classes are shared (e.g. for each tenant)
+        Config = _config_classes[fields] = namedtuple('Config', fields)
+    return Config(**values)
 
 
 def get_config(registry):  # type: (Registry) -> namedtuple
     """Returns namedtuple instance object has configuration."""
+    return parse_config(registry.settings)
+
+
+def parse_config(settings):  # type: (dict) -> namedtuple
+    """Returns namedtuple instance object has configuration from settings.
+
+    This is for use without Pyramid registry (e.g. WSGI middleware).
+    """
     # HTTP Redirections (ssl_redirect.xxx)
     ssl_redirect = _build_config(prefix='ssl_redirect', defaults=(
         ('enabled', True),
         ('proto_header', ''),
         ('ignore_paths', tuple()),
-    ), registry=registry)
+        ('status_code', '301'),  # 301, 302, 307 or 308
+    ), settings=settings)
 
     # HTTP Strict Transport Security (hsts_support.xxx)
     hsts_support = _build_config(prefix='hsts_support', defaults=(
@@ -62,45 +161,88 @@ def get_config(registry):  # type: (Registry) -> namedtuple
         ('max_age', '31536000'),  # seconds, 1 year
         ('include_subdomains', True),
         ('preload', True),
-    ), registry=registry)
+        ('content_types', tuple()),  # e.g. text/html (default: all)
+    ), settings=settings)
 
     # Content Security Policy (csp_coverage.xxx)
     csp_coverage = _build_config(prefix='csp_coverage', defaults=(
         ('enabled', True),
         ('ignore_paths', tuple()),
+        ('minify', False),  # minify directives at startup
+        # the policy is set only for these types (default: all), and the
+        # minimal one for minimal_content_types (e.g. application/json)
+        ('content_types', tuple()),
+        ('minimal_content_types', tuple()),
+        ('minimal_policy', "default-src 'none'; frame-ancestors 'none'"),
+    ) + CSP_DIRECTIVES, settings=settings)
+
+    # Report-Only rollout of CSP (csp_report_only.xxx)
+    # * report_only: csp_coverage policy is only reported
+    # * dual: csp_coverage policy is enforced, and the directives of
+    #   csp_report_only are reported
+    csp_report_only = _build_config(prefix='csp_report_only', defaults=(
+        ('mode', 'enforce'),  # enforce, report_only or dual
+        ('sample_rate', '1'),  # fraction of clients get report-only header
+        ('sample_cookie', ''),  # cookie to bucket clients (default: address)
+    ) + CSP_DIRECTIVES, settings=settings)
+
+    # Other security headers (security_headers.xxx)
+    security_headers = _build_config(prefix='security_headers', defaults=(
+        ('enabled', True),
+        ('ignore_paths', tuple()),
+        ('x_content_type_options', ''),  # e.g. nosniff
+        ('referrer_policy', ''),
+        ('permissions_policy', ''),
+        ('cross_origin_opener_policy', ''),
+        ('cross_origin_embedder_policy', ''),
+        ('reporting_endpoints', ''),
+    ), settings=settings)
+
+    # Hash-sources of inline scripts/styles for csp_coverage (csp_hashes.xxx)
+    csp_hashes = _build_config(prefix='csp_hashes', defaults=(
+        ('enabled', False),
+        ('dirs', tuple()),  # template (or static) directories
+        ('extensions', '.html .htm .pt .jinja2 .mako'),
+        ('manifest', ''),  # path to the cache file
+        ('workers', ''),  # processes (default: cpu count)
+        ('responses', False),  # hash inline scripts in rendered responses
+        # the hash-sources are only reported unless enforced (allows XSS)
+        ('enforce_responses', False),
+    ), settings=settings)
+
+    # Receiver of CSP violation reports (csp_report.xxx)
+    csp_report = _build_config(prefix='csp_report', defaults=(
+        ('path', '/csp-report'),
+        ('spool', ''),  # path to the append-only file (JSON lines)
+        ('store', ''),  # path to the SQLite database (instead of spool)
+        ('retention', ''),  # seconds to keep reports in the store
+        ('max_body_size', '65536'),  # bytes
+        ('queue_size', '10000'),
+        ('batch_size', '500'),
+        ('interval', '1'),  # seconds to flush
+        ('rollup', False),  # write rollups of reports instead of each one
+        ('rollup_size', '10000'),  # fingerprints in memory
+        ('rollup_interval', '60'),  # seconds to flush
+    ), settings=settings)
 
-        # NOTE:
-        #   These directives are appended into header as alphabetical
-        #   order by directive sections.
-        # [fetch]
-        ('child_src', ''),  # (deprecated)
-        ('connect_src', ''),
-        ('default_src', ''),
-        ('font_src', ''),
-        ('frame_src', ''),
-        ('img_src', ''),
-        ('manifest_src', ''),
-        ('media_src', ''),
-        ('object_src', ''),
-        ('script_src', ''),
-        ('style_src', ''),
-        ('worker_src', ''),
-        # [document]
-        ('base_uri', ''),
-        ('plugin_types', ''),
-        ('sandbox', ''),
-        # [navigation]
-        ('form_action', ''),
-        ('frame_ancestors', ''),
-        # [reporting]
-        ('report_uri', ''),  # (deprecated)
-        ('report_to', ''),
-        # [other]
-        ('block_all_mixed_content', False),
-        ('referrer', ''),  # (obsolete)
-        ('require_sri_for', ''),
-        ('upgrade_insecure_requests', False),
-    ), registry=registry)
+    # Subresource Integrity for static assets (sri.xxx)
+    sri = _build_config(prefix='sri', defaults=(
+        ('algorithms', 'sha384'),  # sha256, sha384 or sha512
+        ('cache_size', '1024'),
+        ('prewarm', tuple()),  # asset specs or directories
+        ('workers', '4'),  # threads to prewarm
+    ), settings=settings)
+
+    # Per-tenant policy files loaded on first use (policy_store.xxx)
+    policy_store = _build_config(prefix='policy_store',
+                                 defaults=POLICY_STORE_DEFAULTS,
+                                 settings=settings)
+
+    # Hot reload of policy file (policy_reload.xxx)
+    policy_reload = _build_config(prefix='policy_reload', defaults=(
+        ('path', ''),  # JSON or INI file of hsts_support and csp_coverage
+        ('interval', '2'),  # seconds to check mtime of the file
+    ), settings=settings)
 
     # Shared
     return _build_config(prefix='', defaults=(
@@ -110,22 +252,832 @@ def get_config(registry):  # type: (Registry) -> namedtuple
         ('ssl_redirect', ssl_redirect),
         ('hsts_support', hsts_support),
         ('csp_coverage', csp_coverage),
-    ), registry=registry)
+        ('csp_report_only', csp_report_only),
+        ('csp_hashes', csp_hashes),
+        ('csp_report', csp_report),
+        ('security_headers', security_headers),
+        ('sri', sri),
+        ('policy_store', policy_store),
+        ('policy_reload', policy_reload),
+    ), settings=settings)
 
 
-def apply_path_filter(req, paths):  # type: (Request, tuple) -> bool
+class _SlotsConfig(object):
+    """Base of configuration objects which have only flattened fields."""
+
+    __slots__ = ()
+
+    def __init__(self, **kwargs):
+        for name in self.__slots__:
+            setattr(self, name, kwargs[name])
+
+    def __repr__(self):
+        return '{:s}({:s})'.format(self.__class__.__name__, ', '.join(
+            '{:s}={!r}'.format(n, getattr(self, n)) for n in self.__slots__))
+
+
+class SSLRedirectConfig(_SlotsConfig):
+    __slots__ = (
+        'enabled',
+        'ignore_paths',
+        'proto_header',
+        'proto_key',
+        'status_code',
+    )
+
+
+class HSTSSupportConfig(_SlotsConfig):
+    __slots__ = (
+        'enabled',
+        'ignore_paths',
+        'proto_header',
+        'proto_key',
+        'max_age',
+        'include_subdomains',
+        'preload',
+        'content_types',  # ContentTypeMap (type: True) or None
+    )
+
+
+class CSPCoverageConfig(_SlotsConfig):
+    __slots__ = (
+        'enabled',
+        'ignore_paths',
+        'directives',  # OrderedDict (name, value)
+        'report_only_directives',  # OrderedDict (name, value)
+        'sample_rate',
+        'sample_cookie',
+        'hash_responses',
+        'enforce_hash_responses',
+        'content_types',  # ContentTypeMap (type: True or value) or None
+    )
+
+
+class SecurityHeadersConfig(_SlotsConfig):
+    __slots__ = (
+        'enabled',
+        'ignore_paths',
+        'headers',  # tuple of (name, value)
+    )
+
+
+class CSPReportConfig(_SlotsConfig):
+    __slots__ = (
+        'path',
+        'spool',
+        'store',
+        'retention',
+        'max_body_size',
+        'queue_size',
+        'batch_size',
+        'interval',
+        'rollup',
+        'rollup_size',
+        'rollup_interval',
+    )
+
+
+class SRIConfig(_SlotsConfig):
+    __slots__ = (
+        'algorithms',
+        'cache_size',
+        'prewarm',
+        'workers',
+    )
+
+
+class PolicyReloadConfig(_SlotsConfig):
+    __slots__ = (
+        'path',
+        'interval',
+    )
+
+
+class Config(_SlotsConfig):
+    __slots__ = (
+        'proto_header',
+        'proto_key',
+        'ignore_paths',
+        'ssl_redirect',
+        'hsts_support',
+        'csp_coverage',
+        'csp_report',
+        'security_headers',
+        'sri',
+        'host_policies',  # HostMap (host: Config) or None
+        'policy_store',  # PolicyStore or None
+        'policy_reload',
+        'scanned',  # hash-sources by csp_hashes settings (shared)
+    )
+
+
+def _validate_numbers(config):  # type: (namedtuple) -> None
+    max_age = config.hsts_support.max_age
+    if not str(max_age).isdigit():
+        raise ValueError('invalid hsts_support.max_age {!r}'.format(max_age))
+
+    for key in ('csp_hashes.workers',
+                'csp_report.retention',
+                'csp_report.max_body_size',
+                'csp_report.queue_size',
+                'csp_report.batch_size',
+                'csp_report.rollup_size',
+                'policy_store.cache_size',
+                'sri.cache_size',
+                'sri.workers'):
+        name, field = key.split('.')
+        value = getattr(getattr(config, name), field)
+        if value and not str(value).isdigit():
+            raise ValueError('invalid {:s} {!r}'.format(key, value))
+
+    for key in ('csp_report.interval',
+                'csp_report.rollup_interval',
+                'policy_reload.interval'):
+        name, field = key.split('.')
+        value = getattr(getattr(config, name), field)
+        try:
+            float(value)
+        except ValueError:
+            raise ValueError('invalid {:s} {!r}'.format(key, value))
+
+
+def _validate_csp_report_only(config):  # type: (namedtuple) -> None
+    report_only = config.csp_report_only
+    if report_only.mode not in CSP_MODES:
+        raise ValueError('invalid csp_report_only.mode {!r}'.format(
+            report_only.mode))
+
+    try:
+        sample_rate = float(report_only.sample_rate)
+    except ValueError:
+        sample_rate = -1
+    if not 0 <= sample_rate <= 1:
+        raise ValueError('invalid csp_report_only.sample_rate {!r}'.format(
+            report_only.sample_rate))
+
+    if report_only.mode == 'dual' and \
+       not any(getattr(report_only, k) for k, _ in CSP_DIRECTIVES):
+        raise ValueError('csp_report_only directives are required for dual')
+
+
+def _validate_settings(settings, config):  # type: (dict, namedtuple) -> None
+    """Raises ValueError for invalid values in settings."""
+    _validate_numbers(config)
+    _validate_csp_report_only(config)
+
+    for algorithm in _split(config.sri.algorithms):
+        if algorithm not in SRI_ALGORITHMS:
+            raise ValueError('invalid sri.algorithms {!r}'.format(algorithm))
+
+    for name in ('csp_coverage', 'csp_report_only'):
+        prefix = '{:s}.{:s}.'.format(PACKAGE_NAME, name)
+        directives = getattr(config, name)._fields
+        for key in settings or {}:
+            if key.startswith(prefix) and key[len(prefix):] not in directives:
+                raise ValueError('unknown {:s} directive {!r}'.format(
+                    name, key[len(prefix):]))
+
+
+def _split(value):  # type: (Union[str, tuple]) -> tuple
+    return tuple(value.split()) if hasattr(value, 'split') else tuple(value)
+
+
+def _minify_csp_directives(directives, report_only=False):
+    # type: (OrderedDict, bool) -> OrderedDict
+    # pylint: disable=import-outside-toplevel,cyclic-import
+    from pyramid_secure_response.csp_minify import minify_csp_directives
+
+    minified, report = minify_csp_directives(directives, report_only)
+    for warning in report.warnings:
+        logger.warning('(%s) %s', 'csp_minify', warning)
+    logger.info('(%s) Minified CSP from %d to %d bytes (%d saved)',
+                'csp_minify', report.before, report.after,
+                report.before - report.after)
+    return minified
+
+
+def _scan_hash_sources(c, scanned):  # type: (namedtuple, dict) -> tuple
+    csp_hashes = c.csp_hashes
+    key = (_split(csp_hashes.dirs), _split(csp_hashes.extensions),
+           csp_hashes.manifest)
+    if key not in scanned:  # scanned once also for host policies
+        # pylint: disable=import-outside-toplevel,cyclic-import
+        from pyramid_secure_response.csp_hashes import scan
+
+        scanned[key] = scan(
+            key[0], extensions=key[1], manifest=key[2],
+            workers=int(csp_hashes.workers or 0))
+    return scanned[key]
+
+
+def _compile_csp_policies(c, scanned):  # type: (namedtuple, dict) -> tuple
+    """Returns directives to enforce and to report by the mode."""
+    policies = [c.csp_coverage]
+    if c.csp_report_only.mode == 'dual':
+        policies.append(c.csp_report_only)
+    policies = [OrderedDict((k, getattr(p, k)) for k, _ in CSP_DIRECTIVES)
+                for p in policies]
+
+    if c.csp_coverage.enabled and c.csp_hashes.enabled:
+        # pylint: disable=import-outside-toplevel,cyclic-import
+        from pyramid_secure_response.csp_hashes import merge_hash_sources
+
+        script_sources, style_sources = _scan_hash_sources(c, scanned)
+        policies = [merge_hash_sources(p, script_sources, style_sources)
+                    for p in policies]
+
+    if c.csp_coverage.minify:
+        # the first one is reported in report_only mode, the second in dual
+        report_only = c.csp_report_only.mode == 'report_only'
+        policies = [_minify_csp_directives(p, report_only or i > 0)
+                    for i, p in enumerate(policies)]
+
+    if c.csp_report_only.mode == 'report_only':
+        return OrderedDict(), policies[0]
+    return policies[0], policies[1] if len(policies) > 1 else OrderedDict()
+
+
+def _compile_security_headers(c):  # type: (namedtuple) -> tuple
+    # pylint: disable=import-outside-toplevel,cyclic-import
+    from pyramid_secure_response.security_headers import (
+        build_security_headers,
+    )
+
+    return build_security_headers(c.security_headers)
+
+
+def _compile_content_types(types, minimal_types=(), minimal_value=None):
+    # type: (tuple, tuple, str) -> Union[ContentTypeMap, None]
+    """Returns ContentTypeMap of values for types, or None if not given.
+
+    The value is True for types, minimal_value for minimal_types and None for
+    others (or True, if types are not given).
+    """
+    types, minimal_types = _split(types), _split(minimal_types)
+    if not (types or minimal_types):
+        return None
+
+    content_types = ContentTypeMap(default=None if types else True)
+    for content_type in types:
+        content_types.add(content_type, True)
+    for content_type in minimal_types:
+        content_types.add(content_type, minimal_value or None)
+    return content_types
+
+
+def _compile_host_policies(settings, scanned):
+    # type: (dict, dict) -> Union[HostMap, None]
+    """Returns HostMap of Config for hosts in ``host_policy.<name>.hosts``.
+
+    Each Config is compiled from the settings overridden by
+    ``host_policy.<name>.hsts_support.xxx`` and ``...csp_coverage.xxx``.
+    """
+    prefix = '{:s}.host_policy.'.format(PACKAGE_NAME)
+    base = {}
+    overrides = {}
+    for key, value in (settings or {}).items():
+        if key.startswith(prefix):
+            name, _, field = key[len(prefix):].partition('.')
+            overrides.setdefault(name, {})[field] = value
+        else:
+            base[key] = value
+    if not overrides:
+        return None
+
+    hosts = HostMap()
+    for name, fields in sorted(overrides.items()):
+        patterns = _split(fields.pop('hosts', ''))
+        if not patterns:
+            raise ValueError('host_policy.{:s}.hosts is required'.format(name))
+        for field in fields:
+            if field.split('.')[0] not in HOST_POLICY_SECTIONS or \
+               field in HOST_POLICY_GLOBAL_FIELDS:
+                raise ValueError('host_policy.{:s}.{:s} can not be '
+                                 'overridden'.format(name, field))
+
+        host_settings = dict(base)
+        host_settings.update(('{:s}.{:s}'.format(PACKAGE_NAME, field), value)
+                             for field, value in fields.items())
+        config = _compile_config(host_settings, scanned)
+        for pattern in patterns:
+            hosts.add(pattern, config)
+    return hosts
+
+
+def _compile_policy_store(settings, scanned):
+    # type: (dict, dict) -> Union[PolicyStore, None]
+    # only this group (the others are parsed in _compile_config)
+    policy_store = _build_config(prefix='policy_store',
+                                 defaults=POLICY_STORE_DEFAULTS,
+                                 settings=settings)
+    if not (policy_store.path or policy_store.factory):
+        return None
+
+    # pylint: disable=import-outside-toplevel,cyclic-import
+    from pyramid.path import DottedNameResolver
+    from pyramid_secure_response.policy_store import PolicyStore
+
+    factory = DottedNameResolver().maybe_resolve(
+        policy_store.factory or PolicyStore)
+    return factory(policy_store.path, settings,
+                   cache_size=int(policy_store.cache_size), scanned=scanned)
+
+
+def compile_config(settings, base=None):  # type: (dict, Config) -> Config
+    """Returns validated Config object from settings.
+
+    The fallback values (``proto_header`` and ``ignore_paths``) are resolved
+    into each policy. If ``csp_hashes`` is enabled, the hash-sources of
+    inline scripts and styles are merged into the CSP directives. The CSP
+    directives are split into enforced and report-only ones by
+    ``csp_report_only.mode``. Policies per host (``host_policy.xxx``) are
+    compiled into ``host_policies``, and the ones in ``policy_store.path``
+    are compiled on first use (see `PolicyStore`).
+
+    If the base Config is given (e.g. by `PolicyWatcher`), its scanned
+    hash-sources and policy store are reused, and only the header policies
+    are compiled.
+    """
+    scanned = {} if base is None else base.scanned
+    config = _compile_config(settings, scanned)
+    config.host_policies = _compile_host_policies(settings, scanned)
+    config.policy_store = _compile_policy_store(settings, scanned) \
+        if base is None else base.policy_store
+    return config
+
+
+def _compile_config(settings, scanned):  # type: (dict, dict) -> Config
+    c = parse_config(settings)
+    _validate_settings(settings, c)
+
+    def _resolve(policy, name):
+        return getattr(policy, name) or getattr(c, name)
+
+    ssl_redirect, hsts_support, csp_coverage = \
+        c.ssl_redirect, c.hsts_support, c.csp_coverage
+    directives, report_only_directives = _compile_csp_policies(c, scanned)
+    return Config(
+        proto_header=c.proto_header,
+        proto_key=get_proto_environ_key(c.proto_header),
+        ignore_paths=c.ignore_paths,
+        ssl_redirect=SSLRedirectConfig(
+            enabled=ssl_redirect.enabled,
+            ignore_paths=_resolve(ssl_redirect, 'ignore_paths'),
+            proto_header=_resolve(ssl_redirect, 'proto_header'),
+            proto_key=get_proto_environ_key(
+                _resolve(ssl_redirect, 'proto_header')),
+            status_code=ssl_redirect.status_code,
+        ),
+        hsts_support=HSTSSupportConfig(
+            enabled=hsts_support.enabled,
+            ignore_paths=_resolve(hsts_support, 'ignore_paths'),
+            proto_header=_resolve(hsts_support, 'proto_header'),
+            proto_key=get_proto_environ_key(
+                _resolve(hsts_support, 'proto_header')),
+            max_age=int(hsts_support.max_age),
+            include_subdomains=hsts_support.include_subdomains,
+            preload=hsts_support.preload,
+            content_types=_compile_content_types(hsts_support.content_types),
+        ),
+        csp_coverage=CSPCoverageConfig(
+            enabled=csp_coverage.enabled,
+            ignore_paths=_resolve(csp_coverage, 'ignore_paths'),
+            directives=directives,
+            report_only_directives=report_only_directives,
+            sample_rate=float(c.csp_report_only.sample_rate),
+            sample_cookie=c.csp_report_only.sample_cookie,
+            hash_responses=c.csp_hashes.responses,
+            enforce_hash_responses=c.csp_hashes.enforce_responses,
+            content_types=_compile_content_types(
+                csp_coverage.content_types,
+                csp_coverage.minimal_content_types,
+                ' '.join(_split(csp_coverage.minimal_policy))),
+        ),
+        csp_report=CSPReportConfig(
+            path=c.csp_report.path,
+            spool=c.csp_report.spool,
+            store=c.csp_report.store,
+            retention=int(c.csp_report.retention or 0),
+            max_body_size=int(c.csp_report.max_body_size),
+            queue_size=int(c.csp_report.queue_size),
+            batch_size=int(c.csp_report.batch_size),
+            interval=float(c.csp_report.interval),
+            rollup=c.csp_report.rollup,
+            rollup_size=int(c.csp_report.rollup_size),
+            rollup_interval=float(c.csp_report.rollup_interval),
+        ),
+        security_headers=SecurityHeadersConfig(
+            enabled=c.security_headers.enabled,
+            ignore_paths=_resolve(c.security_headers, 'ignore_paths'),
+            headers=_compile_security_headers(c),
+        ),
+        sri=SRIConfig(
+            algorithms=_split(c.sri.algorithms),
+            cache_size=int(c.sri.cache_size),
+            prewarm=_split(c.sri.prewarm),
+            workers=int(c.sri.workers),
+        ),
+        host_policies=None,
+        policy_store=None,
+        policy_reload=PolicyReloadConfig(
+            path=c.policy_reload.path,
+            interval=float(c.policy_reload.interval),
+        ),
+        scanned=scanned,
+    )
+
+
+def load_config(registry):  # type: (Registry) -> Config
+    """Returns Config object which is cached on registry.
+
+    It's parsed and validated only once for the settings of registry, and
+    shared between tweens.
+    """
+    settings = registry.settings
+    cached = getattr(registry, '_pyramid_secure_response_config', None)
+    if cached is not None and cached[0] is settings:
+        return cached[1]
+
+    config = compile_config(settings)
+    # pylint: disable=protected-access
+    registry._pyramid_secure_response_config = (settings, config)
+    return config
+
+
+class LRUCache(object):
+    """Bounded mapping which evicts the least recently used item.
+
+    This does not take any lock. Each operation on the underlying OrderedDict
+    is atomic, and an item evicted by another thread at the same time is just
+    treated as a cache miss.
+
+    >>> cache = LRUCache(maxsize=2)
+    >>> cache['a'], cache['b'] = 1, 2
+    >>> cache.get('a')
+    1
+    >>> cache['c'] = 3
+    >>> cache.get('b') is None
+    True
+    """
+
+    def __init__(self, maxsize=1024):  # type: (int) -> None
+        if maxsize < 1:
+            raise ValueError('maxsize must be positive')
+
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        data = self._data
+        try:
+            if hasattr(data, 'move_to_end'):
+                data.move_to_end(key)  # as most recently used
+            else:  # Python 2.7
+                data[key] = data.pop(key)
+            return data[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        data = self._data
+        data[key] = value
+        try:
+            while len(data) > self.maxsize:
+                data.popitem(last=False)
+        except KeyError:
+            pass
+
+    def clear(self):
+        self._data.clear()
+
+
+class _Node(object):  # pylint: disable=too-few-public-methods
+    """Node of the path segment trie."""
+
+    __slots__ = ('children', 'prefixes', 'lengths')
+
+    def __init__(self):
+        self.children = {}  # full segment -> _Node
+        self.prefixes = set()  # last (partial) segments of paths
+        self.lengths = ()
+
+
+class PathFilter(tuple):
+    """Ignore paths compiled into a path segment trie.
+
+    This is still a tuple of the given paths, and matches a path as same as
+    ``str.startswith()`` for each path. Paths prefixed with ``glob:`` (match
+    whole path as shell-style wildcards) or ``re:`` (match regular
+    expression at beginning of path) are also supported.
+
+    >>> f = PathFilter(('/static/', '/_ah/health', 'glob:/*/hook/*.json'))
+    >>> f.match('/static/img/a.png'), f.match('/_ah/healthz')
+    (True, True)
+    >>> f.match('/a/hook/b.json'), f.match('/staticfiles')
+    (True, False)
+    """
+
+    def __new__(cls, paths=tuple(), cache_size=1024):
+        if isinstance(paths, str):
+            paths = (paths,)
+        return super(PathFilter, cls).__new__(cls, paths)
+
+    def __init__(self, paths=tuple(), cache_size=1024):
+        # pylint: disable=unused-argument
+        super(PathFilter, self).__init__()
+
+        self._root = _Node()
+        self._pattern = None
+        self._cache = LRUCache(maxsize=cache_size) if cache_size else None
+
+        patterns = []
+        for path in self:
+            if path.startswith('glob:'):
+                patterns.append(translate(path[5:]))
+            elif path.startswith('re:'):
+                patterns.append(path[3:])
+            else:
+                self._add(path)
+
+        if patterns:
+            self._pattern = re.compile(
+                '|'.join('(?:{:s})'.format(p) for p in patterns))
+
+    def _add(self, path):  # type: (str) -> None
+        segments = path.split('/')
+        node = self._root
+        for segment in segments[:-1]:
+            node = node.children.setdefault(segment, _Node())
+        node.prefixes.add(segments[-1])
+        node.lengths = tuple(sorted(set(len(p) for p in node.prefixes)))
+
+    def _match(self, path):  # type: (str) -> bool
+        node = self._root
+        for segment in path.split('/'):
+            for length in node.lengths:
+                if segment[:length] in node.prefixes:
+                    return True
+            node = node.children.get(segment)
+            if node is None:
+                break
+
+        if self._pattern is not None:
+            return self._pattern.match(path) is not None
+        return False
+
+    def match(self, path):  # type: (str) -> bool
+        """Returns True if path is matched with any of paths."""
+        if self._cache is None:
+            return self._match(path)
+
+        result = self._cache.get(path)
+        if result is None:
+            result = self._match(path)
+            self._cache[path] = result
+        return result
+
+
+# compiled filters by paths (bounded, e.g. for reloaded and tenant policies)
+_path_filters = LRUCache(maxsize=1024)
+
+
+def compile_path_filter(paths):  # type: (Union[str, tuple]) -> PathFilter
+    """Returns PathFilter for paths.
+
+    The same paths share an instance, so that decisions for them can be
+    shared also (e.g. by `SecureContext`).
+    """
+    if isinstance(paths, str):
+        paths = (paths,)
+    paths = tuple(paths)
+    path_filter = _path_filters.get(paths)
+    if path_filter is None:
+        path_filter = _path_filters[paths] = PathFilter(paths)
+    return path_filter
+
+
+def match_path(path, paths):  # type: (str, tuple) -> bool
+    """Returns True if path starts with any of paths."""
     if paths:
-        return any([req.path.startswith(path) for path in paths])
+        if isinstance(paths, PathFilter):
+            return paths.match(path)
+        return any([path.startswith(p) for p in paths])
     return False
 
 
+def apply_path_filter(req, paths):  # type: (Request, tuple) -> bool
+    return match_path(req.path, paths)
+
+
+def normalize_host(host):  # type: (str) -> str
+    """Returns lowercased host without port and trailing dot.
+
+    >>> normalize_host('WWW.Example.org.:8080')
+    'www.example.org'
+    >>> normalize_host('[::1]:6543')
+    '[::1]'
+    """
+    host = host.lower()
+    if host.startswith('['):  # IPv6
+        return host[:host.find(']') + 1]
+    return host.partition(':')[0].rstrip('.')
+
+
+_MISSING = object()
+
+
+class HostMap(object):
+    """Mapping from hosts (and wildcard domains) to values.
+
+    Exact hosts are looked up in a dict. Wildcard domains (``*.example.org``
+    matches any subdomain, but not ``example.org``) are looked up in an index
+    of reversed labels, and the longest one wins. Resolved hosts are cached,
+    so the cost per request doesn't depend on the number of hosts.
+
+    >>> hosts = HostMap(default='global')
+    >>> hosts.add('example.org', 'a')
+    >>> hosts.add('*.example.org', 'b')
+    >>> hosts.resolve('Example.org:443'), hosts.resolve('www.example.org')
+    ('a', 'b')
+    >>> hosts.resolve('example.com')
+    'global'
+    """
+
+    def __init__(self, default=None, cache_size=1024):
+        # type: (object, int) -> None
+        self.default = default
+
+        self._items = []
+        self._exact = {}
+        self._suffixes = {}  # label: {label: ..., None: value}
+        self._cache = LRUCache(maxsize=cache_size)
+
+    def __len__(self):
+        return len(self._items)
+
+    def items(self):  # type: () -> list
+        """Returns (pattern, value) pairs in added order."""
+        return list(self._items)
+
+    def add(self, pattern, value):  # type: (str, object) -> None
+        """Adds value for host or wildcard domain.
+
+        Raises ValueError if the pattern is already added.
+        """
+        pattern = normalize_host(pattern)
+        if pattern.startswith('*.'):
+            node = self._suffixes
+            for label in reversed(pattern[2:].split('.')):
+                node = node.setdefault(label, {})
+            if None in node:
+                raise ValueError('duplicate host {!r}'.format(pattern))
+            node[None] = value
+        elif '*' in pattern or not pattern:
+            raise ValueError('invalid host {!r}'.format(pattern))
+        else:
+            if pattern in self._exact:
+                raise ValueError('duplicate host {!r}'.format(pattern))
+            self._exact[pattern] = value
+
+        self._items.append((pattern, value))
+        self._cache.clear()
+
+    def map(self, f, default=None):  # type: (function, object) -> HostMap
+        """Returns new HostMap which has values applied f."""
+        hosts = HostMap(default=default, cache_size=self._cache.maxsize)
+        for pattern, value in self._items:
+            hosts.add(pattern, f(value))
+        return hosts
+
+    def _resolve(self, host):  # type: (str) -> object
+        host = normalize_host(host)
+        try:
+            return self._exact[host]
+        except KeyError:
+            pass
+
+        value = self.default
+        node = self._suffixes
+        # the first label is never matched by the wildcard
+        for label in reversed(host.split('.')[1:]):
+            node = node.get(label)
+            if node is None:
+                break
+            value = node.get(None, value)
+        return value
+
+    def resolve(self, host):  # type: (str) -> object
+        """Returns value for the host (``Host`` header), or the default."""
+        value = self._cache.get(host, _MISSING)
+        if value is _MISSING:
+            value = self._cache[host] = self._resolve(host)
+        return value
+
+
+class ContentTypeMap(object):
+    """Mapping from media types (and ``type/*``) to values.
+
+    The parameters of Content-Type (e.g. ``; charset=UTF-8``) are ignored.
+    Resolved values are cached by the Content-Type header value, so the cost
+    per response is a dict lookup.
+
+    >>> types = ContentTypeMap(default='asset')
+    >>> types.add('text/html', 'document')
+    >>> types.add('application/*', 'api')
+    >>> types.resolve('text/html; charset=UTF-8')
+    'document'
+    >>> types.resolve('application/json'), types.resolve('image/png')
+    ('api', 'asset')
+    """
+
+    def __init__(self, default=None, cache_size=256):
+        # type: (object, int) -> None
+        self.default = default
+
+        self._types = OrderedDict()
+        self._cache = LRUCache(maxsize=cache_size)
+
+    def __len__(self):
+        return len(self._types)
+
+    def items(self):  # type: () -> list
+        """Returns (pattern, value) pairs in added order."""
+        return list(self._types.items())
+
+    def add(self, pattern, value):  # type: (str, object) -> None
+        """Adds value for media type or ``type/*``.
+
+        Raises ValueError for invalid or duplicate pattern.
+        """
+        pattern = pattern.strip().lower()
+        if not MEDIA_TYPE_PATTERN.match(pattern):
+            raise ValueError('invalid content type {!r}'.format(pattern))
+        if pattern in self._types:
+            raise ValueError('duplicate content type {!r}'.format(pattern))
+        self._types[pattern] = value
+        self._cache.clear()
+
+    def _resolve(self, content_type):  # type: (str) -> object
+        media_type = content_type.partition(';')[0].strip().lower()
+        for key in (media_type, media_type.partition('/')[0] + '/*'):
+            if key in self._types:
+                return self._types[key]
+        return self.default
+
+    def resolve(self, content_type):  # type: (str) -> object
+        """Returns value for the Content-Type (or the default)."""
+        value = self._cache.get(content_type, _MISSING)
+        if value is _MISSING:
+            value = self._cache[content_type] = self._resolve(content_type)
+        return value
+
+
+def get_proto_environ_key(proto_header):  # type: (str) -> str
+    """Returns WSGI environ key for the proto header.
+
+    >>> get_proto_environ_key('X-Forwarded-Proto')
+    'HTTP_X_FORWARDED_PROTO'
+    >>> get_proto_environ_key('')
+    ''
+    """
+    if not proto_header:
+        return ''
+    return 'HTTP_{:s}'.format(proto_header.upper().replace('-', '_'))
+
+
+def is_secure_environ(environ, proto_key=''):  # type: (dict, str) -> bool
+    """Returns True if the request is on https, from WSGI environ.
+
+    The `proto_key` must be an environ key (see `get_proto_environ_key()`).
+    Its value must be ``https`` in addition to ``wsgi.url_scheme``, if given.
+    """
+    if environ.get('wsgi.url_scheme') != 'https':
+        return False
+    if proto_key:
+        return environ.get(proto_key, 'http') == 'https'
+    return True
+
+
+def is_secure_request(req, proto_key=''):  # type: (Request, str) -> bool
+    """Returns True if the request is on https.
+
+    This works as same as `all(build_criteria(req, proto_header=...))`, but
+    reads only environ instead of building URL.
+    """
+    return is_secure_environ(req.environ, proto_key)
+
+
 def build_criteria(req, **kwargs):  # type: (Request, dict) -> tuple
     """Builds criteria contains about incoming request.
 
-    This function is used for following tweens:
-
-    * ssl_redirect
-    * hsts_support
+    This builds ``req.url``. Use `is_secure_request()` to check it per
+    request in tweens.
     """
     criteria = [
         req.url.startswith('https://'),
@@ -0,0 +1,125 @@
+from itertools import product
+
+try:
+    from urllib.parse import quote
+except ImportError:  # Python 2.7
+    from urllib import quote  # pylint: disable=no-name-in-module
+
+from pyramid_secure_response import csp_coverage, hsts_support
+from pyramid_secure_response.secure_response import build_plan
+from pyramid_secure_response.ssl_redirect import (
+    REDIRECT_STATUSES,
+    build_redirect_headers_f,
+)
+from pyramid_secure_response.util import (
+    logger,
+    is_secure_environ,
+    match_path,
+    compile_config,
+)
+
+# same as webob.request.PATH_SAFE
+PATH_SAFE = "/~!$&'()*+,;=:@"
+
+
+def get_host(environ):  # type: (dict) -> str
+    """Returns host as same as ``webob.request.BaseRequest.host``."""
+    if 'HTTP_HOST' in environ:
+        return environ['HTTP_HOST']
+    return '{:s}:{:s}'.format(environ['SERVER_NAME'], environ['SERVER_PORT'])
+
+
+def get_path(environ):  # type: (dict) -> str
+    """Returns path as same as ``webob.request.BaseRequest.path``."""
+    path = environ.get('SCRIPT_NAME', '') + environ.get('PATH_INFO', '')
+    if str is not bytes:  # PEP 3333: native string decoded as latin-1
+        path = path.encode('latin-1')
+    return quote(path, PATH_SAFE)
+
+
+class SecureResponseMiddleware(object):
+    """WSGI middleware applies all policies except for report-only CSP.
+
+    This works with the same settings as the tweens, but before any
+    Pyramid/WebOb request is created.
+
+    * insecure request is answered with a pre-rendered redirect
+    * HSTS/CSP headers are appended as precompiled tuples in start_response
+    * app_iter is passed through without buffering
+
+    >>> from pyramid.config import Configurator
+    >>> settings = {'pyramid_secure_response.csp_coverage.default_src': 'self'}
+    >>> config = Configurator(settings=settings)
+    >>> app = SecureResponseMiddleware(config.make_wsgi_app(), settings)
+    """
+
+    def __init__(self, app, settings=None):  # type: (object, dict) -> None
+        self.app = app
+
+        plan = build_plan(compile_config(settings))
+        self.redirect = plan.ssl_redirect
+        self.hsts = plan.hsts_support
+        self.csp = plan.csp_coverage
+        self.bundle = plan.security_headers
+
+        if self.redirect:
+            self.redirect_status = REDIRECT_STATUSES[self.redirect.value]
+            self.redirect_headers = build_redirect_headers_f()
+
+        # header tuples to append (and their lower names) by
+        # (hsts, csp, security_headers)
+        hsts_header = (hsts_support.HEADER_KEY, self.hsts.value) \
+            if self.hsts else None
+        csp_header = (csp_coverage.HEADER_KEY, self.csp.value) \
+            if self.csp and self.csp.value else None
+        bundle_headers = self.bundle.value if self.bundle else ()
+        self.headers = {}
+        for use_hsts, use_csp, use_bundle in product((True, False), repeat=3):
+            headers = tuple(h for h, use in ((hsts_header, use_hsts),
+                                             (csp_header, use_csp))
+                            if h and use)
+            if use_bundle:
+                headers += bundle_headers
+            self.headers[(use_hsts, use_csp, use_bundle)] = (
+                headers, frozenset(h[0].lower() for h in headers))
+
+        self.enabled = any((self.redirect, self.hsts, self.csp, self.bundle))
+
+    def __call__(self, environ, start_response):
+        if not self.enabled:
+            return self.app(environ, start_response)
+
+        path = get_path(environ)
+        redirect, hsts, csp, bundle = \
+            self.redirect, self.hsts, self.csp, self.bundle
+
+        # decisions are cached in compiled ignore paths
+        if redirect and not match_path(path, redirect.ignore_paths) and \
+           not is_secure_environ(environ, redirect.proto_key):
+            logger.warning('(%s) Insecure request %s', 'wsgi', path)
+            start_response(self.redirect_status, list(
+                self.redirect_headers(get_host(environ), path)))
+            return []
+
+        headers, names = self.headers[(
+            bool(hsts and not match_path(path, hsts.ignore_paths) and
+                 is_secure_environ(environ, hsts.proto_key)),
+            bool(csp and not match_path(path, csp.ignore_paths)),
+            bool(bundle and not match_path(path, bundle.ignore_paths)),
+        )]
+        if not headers:
+            return self.app(environ, start_response)
+
+        def _start_response(status, response_headers, exc_info=None):
+            found = None
+            for name, _ in response_headers:
+                if name.lower() in names:
+                    found = (found or ()) + (name.lower(),)
+            if found is None:
+                response_headers.extend(headers)
+            else:  # ignore if already exists
+                response_headers.extend(
+                    h for h in headers if h[0].lower() not in found)
+            return start_response(status, response_headers, exc_info)
+
+        return self.app(environ, _start_response)
@@ -1,5 +1,12 @@
+import sys
+
 import pytest
 
+# pylint: disable=invalid-name
+collect_ignore = []
+if sys.version_info < (3, 5):  # async/await
+    collect_ignore.append('unit/asgi_test.py')
+
 
 @pytest.fixture(scope='function')
 def dummy_request():  # type: () -> Request
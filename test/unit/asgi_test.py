@@ -0,0 +1,199 @@
+import asyncio
+
+import pytest
+
+from pyramid_secure_response.asgi import SecureResponseMiddleware
+
+
+@pytest.fixture(autouse=True)
+def setup():
+    import logging
+    from pyramid_secure_response.asgi import logger
+    logger.setLevel(logging.ERROR)
+
+
+def build_app(headers=None, chunks=(b'OK',)):
+    calls = []
+
+    async def app(scope, receive, send):  # pylint: disable=unused-argument
+        calls.append(scope)
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': list(headers or []),
+        })
+        for i, chunk in enumerate(chunks):
+            await send({
+                'type': 'http.response.body',
+                'body': chunk,
+                'more_body': i < len(chunks) - 1,
+            })
+
+    app.calls = calls
+    return app
+
+
+def build_scope(url, headers=None):
+    from urllib.parse import urlsplit
+
+    parts = urlsplit(url)
+    return {
+        'type': 'http',
+        'scheme': parts.scheme,
+        'path': parts.path,
+        'root_path': '',
+        'query_string': parts.query.encode('latin-1'),
+        'headers': [(k.lower().encode('latin-1'), v.encode('latin-1'))
+                    for k, v in (headers or {}).items()],
+        'server': (parts.hostname, parts.port or 80),
+    }
+
+
+def call(app, scope):
+    """Runs ASGI app in process, then returns sent messages."""
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(app(scope, receive, send))
+    finally:
+        loop.close()
+    return messages
+
+
+def get_headers(message):
+    return dict((k.decode('latin-1'), v.decode('latin-1'))
+                for k, v in message['headers'])
+
+
+@pytest.mark.parametrize('url,headers,host,path', [
+    ('http://example.org/foo', {'Host': 'example.org'},
+     'example.org', '/foo'),
+    ('http://example.org:8080/foo bar', {},
+     'example.org:8080', '/foo%20bar'),
+])
+def test_get_host_and_path(url, headers, host, path):
+    from pyramid_secure_response.asgi import get_host, get_path
+
+    scope = build_scope(url, headers=headers)
+    assert host == get_host(scope)
+    assert path == get_path(scope)
+
+
+@pytest.mark.parametrize('url,proto_name,value,secure', [
+    ('http://example.org/', b'', None, False),
+    ('https://example.org/', b'', None, True),
+    ('https://example.org/', b'x-forwarded-proto', None, False),
+    ('https://example.org/', b'x-forwarded-proto', 'http', False),
+    ('https://example.org/', b'x-forwarded-proto', 'https', True),
+])
+def test_is_secure_scope(url, proto_name, value, secure):
+    from pyramid_secure_response.asgi import is_secure_scope
+
+    headers = {'X-Forwarded-Proto': value} if value else {}
+    assert secure is is_secure_scope(
+        build_scope(url, headers=headers), proto_name)
+
+
+def test_middleware_passes_through_other_scope():
+    app = build_app()
+    middleware = SecureResponseMiddleware(app, {})
+
+    call(middleware, {'type': 'lifespan'})
+    assert 1 == len(app.calls)
+
+
+def test_middleware_with_ignored_path():
+    app = build_app()
+    middleware = SecureResponseMiddleware(app, {
+        'pyramid_secure_response.ignore_paths': '\n/humans.txt\n',
+        'pyramid_secure_response.csp_coverage.default_src': 'self',
+    })
+    messages = call(middleware, build_scope('http://example.org/humans.txt'))
+
+    assert 1 == len(app.calls)
+    assert 200 == messages[0]['status']
+    assert 'content-security-policy' not in get_headers(messages[0])
+
+
+def test_middleware_insecure():
+    app = build_app()
+    middleware = SecureResponseMiddleware(app, {
+        'pyramid_secure_response.ssl_redirect.status_code': '308',
+    })
+    messages = call(middleware, build_scope(
+        'http://example.org/foo', headers={'Host': 'example.org'}))
+
+    assert 0 == len(app.calls)
+    assert 308 == messages[0]['status']
+    assert 'https://example.org/foo' == get_headers(messages[0])['location']
+    assert b'' == messages[1]['body']
+
+
+def test_middleware_insecure_with_proto_header():
+    app = build_app()
+    middleware = SecureResponseMiddleware(app, {
+        'pyramid_secure_response.proto_header': 'X-Forwarded-Proto',
+    })
+    messages = call(middleware, build_scope(
+        'https://example.org/', headers={'X-Forwarded-Proto': 'http'}))
+
+    assert 0 == len(app.calls)
+    assert 301 == messages[0]['status']
+
+
+def test_middleware_secure():
+    app = build_app(chunks=(b'a', b'b', b'c'))
+    middleware = SecureResponseMiddleware(app, {
+        'pyramid_secure_response.proto_header': 'X-Forwarded-Proto',
+        'pyramid_secure_response.hsts_support.max_age': '300',
+        'pyramid_secure_response.csp_coverage.default_src': 'self',
+    })
+    messages = call(middleware, build_scope(
+        'https://example.org/', headers={'X-Forwarded-Proto': 'https'}))
+
+    assert 1 == len(app.calls)
+    headers = get_headers(messages[0])
+    assert 'max-age=300; includeSubDomains; preload' == \
+        headers['strict-transport-security']
+    assert "default-src 'self'" == headers['content-security-policy']
+
+    # body is not buffered
+    assert [b'a', b'b', b'c'] == [m['body'] for m in messages[1:]]
+
+
+def test_middleware_does_not_override_headers():
+    app = build_app(headers=[
+        (b'Strict-Transport-Security', b'max-age=0'),
+    ])
+    middleware = SecureResponseMiddleware(app, {
+        'pyramid_secure_response.csp_coverage.default_src': 'self',
+    })
+    messages = call(middleware, build_scope('https://example.org/'))
+
+    names = [k.lower() for k, _ in messages[0]['headers']]
+    assert 1 == names.count(b'strict-transport-security')
+    assert "default-src 'self'" == \
+        get_headers(messages[0])['content-security-policy']
+
+
+def test_middleware_with_security_headers():
+    app = build_app(headers=[(b'X-Content-Type-Options', b'nosniff')])
+    middleware = SecureResponseMiddleware(app, {
+        'pyramid_secure_response.hsts_support.enabled': 'False',
+        'pyramid_secure_response.security_headers.x_content_type_options':
+            'nosniff',
+        'pyramid_secure_response.security_headers.referrer_policy':
+            'no-referrer',
+    })
+    messages = call(middleware, build_scope('https://example.org/'))
+
+    names = [k.lower() for k, _ in messages[0]['headers']]
+    assert 1 == names.count(b'x-content-type-options')
+    assert 'no-referrer' == get_headers(messages[0])['referrer-policy']
@@ -140,13 +140,65 @@ def test_build_csp_header_config_argument():
     assert '' == build_csp_header(Config(True))
 
 
+def test_compile_csp_header():
+    from pyramid_secure_response.csp_coverage import compile_csp_header
+
+    header = compile_csp_header({
+        'default_src': 'self https:',
+        'upgrade_insecure_requests': 'True',
+    })
+    assert "default-src 'self' https:; upgrade-insecure-requests" == \
+        header.value
+    assert header.value.encode('latin-1') == header.encoded
+
+    header = compile_csp_header({})
+    assert '' == header.value
+    assert b'' == header.encoded
+
+
+@pytest.mark.parametrize('directives', [
+    {'default_src': 'self;script-src'},
+    {'report_uri': 'https://example.org/a,b'},
+    {'default_src': u'https://\u4f8b.example.org'},
+])
+def test_compile_csp_header_with_invalid_token(directives):
+    from pyramid_secure_response.csp_coverage import compile_csp_header
+
+    with pytest.raises(ValueError):
+        compile_csp_header(directives)
+
+
+def test_csp_coverage_tween_does_not_rebuild_header(mocker, dummy_request):
+    from pyramid_secure_response import csp_coverage
+    # pylint: disable=protected-access
+    mocker.spy(csp_coverage, '_build_csp_policies')
+
+    from pyramid.response import Response
+
+    dummy_request.registry.settings = {
+        'pyramid_secure_response.csp_coverage.enabled': 'True',
+        'pyramid_secure_response.csp_coverage.default_src': 'self',
+    }
+
+    handler_stub = mocker.stub(name='handler_stub')
+    handler_stub.side_effect = lambda _: Response(status=200)
+    csp_coverage_tween = tween(handler_stub, dummy_request.registry)
+    for _ in range(3):
+        res = csp_coverage_tween(dummy_request)
+        assert "default-src 'self'" == res.headers['Content-Security-Policy']
+
+    # pylint: disable=no-member
+    assert 3 == handler_stub.call_count
+    assert 1 == csp_coverage._build_csp_policies.call_count
+
+
 def test_csp_coverage_tween_with_disabled(mocker, dummy_request):
-    mocker.patch('pyramid_secure_response.csp_coverage.apply_path_filter',
+    mocker.patch('pyramid_secure_response.secure_context.match_path',
                  return_value=True)
 
     from pyramid.response import Response
-    from pyramid_secure_response.csp_coverage import (
-        apply_path_filter,
+    from pyramid_secure_response.secure_context import (
+        match_path,
     )
 
     dummy_request.registry.settings = {
@@ -160,23 +212,24 @@ def test_csp_coverage_tween_with_disabled(mocker, dummy_request):
 
     # pylint: disable=no-member
     assert 1 == handler_stub.call_count
-    assert 0 == apply_path_filter.call_count
+    assert 0 == match_path.call_count
     assert 'Content-Security-Policy' not in res.headers
 
 
 def test_csp_coverage_tween_with_ignored_path(mocker, dummy_request):
-    mocker.patch('pyramid_secure_response.csp_coverage.apply_path_filter',
+    mocker.patch('pyramid_secure_response.secure_context.match_path',
                  return_value=True)
 
     from pyramid.response import Response
-    from pyramid_secure_response.csp_coverage import (
-        apply_path_filter,
+    from pyramid_secure_response.secure_context import (
+        match_path,
     )
 
     dummy_request.path = '/humans.txt'
     dummy_request.registry.settings = {
         'pyramid_secure_response.csp_coverage.enabled': 'True',
-        'pyramid_secure_response.csp_coverage.ignore_paths': '\n/humans.txt\n'
+        'pyramid_secure_response.csp_coverage.ignore_paths': '\n/humans.txt\n',
+        'pyramid_secure_response.csp_coverage.default_src': 'self',
     }
 
     handler_stub = mocker.stub(name='handler_stub')
@@ -186,19 +239,19 @@ def test_csp_coverage_tween_with_ignored_path(mocker, dummy_request):
 
     # pylint: disable=no-member
     assert 1 == handler_stub.call_count
-    assert 1 == apply_path_filter.call_count
-    apply_path_filter.assert_called_once_with(
-        dummy_request, ('/humans.txt',))
+    assert 1 == match_path.call_count
+    match_path.assert_called_once_with(
+        dummy_request.path, ('/humans.txt',))
     assert 'Content-Security-Policy' not in res.headers
 
 
 def test_csp_coverage_with_default_values(mocker, dummy_request):
-    from pyramid_secure_response import csp_coverage
-    mocker.spy(csp_coverage, 'apply_path_filter')
+    from pyramid_secure_response import secure_context
+    mocker.spy(secure_context, 'match_path')
 
     from pyramid.response import Response
-    from pyramid_secure_response.csp_coverage import (
-        apply_path_filter,
+    from pyramid_secure_response.secure_context import (
+        match_path,
     )
 
     dummy_request.url = 'http://example.org/'
@@ -215,21 +268,20 @@ def test_csp_coverage_with_default_values(mocker, dummy_request):
     # pylint: disable=no-member
     assert 1 == handler_stub.call_count
 
-    assert 1 == apply_path_filter.call_count
-    apply_path_filter.assert_called_once_with(dummy_request, tuple())
-
-    # does not set if header is empty
+    # does nothing if header is empty
+    assert handler_stub is csp_coverage_tween
+    assert 0 == match_path.call_count
     assert 'Content-Security-Policy' not in res.headers
 
 
 def test_csp_coverage_tween_default_src_with_host_source(
         mocker, dummy_request):
-    from pyramid_secure_response import csp_coverage
-    mocker.spy(csp_coverage, 'apply_path_filter')
+    from pyramid_secure_response import secure_context
+    mocker.spy(secure_context, 'match_path')
 
     from pyramid.response import Response
-    from pyramid_secure_response.csp_coverage import (
-        apply_path_filter,
+    from pyramid_secure_response.secure_context import (
+        match_path,
     )
 
     dummy_request.url = 'https://example.org/'
@@ -248,8 +300,9 @@ def test_csp_coverage_tween_default_src_with_host_source(
     # pylint: disable=no-member
     assert 1 == handler_stub.call_count
 
-    assert 1 == apply_path_filter.call_count
-    apply_path_filter.assert_called_once_with(dummy_request, tuple())
+    assert 1 == match_path.call_count
+    match_path.assert_called_once_with(
+        dummy_request.path, tuple())
 
     assert 'Content-Security-Policy' in res.headers
     assert 'default-src https://example.org/' == \
@@ -258,12 +311,12 @@ def test_csp_coverage_tween_default_src_with_host_source(
 
 def test_csp_coverage_tween_default_src_with_scheme_source(
         mocker, dummy_request):
-    from pyramid_secure_response import csp_coverage
-    mocker.spy(csp_coverage, 'apply_path_filter')
+    from pyramid_secure_response import secure_context
+    mocker.spy(secure_context, 'match_path')
 
     from pyramid.response import Response
-    from pyramid_secure_response.csp_coverage import (
-        apply_path_filter,
+    from pyramid_secure_response.secure_context import (
+        match_path,
     )
 
     dummy_request.url = 'https://example.org/'
@@ -281,9 +334,290 @@ def test_csp_coverage_tween_default_src_with_scheme_source(
     # pylint: disable=no-member
     assert 1 == handler_stub.call_count
 
-    assert 1 == apply_path_filter.call_count
-    apply_path_filter.assert_called_once_with(dummy_request, tuple())
+    assert 1 == match_path.call_count
+    match_path.assert_called_once_with(
+        dummy_request.path, tuple())
 
     assert 'Content-Security-Policy' in res.headers
     assert 'default-src https:' == \
         res.headers['Content-Security-Policy']
+
+
+def test_compile_csp_template():
+    from pyramid_secure_response.csp_coverage import (
+        build_csp_header,
+        compile_csp_header,
+        compile_csp_template,
+        render_csp_header,
+    )
+
+    directives = {
+        'default_src': 'self',
+        'script_src': 'self nonce',
+        'style_src': 'nonce',
+        'report_uri': 'https://example.org/nonce',
+    }
+    template = compile_csp_template(directives)
+    assert 3 == len(template)
+    assert "default-src 'self'; script-src 'self' 'nonce-abc'; " \
+        "style-src 'nonce-abc'; report-uri https://example.org/nonce" == \
+        render_csp_header(template, 'abc')
+
+    # without nonce source
+    assert "default-src 'self'; script-src 'self'; style-src; " \
+        "report-uri https://example.org/nonce" == \
+        compile_csp_header(directives).value == \
+        build_csp_header(directives) == render_csp_header(template)
+
+    assert ("default-src 'self'",) == compile_csp_template({
+        'default_src': 'self'})
+
+
+@pytest.mark.parametrize('read', [True, False])
+def test_csp_coverage_tween_with_nonce(mocker, dummy_request, read):
+    from pyramid.response import Response
+    from pyramid_secure_response.csp_nonce import get_csp_nonce
+
+    dummy_request.registry.settings = {
+        'pyramid_secure_response.csp_coverage.enabled': 'True',
+        'pyramid_secure_response.csp_coverage.script_src': 'self nonce',
+    }
+
+    def handler(req):
+        if read:
+            get_csp_nonce(req)
+        return Response(status=200)
+
+    csp_coverage_tween = tween(handler, dummy_request.registry)
+    res = csp_coverage_tween(dummy_request)
+
+    if read:
+        assert "script-src 'self' 'nonce-{:s}'".format(
+            dummy_request.csp_nonce) == res.headers['Content-Security-Policy']
+    else:
+        assert "script-src 'self'" == res.headers['Content-Security-Policy']
+
+
+@pytest.mark.parametrize('enforce', [True, False])
+def test_csp_coverage_tween_with_hash_responses(
+        mocker, dummy_request, enforce):
+    from pyramid.response import Response
+    from pyramid_secure_response.csp_hashes import build_hash_source
+
+    dummy_request.registry.settings = {
+        'pyramid_secure_response.csp_coverage.script_src': 'self',
+        'pyramid_secure_response.csp_hashes.responses': 'True',
+        'pyramid_secure_response.csp_hashes.enforce_responses': str(enforce),
+    }
+
+    body = b'<html><script>a();</script></html>'
+    handler_stub = mocker.stub(name='handler_stub')
+    csp_coverage_tween = tween(handler_stub, dummy_request.registry)
+
+    # buffered
+    handler_stub.return_value = Response(body=body)
+    res = csp_coverage_tween(dummy_request)
+    value = "script-src 'self' {:s}".format(build_hash_source(u'a();'))
+    if enforce:
+        assert value == res.headers['Content-Security-Policy']
+        assert 'Content-Security-Policy-Report-Only' not in res.headers
+    else:
+        # injected scripts are not allowed by default
+        assert "script-src 'self'" == res.headers['Content-Security-Policy']
+        assert value == res.headers['Content-Security-Policy-Report-Only']
+
+    # not html
+    handler_stub.return_value = Response(body=body, content_type='text/plain')
+    res = csp_coverage_tween(dummy_request)
+    assert "script-src 'self'" == res.headers['Content-Security-Policy']
+
+    # streamed (learned from the last response for the path)
+    for i in range(2):
+        handler_stub.return_value = Response(app_iter=iter([body]))
+        res = csp_coverage_tween(dummy_request)
+        assert "script-src 'self'" == res.headers['Content-Security-Policy']
+        if i == 0:
+            assert 'Content-Security-Policy-Report-Only' not in res.headers
+        else:
+            assert "script-src 'self' {:s}".format(
+                build_hash_source(u'a();')) == \
+                res.headers['Content-Security-Policy-Report-Only']
+        assert body == b''.join(res.app_iter)
+
+
+def test_build_sample_f():
+    from pyramid import testing
+    from pyramid_secure_response.csp_coverage import build_sample_f
+
+    def build_request(addr, cookie=None):
+        return testing.DummyRequest(
+            environ={'REMOTE_ADDR': addr},
+            cookies={'sid': cookie} if cookie else {})
+
+    addrs = ['10.0.{:d}.{:d}'.format(i // 256, i % 256) for i in range(2000)]
+
+    assert all(build_sample_f(1.0)(build_request(a)) for a in addrs)
+    assert not any(build_sample_f(0.0)(build_request(a)) for a in addrs)
+
+    is_sampled = build_sample_f(0.1)
+    sampled = [a for a in addrs if is_sampled(build_request(a))]
+    assert 100 < len(sampled) < 300
+    # deterministic
+    assert sampled == [a for a in addrs if build_sample_f(0.1)(
+        build_request(a))]
+
+    # by cookie
+    is_sampled = build_sample_f(0.1, 'sid')
+    assert len({is_sampled(build_request(a, 'abc')) for a in addrs}) == 1
+
+
+@pytest.mark.parametrize('sample_rate,sampled', [('1', True), ('0', False)])
+def test_csp_coverage_tween_in_report_only_mode(
+        mocker, dummy_request, sample_rate, sampled):
+    from pyramid.response import Response
+
+    dummy_request.registry.settings = {
+        'pyramid_secure_response.csp_coverage.script_src': 'self',
+        'pyramid_secure_response.csp_report_only.mode': 'report_only',
+        'pyramid_secure_response.csp_report_only.sample_rate': sample_rate,
+    }
+
+    handler_stub = mocker.stub(name='handler_stub')
+    handler_stub.return_value = Response(status=200)
+    res = tween(handler_stub, dummy_request.registry)(dummy_request)
+
+    assert 'Content-Security-Policy' not in res.headers
+    if sampled:
+        assert "script-src 'self'" == \
+            res.headers['Content-Security-Policy-Report-Only']
+    else:
+        assert 'Content-Security-Policy-Report-Only' not in res.headers
+
+
+def test_csp_coverage_tween_in_dual_mode(mocker, dummy_request):
+    from pyramid.response import Response
+    from pyramid_secure_response.csp_nonce import get_csp_nonce
+
+    dummy_request.registry.settings = {
+        'pyramid_secure_response.csp_coverage.script_src': 'self',
+        'pyramid_secure_response.csp_report_only.mode': 'dual',
+        'pyramid_secure_response.csp_report_only.script_src': 'self nonce',
+    }
+
+    def handler(req):
+        get_csp_nonce(req)
+        return Response(status=200)
+
+    res = tween(handler, dummy_request.registry)(dummy_request)
+
+    assert "script-src 'self'" == res.headers['Content-Security-Policy']
+    assert "script-src 'self' 'nonce-{:s}'".format(
+        dummy_request.csp_nonce) == \
+        res.headers['Content-Security-Policy-Report-Only']
+
+
+@pytest.mark.parametrize('host,expected', [
+    ('example.org', None),
+    ('www.example.com:8080', "frame-ancestors 'self'"),
+    ('embed.example.com', "frame-ancestors https://example.net"),
+])
+def test_csp_coverage_tween_with_host_policies(
+        mocker, dummy_request, host, expected):
+    from pyramid.response import Response
+
+    dummy_request.host = host
+    dummy_request.registry.settings = {
+        'pyramid_secure_response.host_policy.a.hosts': '*.example.com',
+        'pyramid_secure_response.host_policy.a.csp_coverage.frame_ancestors':
+            'self',
+        'pyramid_secure_response.host_policy.b.hosts': 'embed.example.com',
+        'pyramid_secure_response.host_policy.b.csp_coverage.frame_ancestors':
+            'https://example.net',
+    }
+
+    handler_stub = mocker.stub(name='handler_stub')
+    handler_stub.return_value = Response(status=200)
+    res = tween(handler_stub, dummy_request.registry)(dummy_request)
+
+    assert expected == res.headers.get('Content-Security-Policy')
+
+
+def test_csp_coverage_tween_with_policy_store(mocker, dummy_request, tmpdir):
+    from pyramid.response import Response
+
+    tmpdir.join('example.org.ini').write(
+        '[csp_coverage]\nframe_ancestors = self\n')
+    dummy_request.registry.settings = {
+        'pyramid_secure_response.policy_store.path': str(tmpdir),
+    }
+
+    handler_stub = mocker.stub(name='handler_stub')
+    handler_stub.side_effect = lambda req: Response(status=200)
+    csp_coverage_tween = tween(handler_stub, dummy_request.registry)
+
+    res = csp_coverage_tween(dummy_request)
+    assert "frame-ancestors 'self'" == res.headers['Content-Security-Policy']
+
+    dummy_request.host = 'example.com'
+    del dummy_request.secure_context
+    res = csp_coverage_tween(dummy_request)
+    assert 'Content-Security-Policy' not in res.headers
+
+
+@pytest.mark.parametrize('status,content_type,expected', [
+    (200, 'text/html', "default-src 'self'; img-src 'self' data:"),
+    (200, 'application/json', "default-src 'none'; frame-ancestors 'none'"),
+    (200, 'image/png', None),
+    (200, 'application/javascript', None),
+    (304, None, None),
+])
+def test_csp_coverage_tween_with_content_types(
+        dummy_request, status, content_type, expected):
+    from pyramid.response import Response
+
+    dummy_request.registry.settings = {
+        'pyramid_secure_response.csp_coverage.default_src': 'self',
+        'pyramid_secure_response.csp_coverage.img_src': 'self data:',
+        'pyramid_secure_response.csp_coverage.content_types': 'text/html',
+        'pyramid_secure_response.csp_coverage.minimal_content_types':
+            'application/json',
+    }
+
+    def handler(req):  # pylint: disable=unused-argument
+        res = Response(status=status)
+        if content_type:
+            res.content_type = content_type
+        else:
+            del res.content_type
+        return res
+
+    res = tween(handler, dummy_request.registry)(dummy_request)
+    assert expected == res.headers.get('Content-Security-Policy')
+
+
+@pytest.mark.parametrize('mode,expected', [
+    ('enforce', ("default-src 'none'; frame-ancestors 'none'", None)),
+    ('report_only', (None, "default-src 'none'; frame-ancestors 'none'")),
+    ('dual', ("default-src 'none'; frame-ancestors 'none'",
+              "default-src 'none'; frame-ancestors 'none'")),
+])
+def test_csp_coverage_tween_with_minimal_content_types_by_mode(
+        dummy_request, mode, expected):
+    from pyramid.response import Response
+
+    dummy_request.registry.settings = {
+        'pyramid_secure_response.csp_coverage.default_src': 'self',
+        'pyramid_secure_response.csp_coverage.content_types': 'text/html',
+        'pyramid_secure_response.csp_coverage.minimal_content_types':
+            'application/json',
+        'pyramid_secure_response.csp_report_only.mode': mode,
+        'pyramid_secure_response.csp_report_only.default_src': 'none',
+    }
+
+    def handler(_):  # type: (Request) -> Response
+        return Response(content_type='application/json')
+
+    res = tween(handler, dummy_request.registry)(dummy_request)
+    assert expected == (
+        res.headers.get('Content-Security-Policy'),
+        res.headers.get('Content-Security-Policy-Report-Only'))
@@ -0,0 +1,226 @@
+from collections import OrderedDict
+import os
+
+import pytest
+
+from pyramid_secure_response.csp_hashes import (
+    build_hash_source,
+    extract_hash_sources,
+    merge_hash_sources,
+    scan,
+)
+
+TEMPLATE = u'''<html>
+<head>
+  <style>body { color: #333; }</style>
+  <script src="/static/app.js"></script>
+  <script>window.app = {};</script>
+</head>
+<body>
+  <script type="text/javascript">var user = "${user.name}";</script>
+  <script>
+    console.log('\u3053\u3093\u306b\u3061\u306f');
+  </script>
+</body>
+</html>
+'''
+
+
+@pytest.fixture(autouse=True)
+def setup():
+    import logging
+    from pyramid_secure_response.csp_hashes import logger
+    logger.setLevel(logging.ERROR)
+
+
+def write_templates(tmpdir, count):  # type: (py.path.local, int) -> list
+    paths = []
+    for i in range(count):
+        path = tmpdir.join('templates', 'page{:d}.pt'.format(i))
+        text = TEMPLATE.replace('window.app = {}',
+                                'window.app = {:d}'.format(i))
+        path.write_text(text, encoding='utf-8', ensure=True)
+        paths.append(str(path))
+    tmpdir.join('templates', 'style.css').write_text(
+        u'<style>a {}</style>', encoding='utf-8')
+    return paths
+
+
+def test_extract_hash_sources():
+    script, style = extract_hash_sources(TEMPLATE)
+
+    # skips external script and template expression
+    assert [
+        build_hash_source(u'window.app = {};'),
+        build_hash_source(
+            u"\n    console.log('\u3053\u3093\u306b\u3061\u306f');\n  "),
+    ] == script
+    assert [build_hash_source(u'body { color: #333; }')] == style
+
+
+def test_extract_hash_sources_with_template_expressions(mocker):
+    from pyramid_secure_response.csp_hashes import logger
+    mocker.spy(logger, 'debug')
+
+    script, _ = extract_hash_sources(u'''
+      <script>var o = {total: 1, tal: 2};</script>
+      <script tal:condition="debug">var debug = 1;</script>
+      <script>var o = {{ data }};</script>
+    ''')
+
+    assert [
+        build_hash_source(u'var o = {total: 1, tal: 2};'),
+        build_hash_source(u'var debug = 1;'),
+    ] == script
+    # pylint: disable=no-member
+    assert 1 == logger.debug.call_count
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_scan(tmpdir, workers):
+    write_templates(tmpdir, 3)
+
+    script, style = scan((str(tmpdir.join('templates')),), workers=workers)
+
+    # window.app = 0..2 and console.log()
+    assert 4 == len(script)
+    assert build_hash_source(u'window.app = 1;') in script
+    # deduplicated
+    assert [build_hash_source(u'body { color: #333; }')] == style
+
+
+def test_scan_with_manifest(mocker, tmpdir):
+    from pyramid_secure_response import csp_hashes
+    mocker.spy(csp_hashes, 'scan_file')
+
+    paths = write_templates(tmpdir, 3)
+    dirs = (str(tmpdir.join('templates')),)
+    manifest = str(tmpdir.join('manifest.json'))
+
+    expected = scan(dirs, manifest=manifest, workers=1)
+    assert os.path.exists(manifest)
+    # pylint: disable=no-member
+    assert 3 == csp_hashes.scan_file.call_count
+
+    # unchanged
+    assert expected == scan(dirs, manifest=manifest, workers=1)
+    assert 3 == csp_hashes.scan_file.call_count
+
+    # changed (size)
+    with open(paths[0], 'a') as f:
+        f.write('<script>changed();</script>')
+    script, _ = scan(dirs, manifest=manifest, workers=1)
+    assert 4 == csp_hashes.scan_file.call_count
+    csp_hashes.scan_file.assert_called_with(paths[0])
+    assert build_hash_source(u'changed();') in script
+
+
+def test_scan_with_broken_manifest(tmpdir):
+    write_templates(tmpdir, 1)
+    manifest = tmpdir.join('manifest.json')
+    manifest.write('{')
+
+    script, _ = scan((str(tmpdir.join('templates')),),
+                     manifest=str(manifest), workers=1)
+    assert 2 == len(script)
+
+
+def test_merge_hash_sources():
+    directives = OrderedDict([
+        ('default_src', 'none'),
+        ('script_src', 'self'),
+        ('style_src', ''),
+    ])
+    merged = merge_hash_sources(directives, ["'sha256-a'"], ["'sha256-b'"])
+    assert "self 'sha256-a'" == merged['script_src']
+    # default_src is the base ('none' is dropped)
+    assert "'sha256-b'" == merged['style_src']
+    assert 'self' == directives['script_src']
+
+    # no restriction
+    directives = OrderedDict([('default_src', ''), ('script_src', '')])
+    assert directives == merge_hash_sources(directives, ["'sha256-a'"], [])
+
+
+def test_compile_config_with_csp_hashes(tmpdir):
+    from pyramid_secure_response.csp_coverage import compile_csp_header
+    from pyramid_secure_response.util import compile_config
+
+    write_templates(tmpdir, 1)
+    config = compile_config({
+        'pyramid_secure_response.csp_coverage.default_src': 'self',
+        'pyramid_secure_response.csp_hashes.enabled': 'True',
+        'pyramid_secure_response.csp_hashes.dirs':
+            '\n{:s}\n'.format(str(tmpdir.join('templates'))),
+        'pyramid_secure_response.csp_hashes.workers': '1',
+    })
+
+    value = compile_csp_header(config.csp_coverage.directives).value
+    assert "script-src 'self' {:s}".format(
+        build_hash_source(u'window.app = 0;')) in value
+    assert "style-src 'self' {:s}".format(
+        build_hash_source(u'body { color: #333; }')) in value
+
+
+def test_compile_config_with_invalid_csp_hashes_workers():
+    from pyramid_secure_response.util import compile_config
+
+    with pytest.raises(ValueError):
+        compile_config({'pyramid_secure_response.csp_hashes.workers': 'a'})
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 7, 8, 9, 64, 4096])
+def test_inline_script_hasher_with_split_tags(chunk_size):
+    from pyramid_secure_response.csp_hashes import InlineScriptHasher
+
+    html = (TEMPLATE.replace('${user.name}', 'guest') + (
+        u'<SCRIPT type="module">var a = "</scr" + "ipt>";</Script >'
+        u'<scripts>not script</scripts><script></script>')).encode('utf-8')
+
+    hasher = InlineScriptHasher()
+    for i in range(0, len(html), chunk_size):
+        hasher.feed(html[i:i + chunk_size])
+
+    assert [
+        build_hash_source(u'window.app = {};'),
+        build_hash_source(u'var user = "guest";'),
+        build_hash_source(
+            u"\n    console.log('\u3053\u3093\u306b\u3061\u306f');\n  "),
+        build_hash_source(u'var a = "</scr" + "ipt>";'),
+    ] == hasher.close()
+
+
+def test_inline_script_hasher_keeps_bounded_buffer():
+    from pyramid_secure_response.csp_hashes import InlineScriptHasher
+
+    hasher = InlineScriptHasher()
+    hasher.feed(b'<script>')
+    for _ in range(1000):
+        hasher.feed(b'x' * 1024)
+        # pylint: disable=protected-access
+        assert len(hasher._buffer) <= len(b'</script')
+    hasher.feed(b'</script>')
+
+    assert [build_hash_source(u'x' * 1024 * 1000)] == hasher.close()
+
+
+def test_hash_app_iter(mocker):
+    from pyramid_secure_response.csp_hashes import hash_app_iter
+
+    class AppIter(object):
+        def __init__(self):
+            self.closed = False
+
+        def __iter__(self):
+            return iter([b'<script>a', b'();</script>'])
+
+        def close(self):
+            self.closed = True
+
+    app_iter = AppIter()
+    callback = mocker.stub(name='callback')
+    assert [b'<script>a', b'();</script>'] == list(
+        hash_app_iter(app_iter, callback))
+
+    callback.assert_called_once_with((build_hash_source(u'a();'),))
+    assert app_iter.closed
@@ -0,0 +1,146 @@
+from collections import OrderedDict
+
+import pytest
+
+from pyramid_secure_response.csp_minify import (
+    FETCH_FALLBACKS,
+    minify_csp_directives,
+)
+
+
+def normalize(value):  # type: (str) -> frozenset
+    sources = set(t.strip("'") for t in value.split())
+    if len(sources) > 1:
+        sources.discard('none')
+    return frozenset(t for t in sources if t.split('//')[0] == t or
+                     t.split('//')[0] not in sources)
+
+
+def effective_sources(directives):  # type: (OrderedDict) -> dict
+    """Returns normalized sources which each fetch directive uses."""
+    sources = dict((k, normalize(v)) for k, v in directives.items()
+                   if v and k in tuple(FETCH_FALLBACKS) + ('default_src',))
+    result = {}
+    for name, fallbacks in FETCH_FALLBACKS.items():
+        for n in (name,) + fallbacks:
+            if n in sources:
+                result[name] = sources[n]
+                break
+    return result
+
+
+@pytest.mark.parametrize('directives,expected', [
+    # duplicates
+    ({'img_src': "self 'self' https://a.org https://a.org"},
+     {'img_src': 'self https://a.org'}),
+    # hashes are case-sensitive
+    ({'script_src': "'sha256-abc' 'sha256-ABC'"},
+     {'script_src': "'sha256-abc' 'sha256-ABC'"}),
+    # scheme sources
+    ({'img_src': 'https://a.org/x.png data: https: http://b.org'},
+     {'img_src': 'data: https: http://b.org'}),
+    # 'none' with others
+    ({'object_src': 'none self'}, {'object_src': 'self'}),
+    ({'object_src': 'none'}, {'object_src': 'none'}),
+    # same as default-src
+    ({'default_src': 'self', 'img_src': 'self', 'font_src': 'self https:'},
+     {'default_src': 'self', 'font_src': 'self https:'}),
+    # worker-src falls back to script-src before default-src
+    ({'default_src': 'self', 'child_src': 'self', 'script_src': 'https:'},
+     {'default_src': 'self', 'script_src': 'https:', 'child_src': 'self'}),
+    # non-fetch directives are kept
+    ({'default_src': 'self', 'base_uri': 'self self',
+      'report_uri': '/csp-report'},
+     {'default_src': 'self', 'base_uri': 'self',
+      'report_uri': '/csp-report'}),
+])
+def test_minify_csp_directives(directives, expected):
+    directives = OrderedDict(sorted(directives.items()))
+    minified, report = minify_csp_directives(directives)
+
+    assert expected == dict((k, v) for k, v in minified.items() if v)
+    assert effective_sources(directives) == effective_sources(minified)
+    assert report.after <= report.before
+
+
+def test_minify_csp_directives_does_not_hoist_into_default_src():
+    # other fetch directives (e.g. fenced-frame-src) fall back to default-src
+    directives = OrderedDict(
+        (name, 'self https://cdn.example.org') for name in FETCH_FALLBACKS
+        if name not in ('frame_src', 'worker_src'))
+    directives['default_src'] = ''
+    directives['form_action'] = 'self'
+
+    minified, report = minify_csp_directives(directives)
+
+    assert directives == minified
+    assert report.before == report.after
+    assert [] == report.warnings
+
+
+def test_minify_csp_directives_does_not_hoist_partially():
+    directives = OrderedDict((
+        ('img_src', 'self'),
+        ('script_src', 'self'),
+    ))
+    minified, report = minify_csp_directives(directives)
+
+    assert directives == minified
+    assert report.before == report.after
+    assert [] == report.warnings
+
+
+def test_minify_csp_directives_warns_ignored_sources():
+    _, report = minify_csp_directives(OrderedDict((
+        ('script_src', "unsafe-inline nonce strict-dynamic https:"),
+        ('style_src', "unsafe-inline 'sha256-abc'"),
+        ('object_src', 'none self'),
+        ('block_all_mixed_content', True),
+        ('upgrade_insecure_requests', True),
+    )))
+
+    assert [
+        "'unsafe-inline' in script_src is ignored with nonce or hash",
+        "host and scheme sources in script_src are ignored with "
+        "'strict-dynamic'",
+        "'unsafe-inline' in style_src is ignored with nonce or hash",
+        "'none' in object_src is ignored with other sources",
+        'block-all-mixed-content is ignored with upgrade-insecure-requests',
+    ] == report.warnings
+
+
+@pytest.mark.parametrize('report_only,expected', [
+    (False, ['referrer has no effect (obsolete)']),
+    (True, ['sandbox has no effect in report-only policy',
+            'referrer has no effect (obsolete)']),
+])
+def test_minify_csp_directives_warns_ignored_directives(report_only,
+                                                        expected):
+    directives = OrderedDict((
+        ('default_src', 'self'),
+        ('sandbox', 'allow-scripts'),
+        ('referrer', 'no-referrer'),
+        ('plugin_types', ''),
+    ))
+    minified, report = minify_csp_directives(directives, report_only)
+
+    assert directives == minified
+    assert expected == report.warnings
+
+
+def test_compile_config_with_minify():
+    from pyramid_secure_response.csp_coverage import compile_csp_header
+    from pyramid_secure_response.util import compile_config
+
+    settings = {
+        'pyramid_secure_response.csp_coverage.default_src': 'self',
+        'pyramid_secure_response.csp_coverage.img_src': 'self self',
+        'pyramid_secure_response.csp_coverage.script_src': 'self',
+    }
+    assert "default-src 'self'; img-src 'self' 'self'; " \
+        "script-src 'self'" == compile_csp_header(
+            compile_config(settings).csp_coverage.directives).value
+
+    settings['pyramid_secure_response.csp_coverage.minify'] = 'True'
+    assert "default-src 'self'" == compile_csp_header(
+        compile_config(settings).csp_coverage.directives).value
@@ -0,0 +1,69 @@
+import pytest
+
+from pyramid_secure_response.csp_nonce import (
+    NoncePool,
+    find_csp_nonce,
+    get_csp_nonce,
+)
+
+
+def test_nonce_pool_get():
+    from base64 import b64decode
+
+    pool = NoncePool(nonce_size=16, batch_size=4)
+    assert 0 == len(pool)
+
+    nonces = [pool.get() for _ in range(10)]
+    # refilled 3 times
+    assert 2 == len(pool)
+    assert 10 == len(set(nonces))
+    for nonce in nonces:
+        assert 24 == len(nonce)
+        assert 16 == len(b64decode(nonce))
+
+
+def test_nonce_pool_refill_reads_urandom_once(mocker):
+    import os
+    mocker.spy(os, 'urandom')
+
+    pool = NoncePool(nonce_size=16, batch_size=8)
+    for _ in range(8):
+        pool.get()
+
+    # pylint: disable=no-member
+    os.urandom.assert_called_once_with(128)
+
+    pool.clear()
+    assert 0 == len(pool)
+
+
+def test_find_csp_nonce(dummy_request):
+    assert find_csp_nonce(dummy_request) is None
+
+    nonce = get_csp_nonce(dummy_request)
+    assert nonce == find_csp_nonce(dummy_request)
+    assert nonce == get_csp_nonce(dummy_request)
+
+
+@pytest.mark.parametrize('read', [True, False])
+def test_csp_nonce_request_method(read):
+    from pyramid.config import Configurator
+    from pyramid.interfaces import IRequestExtensions
+    from pyramid.request import Request, apply_request_extensions
+
+    config = Configurator(settings={})
+    config.include('pyramid_secure_response')
+    config.commit()
+
+    req = Request.blank('/')
+    apply_request_extensions(
+        req, config.registry.queryUtility(IRequestExtensions))
+
+    # generated lazily
+    assert find_csp_nonce(req) is None
+    if read:
+        nonce = req.csp_nonce
+        assert nonce == req.csp_nonce
+        assert nonce == find_csp_nonce(req)
+    else:
+        assert find_csp_nonce(req) is None
@@ -0,0 +1,260 @@
+from collections import OrderedDict
+
+import pytest
+
+from pyramid_secure_response.csp_override import (
+    CSPOverride,
+    apply_csp_overrides,
+    build_csp_overrides,
+    find_csp_override,
+    get_csp_override,
+)
+
+
+def test_build_csp_overrides():
+    assert () == build_csp_overrides()
+    assert (
+        ('+', 'connect_src', ('https://a.example.org',)),
+        ('+', 'frame_src', ('https://b.example.org', 'https://c.example.org')),
+        ('-', 'script_src', ('unsafe-inline',)),
+    ) == build_csp_overrides(add={
+        'frame-src': ['https://b.example.org', 'https://c.example.org'],
+        'connect_src': 'https://a.example.org',
+    }, remove={'script_src': 'unsafe-inline'})
+
+
+@pytest.mark.parametrize('add', [
+    {'connect_srcs': 'self'},
+    {'upgrade_insecure_requests': 'true'},
+    {'connect_src': 'self; script-src *'},
+    {'connect_src': ''},
+])
+def test_build_csp_overrides_with_invalid_values(add):
+    with pytest.raises(ValueError):
+        build_csp_overrides(add=add)
+
+
+def test_apply_csp_overrides():
+    directives = OrderedDict((
+        ('default_src', 'self'),
+        ('script_src', 'self unsafe-inline'),
+        ('frame_src', 'none'),
+    ))
+    overrides = build_csp_overrides(add={
+        'connect_src': 'https://api.example.org',
+        'frame_src': 'https://a.example.org',
+        'script_src': 'self',
+    }, remove={'script_src': 'self unsafe-inline'})
+
+    assert OrderedDict((
+        ('default_src', 'self'),
+        ('script_src', 'none'),
+        ('frame_src', 'https://a.example.org'),
+        ('connect_src', 'self https://api.example.org'),
+    )) == apply_csp_overrides(directives, overrides)
+    # not changed
+    assert 'self unsafe-inline' == directives['script_src']
+    assert 'connect_src' not in directives
+
+    # without default_src, unset fetch directives are not restricted
+    directives = OrderedDict((('script_src', 'self'),))
+    overrides = build_csp_overrides(add={
+        'connect_src': 'https://api.example.org',
+        'script_src': 'https://cdn.example.org',
+    }, remove={'frame_src': 'self'})
+    assert OrderedDict((
+        ('script_src', 'self https://cdn.example.org'),
+    )) == apply_csp_overrides(directives, overrides)
+
+
+@pytest.mark.parametrize('directives,add,remove,expected', [
+    # fallbacks of fetch directives
+    ({'default_src': 'self', 'child_src': 'https://a.example.org'},
+     {'frame_src': 'https://x.example.org'}, None,
+     {'default_src': 'self', 'child_src': 'https://a.example.org',
+      'frame_src': 'https://a.example.org https://x.example.org'}),
+    ({'default_src': 'self', 'script_src': 'https://a.example.org'},
+     {'worker_src': 'blob:'}, None,
+     {'default_src': 'self', 'script_src': 'https://a.example.org',
+      'worker_src': 'https://a.example.org blob:'}),
+    ({'child_src': 'self'}, None, {'worker_src': 'self'},
+     {'child_src': 'self', 'worker_src': 'none'}),
+    # non-fetch directives don't inherit default_src
+    ({'default_src': 'self'},
+     {'frame_ancestors': 'https://partner.example.org',
+      'report_uri': '/csp-report', 'sandbox': 'allow-scripts'}, None,
+     {'default_src': 'self', 'frame_ancestors': 'https://partner.example.org',
+      'report_uri': '/csp-report', 'sandbox': 'allow-scripts'}),
+    ({'script_src': 'self'},
+     {'frame_ancestors': 'self', 'report_uri': '/csp-report'}, None,
+     {'script_src': 'self', 'frame_ancestors': 'self',
+      'report_uri': '/csp-report'}),
+    ({'frame_ancestors': 'self https://a.example.org'},
+     {'frame_ancestors': 'https://b.example.org'}, None,
+     {'frame_ancestors': 'self https://a.example.org https://b.example.org'}),
+    # remove
+    ({'default_src': 'self'}, None, {'frame_ancestors': 'self'},
+     {'default_src': 'self'}),
+    ({'frame_ancestors': 'self'}, None, {'frame_ancestors': 'self'},
+     {'frame_ancestors': 'none'}),
+    ({'sandbox': 'allow-scripts', 'report_uri': '/csp-report'}, None,
+     {'sandbox': 'allow-scripts', 'report_uri': '/csp-report'},
+     {'sandbox': 'allow-scripts', 'report_uri': '/csp-report'}),
+    ({'sandbox': 'allow-scripts allow-forms'}, None,
+     {'sandbox': 'allow-forms'}, {'sandbox': 'allow-scripts'}),
+])
+def test_apply_csp_overrides_by_directive(directives, add, remove, expected):
+    assert expected == dict(apply_csp_overrides(
+        OrderedDict(directives), build_csp_overrides(add, remove)))
+
+
+def test_apply_csp_overrides_with_minified_policy():
+    from pyramid_secure_response.csp_minify import minify_csp_directives
+
+    directives = OrderedDict((
+        ('child_src', 'self https://a.example.org'),
+        ('default_src', 'self'),
+        ('frame_src', 'self https://a.example.org'),
+    ))
+    minified, _ = minify_csp_directives(directives)
+    assert 'frame_src' not in minified
+
+    overrides = build_csp_overrides(add={'frame_src': 'https://x.example.org'})
+    assert apply_csp_overrides(directives, overrides)['frame_src'] == \
+        apply_csp_overrides(minified, overrides)['frame_src']
+
+
+def test_csp_override(dummy_request):
+    assert find_csp_override(dummy_request) is None
+
+    override = get_csp_override(dummy_request)
+    assert isinstance(override, CSPOverride)
+    assert override is find_csp_override(dummy_request)
+    assert not override
+
+    override.add('connect-src', 'https://api.example.org', 'wss:')
+    override.remove('script_src', 'unsafe-inline')
+    assert (
+        ('+', 'connect_src', ('https://api.example.org', 'wss:')),
+        ('-', 'script_src', ('unsafe-inline',)),
+    ) == override.key
+
+    with pytest.raises(ValueError):
+        override.add('sandbox')
+    assert 2 == len(override)
+
+
+def test_csp_coverage_tween_with_override(mocker, dummy_request):
+    from pyramid.response import Response
+    from pyramid_secure_response import csp_coverage
+    from pyramid_secure_response.csp_coverage import tween
+
+    mocker.spy(csp_coverage, 'apply_csp_overrides')
+
+    dummy_request.registry.settings = {
+        'pyramid_secure_response.csp_coverage.default_src': 'self',
+        'pyramid_secure_response.csp_coverage.script_src': 'self nonce',
+    }
+
+    def view(req):
+        req.csp.add('connect_src', 'https://api.example.org')
+        return Response()
+
+    handler_stub = mocker.Mock(side_effect=view)
+    csp_coverage_tween = tween(handler_stub, dummy_request.registry)
+
+    for _ in range(3):
+        vars(dummy_request).pop('csp', None)
+        vars(dummy_request).pop('csp_nonce', None)
+        dummy_request.csp = CSPOverride()
+        res = csp_coverage_tween(dummy_request)
+        assert "connect-src 'self' https://api.example.org; " \
+            "default-src 'self'; script-src 'self'" == \
+            res.headers['Content-Security-Policy']
+
+    # merged only once
+    # pylint: disable=no-member
+    assert 1 == csp_coverage.apply_csp_overrides.call_count
+
+    # nonce is spliced into the merged policy
+    dummy_request.csp = CSPOverride()
+    dummy_request.csp_nonce = 'abc'
+    res = csp_coverage_tween(dummy_request)
+    assert "script-src 'self' 'nonce-abc'" in \
+        res.headers['Content-Security-Policy']
+
+    # without overrides
+    del dummy_request.csp
+    handler_stub.side_effect = lambda req: Response()
+    res = csp_coverage_tween(dummy_request)
+    assert 'connect-src' not in res.headers['Content-Security-Policy']
+
+
+def test_csp_coverage_tween_with_override_in_report_only_mode(
+        dummy_request):
+    from pyramid.response import Response
+    from pyramid_secure_response.csp_coverage import tween
+
+    dummy_request.registry.settings = {
+        'pyramid_secure_response.csp_report_only.mode': 'report_only',
+        'pyramid_secure_response.csp_coverage.default_src': 'self',
+    }
+
+    def view(req):
+        get_csp_override(req).add('connect_src', 'https://api.example.org')
+        return Response()
+
+    res = tween(view, dummy_request.registry)(dummy_request)
+    # not enforced
+    assert 'Content-Security-Policy' not in res.headers
+    assert "connect-src 'self' https://api.example.org; " \
+        "default-src 'self'" == \
+        res.headers['Content-Security-Policy-Report-Only']
+
+
+@pytest.mark.parametrize('fused', ['False', 'True'])
+def test_csp_view_options(fused):
+    from pyramid.config import Configurator
+    from pyramid.request import Request
+    from pyramid.response import Response
+    from pyramid_secure_response.csp_override import csp_override
+
+    config = Configurator(settings={
+        'pyramid_secure_response.fused': fused,
+        'pyramid_secure_response.csp_coverage.default_src': 'self',
+        'pyramid_secure_response.csp_coverage.frame_src': 'none',
+    })
+    config.include('pyramid_secure_response')
+    config.add_route('index', '/')
+    config.add_route('chat', '/chat')
+    config.add_route('embed', '/embed')
+    config.add_view(lambda _: Response('OK'), route_name='index')
+    config.add_view(lambda _: Response('OK'), route_name='chat',
+                    csp_add={'connect_src': 'https://chat.example.org'})
+    config.add_view(lambda _: Response('OK'), route_name='embed',
+                    decorator=csp_override(
+                        add={'frame_src': 'https://video.example.org'}))
+    app = config.make_wsgi_app()
+
+    def get(path):  # type: (str) -> str
+        res = Request.blank('https://example.org' + path).get_response(app)
+        return res.headers['Content-Security-Policy']
+
+    assert "default-src 'self'; frame-src 'none'" == get('/')
+    assert "connect-src 'self' https://chat.example.org; " \
+        "default-src 'self'; frame-src 'none'" == get('/chat')
+    assert "default-src 'self'; " \
+        "frame-src https://video.example.org" == get('/embed')
+
+
+def test_csp_view_options_with_invalid_values():
+    from pyramid.config import Configurator
+    from pyramid.exceptions import ConfigurationExecutionError
+    from pyramid.response import Response
+
+    config = Configurator(settings={})
+    config.include('pyramid_secure_response')
+    config.add_view(lambda _: Response('OK'), name='index',
+                    csp_remove={'scripts_src': 'self'})
+    with pytest.raises(ConfigurationExecutionError):
+        config.commit()
@@ -0,0 +1,208 @@
+import json
+
+import pytest
+
+from pyramid_secure_response.csp_report import (
+    ReportQueue,
+    SpoolFile,
+    parse_reports,
+)
+
+CSP_REPORT = {
+    'csp-report': {
+        'document-uri': 'https://example.org/page',
+        'referrer': '',
+        'violated-directive': 'script-src',
+        'effective-directive': 'script-src',
+        'original-policy': "script-src 'self'",
+        'blocked-uri': 'inline',
+        'line-number': 1,
+    },
+}
+
+REPORTS = [
+    {
+        'type': 'csp-violation',
+        'url': 'https://example.org/page',
+        'body': {
+            'documentURL': 'https://example.org/page',
+            'effectiveDirective': 'img-src',
+            'blockedURL': 'https://evil.example.com/a.png',
+            'disposition': 'enforce',
+        },
+    },
+    {'type': 'deprecation', 'body': {}},
+]
+
+
+@pytest.fixture(autouse=True)
+def setup():
+    import logging
+    from pyramid_secure_response.csp_report import logger
+    logger.setLevel(logging.CRITICAL)
+
+
+def test_parse_reports():
+    assert [{
+        'document_uri': 'https://example.org/page',
+        'referrer': '',
+        'violated_directive': 'script-src',
+        'effective_directive': 'script-src',
+        'blocked_uri': 'inline',
+        'line_number': 1,
+    }] == parse_reports(json.dumps(CSP_REPORT).encode('utf-8'),
+                        'application/csp-report')
+
+    assert [{
+        'document_uri': 'https://example.org/page',
+        'violated_directive': 'img-src',
+        'effective_directive': 'img-src',
+        'blocked_uri': 'https://evil.example.com/a.png',
+        'disposition': 'enforce',
+    }] == parse_reports(json.dumps(REPORTS).encode('utf-8'),
+                        'application/reports+json')
+
+
+@pytest.mark.parametrize('body,content_type', [
+    (b'{', 'application/csp-report'),
+    (b'[]', 'application/csp-report'),
+    (b'{"csp-report": "inline"}', 'application/csp-report'),
+    (b'{}', 'application/reports+json'),
+    (b'[{"type": "csp-violation"}]', 'application/reports+json'),
+    (b'{}', 'application/json'),
+])
+def test_parse_reports_with_invalid_body(body, content_type):
+    with pytest.raises(ValueError):
+        parse_reports(body, content_type)
+
+
+def test_report_queue_writes_in_batches(mocker):
+    sink = mocker.stub(name='sink')
+    queue = ReportQueue(sink, maxsize=10, batch_size=3, interval=0.05)
+
+    for i in range(7):
+        assert queue.put({'i': i})
+    queue.stop(timeout=1)
+
+    batches = [c[0][0] for c in sink.call_args_list]
+    assert [{'i': i} for i in range(7)] == sum(batches, [])
+    assert all(len(b) <= 3 for b in batches)
+
+
+def test_report_queue_drops_if_full(mocker):
+    import threading
+
+    event = threading.Event()
+    sink = mocker.stub(name='sink')
+    sink.side_effect = lambda _: event.wait(1)
+
+    queue = ReportQueue(sink, maxsize=2, batch_size=1, interval=0.01)
+    assert queue.put({'i': 0})
+
+    # wait until the writer is blocked by the first report
+    for _ in range(100):
+        if sink.call_count:
+            break
+        event.wait(0.01)
+
+    results = [queue.put({'i': i}) for i in range(1, 5)]
+    assert [True, True, False, False] == results
+    assert 2 == queue.dropped
+
+    event.set()
+    queue.stop(timeout=1)
+    assert 3 == sink.call_count
+
+
+def test_report_queue_continues_after_sink_error(mocker):
+    sink = mocker.stub(name='sink')
+    sink.side_effect = [IOError('disk full'), None]
+
+    queue = ReportQueue(sink, batch_size=1, interval=0.01)
+    queue.put({'i': 0})
+    queue.put({'i': 1})
+    queue.stop(timeout=1)
+
+    assert 2 == sink.call_count
+
+
+def test_spool_file(tmpdir):
+    path = tmpdir.join('reports.jsonl')
+    spool = SpoolFile(str(path))
+    spool([{'a': 1}, {'b': 2}])
+    spool([{'c': 3}])
+
+    assert [{'a': 1}, {'b': 2}, {'c': 3}] == [
+        json.loads(line) for line in path.readlines()]
+
+
+@pytest.fixture
+def app(tmpdir):
+    from pyramid.config import Configurator
+
+    config = Configurator(settings={
+        'pyramid_secure_response.csp_report.spool':
+            str(tmpdir.join('reports.jsonl')),
+        'pyramid_secure_response.csp_report.max_body_size': '1024',
+        'pyramid_secure_response.csp_report.interval': '0.01',
+    })
+    config.include('pyramid_secure_response.csp_report')
+    return config.make_wsgi_app()
+
+
+def post(app, body, content_type):  # type: (Router, bytes, str) -> Response
+    from pyramid.request import Request
+
+    req = Request.blank('/csp-report', method='POST', body=body,
+                        content_type=content_type)
+    return req.get_response(app)
+
+
+def test_csp_report_view(app, tmpdir):
+    from pyramid_secure_response.csp_report import get_report_queue
+
+    res = post(app, json.dumps(CSP_REPORT).encode('utf-8'),
+               'application/csp-report')
+    assert 204 == res.status_code
+    res = post(app, json.dumps(REPORTS).encode('utf-8'),
+               'application/reports+json')
+    assert 204 == res.status_code
+
+    get_report_queue(app.registry).stop(timeout=1)
+
+    reports = [json.loads(line) for line in
+               tmpdir.join('reports.jsonl').readlines()]
+    assert ['inline', 'https://evil.example.com/a.png'] == [
+        r['blocked_uri'] for r in reports]
+    assert all('time' in r for r in reports)
+
+
+@pytest.mark.parametrize('body,content_type,status', [
+    (b'{}', 'application/json', 415),
+    (b'{"csp-report": {"blocked-uri": "' + b'a' * 1024 + b'"}}',
+     'application/csp-report', 413),
+    (b'{', 'application/csp-report', 400),
+])
+def test_csp_report_view_with_invalid_request(app, body, content_type,
+                                              status):
+    assert status == post(app, body, content_type).status_code
+
+
+def test_csp_report_view_sheds_load(mocker, app):
+    from pyramid_secure_response.csp_report import get_report_queue
+
+    queue = get_report_queue(app.registry)
+    mocker.patch.object(queue, 'put', return_value=False)
+
+    res = post(app, json.dumps(CSP_REPORT).encode('utf-8'),
+               'application/csp-report')
+    assert 204 == res.status_code
+    assert 1 == queue.put.call_count  # pylint: disable=no-member
+
+
+def test_includeme_without_spool():
+    from pyramid.config import Configurator
+
+    config = Configurator(settings={})
+    with pytest.raises(ValueError):
+        config.include('pyramid_secure_response.csp_report')
@@ -0,0 +1,169 @@
+import pytest
+
+from pyramid_secure_response.csp_rollup import (
+    CountMinSketch,
+    ReportAggregator,
+    fingerprint,
+)
+
+
+def build_report(directive='script-src-elem', blocked_uri='inline',
+                 document_uri='https://example.org/', seen=100):
+    return {
+        'violated_directive': directive,
+        'blocked_uri': blocked_uri,
+        'document_uri': document_uri,
+        'time': seen,
+    }
+
+
+@pytest.fixture(autouse=True)
+def setup():
+    import logging
+    from pyramid_secure_response.csp_rollup import logger
+    logger.setLevel(logging.CRITICAL)
+
+
+@pytest.mark.parametrize('report,expected', [
+    ({}, ('', '', '')),
+    (build_report(directive="img-src 'self'",
+                  blocked_uri='https://evil.example.com:8080/a.png?x=1',
+                  document_uri='https://example.org/a?b=c#d'),
+     ('img-src', 'https://evil.example.com:8080', '/a')),
+    (build_report(blocked_uri='data:image/png;base64,AAAA'),
+     ('script-src-elem', 'data', '/')),
+    (dict(build_report(directive='script-src'),
+          effective_directive='script-src-attr'),
+     ('script-src-attr', 'inline', '/')),
+    (build_report(document_uri='https://example.org/' + 'a' * 1000),
+     ('script-src-elem', 'inline', '/' + 'a' * 255)),
+])
+def test_fingerprint(report, expected):
+    assert expected == fingerprint(report)
+
+
+def test_count_min_sketch():
+    sketch = CountMinSketch(width=64, depth=4)
+    for i in range(1000):
+        sketch.add(('noise', i))
+    for _ in range(500):
+        sketch.add(('heavy',))
+
+    assert 500 <= sketch.estimate(('heavy',))
+    assert 0 == CountMinSketch().estimate(('unknown',))
+
+
+def test_report_aggregator_rolls_up(mocker):
+    sink = mocker.stub(name='sink')
+    aggregator = ReportAggregator(sink, maxsize=10, interval=3600)
+
+    aggregator([build_report(seen=100), build_report(seen=200)])
+    aggregator([build_report(directive='img-src', seen=150)])
+    assert 0 == sink.call_count  # within the interval
+
+    rollups = aggregator.flush()
+    sink.assert_called_once_with(rollups)
+    assert [{
+        'directive': 'script-src-elem',
+        'blocked_uri': 'inline',
+        'document_path': '/',
+        'count': 2,
+        'first_seen': 100,
+        'last_seen': 200,
+    }, {
+        'directive': 'img-src',
+        'blocked_uri': 'inline',
+        'document_path': '/',
+        'count': 1,
+        'first_seen': 150,
+        'last_seen': 150,
+    }] == rollups
+
+    # counts since the last flush
+    aggregator([build_report(seen=300)])
+    assert [1] == [r['count'] for r in aggregator.flush()]
+    assert [] == aggregator.flush()
+
+
+def test_report_aggregator_flushes_at_interval(mocker):
+    sink = mocker.stub(name='sink')
+    aggregator = ReportAggregator(sink, interval=0)
+
+    aggregator([build_report()])
+    assert 1 == sink.call_count
+
+
+def test_report_aggregator_keeps_bounded_memory(mocker):
+    sink = mocker.stub(name='sink')
+    aggregator = ReportAggregator(sink, maxsize=100, interval=3600)
+
+    aggregator([build_report()] * 50)
+    # adversarial, high-cardinality input
+    for i in range(100):
+        aggregator([build_report(blocked_uri='https://{:d}-{:d}.example'
+                                 .format(i, j)) for j in range(100)])
+        assert len(aggregator) <= 100
+
+    # evicted ones are written per batch (not lost)
+    aggregator.flush()
+    assert 101 >= sink.call_count
+    rollups = sum((c[0][0] for c in sink.call_args_list), [])
+    assert 50 + 100 * 100 == sum(r['count'] for r in rollups)
+    assert 9901 == aggregator.evicted
+
+    # total count is restored from sketch
+    aggregator([build_report()])
+    assert 51 <= dict(aggregator.top(field='blocked_uri'))['inline']
+    assert 51 <= aggregator.estimate(build_report())
+
+
+def test_report_aggregator_top():
+    aggregator = ReportAggregator(maxsize=100)
+    aggregator(
+        [build_report(document_uri='https://example.org/a')] * 3 +
+        [build_report(document_uri='https://example.org/b')] * 2 +
+        [build_report(directive='img-src')] * 4 +
+        [build_report(directive='style-src')])
+
+    assert [('script-src-elem', 5), ('img-src', 4)] == aggregator.top(2)
+    assert [('/', 5), ('/a', 3), ('/b', 2)] == \
+        aggregator.top(field='document_path')
+    assert (('img-src', 'inline', '/'), 4) == \
+        aggregator.top(1, field='fingerprint')[0]
+
+
+def test_report_queue_with_aggregator(mocker):
+    from pyramid_secure_response.csp_report import ReportQueue
+
+    sink = mocker.stub(name='sink')
+    aggregator = ReportAggregator(sink, interval=3600)
+    queue = ReportQueue(aggregator, batch_size=2, interval=0.01)
+    for _ in range(5):
+        queue.put(build_report())
+    queue.stop(timeout=1)
+
+    # flushed at stop
+    assert [5] == [r['count'] for r in sink.call_args_list[-1][0][0]]
+
+
+def test_get_report_aggregator(tmpdir):
+    from pyramid.config import Configurator
+    from pyramid_secure_response.csp_report import (
+        get_report_aggregator,
+        get_report_queue,
+    )
+
+    settings = {
+        'pyramid_secure_response.csp_report.spool':
+            str(tmpdir.join('rollups.jsonl')),
+    }
+    config = Configurator(settings=settings)
+    assert get_report_aggregator(config.registry) is None
+
+    config = Configurator(settings=dict(settings, **{
+        'pyramid_secure_response.csp_report.rollup': 'True',
+        'pyramid_secure_response.csp_report.rollup_size': '10',
+    }))
+    aggregator = get_report_aggregator(config.registry)
+    assert aggregator is get_report_queue(config.registry).sink
+    assert 10 == aggregator.maxsize
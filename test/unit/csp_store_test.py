@@ -0,0 +1,110 @@
+import pytest
+
+from pyramid_secure_response.csp_store import (
+    ReportStore,
+    main,
+)
+
+NOW = 1500000000
+
+
+def build_report(directive='script-src-elem', blocked_uri='inline',
+                 seen=NOW):
+    return {
+        'violated_directive': directive,
+        'blocked_uri': blocked_uri,
+        'document_uri': 'https://example.org/a',
+        'time': seen,
+    }
+
+
+@pytest.fixture
+def store(tmpdir):
+    store = ReportStore(str(tmpdir.join('reports.sqlite')))
+    yield store
+    store.close()
+
+
+def test_report_store_schema(store):
+    conn = store.connection
+    assert 'wal' == conn.execute('PRAGMA journal_mode').fetchone()[0]
+    assert {
+        'reports_directive', 'reports_blocked_origin', 'reports_bucket',
+    } <= {row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+
+def test_report_store_top(store):
+    store([build_report()] * 3 + [
+        build_report(directive='img-src',
+                     blocked_uri='https://evil.example.com/a.png'),
+        build_report(seen=NOW - 7200),  # out of range
+    ])
+    # rollup
+    store([{
+        'directive': 'img-src',
+        'blocked_uri': 'https://evil.example.com',
+        'document_path': '/b',
+        'count': 5,
+        'first_seen': NOW - 10,
+        'last_seen': NOW - 10,
+    }])
+
+    assert [
+        ('img-src', 'https://evil.example.com', 6),
+        ('script-src-elem', 'inline', 3),
+    ] == store.top(now=NOW)
+    assert [('img-src', 6)] == store.top(1, field='directive', now=NOW)
+    assert [('/a', 4), ('/b', 5)] == sorted(
+        store.top(field='document_path', now=NOW))
+    # scheme://host[:port] (or keyword)
+    assert [('https://evil.example.com', 6), ('inline', 3)] == store.top(
+        field='blocked_origin', now=NOW)
+    assert [('img-src', 6), ('script-src-elem', 4)] == store.top(
+        since=86400, field='directive', now=NOW + 60)
+
+
+def test_report_store_prune(store):
+    store([build_report(seen=NOW - 86400), build_report(seen=NOW)])
+
+    assert 1 == store.prune(3600, now=NOW)
+    assert [('script-src-elem', 1)] == store.top(
+        since=86400 * 2, field='directive', now=NOW)
+
+
+def test_report_store_prunes_on_write(tmpdir):
+    store = ReportStore(str(tmpdir.join('reports.sqlite')), retention=3600)
+    store([build_report(seen=1)])
+    assert [] == store.top(since=NOW, field='directive', now=NOW)
+    store.close()
+
+
+def test_main(capsys, store):
+    import time
+
+    now = int(time.time())
+    store([build_report(seen=now)] * 2 + [build_report(seen=now - 86400)])
+
+    assert 0 == main(['top', store.path, '--last', '3600'])
+    assert '         2  script-src-elem  inline\n' == capsys.readouterr().out
+    assert 0 == main(['top', store.path, '--field', 'blocked_origin'])
+    assert '         2  inline\n' == capsys.readouterr().out
+
+    assert 0 == main(['prune', store.path, '--retention', '3600'])
+    assert '1 reports deleted\n' == capsys.readouterr().out
+
+
+def test_get_report_queue_with_store(tmpdir):
+    from pyramid.config import Configurator
+    from pyramid_secure_response.csp_report import get_report_queue
+
+    config = Configurator(settings={
+        'pyramid_secure_response.csp_report.store':
+            str(tmpdir.join('reports.sqlite')),
+        'pyramid_secure_response.csp_report.retention': '86400',
+    })
+    config.include('pyramid_secure_response.csp_report')
+
+    sink = get_report_queue(config.registry).sink
+    assert isinstance(sink, ReportStore)
+    assert 86400 == sink.retention
@@ -30,15 +30,15 @@ def test_build_hsts_header(max_age, include_subdomains, preload, header):
 
 
 def test_hsts_support_tween_with_disabled(mocker, dummy_request):
-    mocker.patch('pyramid_secure_response.hsts_support.apply_path_filter',
+    mocker.patch('pyramid_secure_response.secure_context.match_path',
                  return_value=True)
-    mocker.patch('pyramid_secure_response.hsts_support.build_criteria',
-                 return_value=[])
+    mocker.patch('pyramid_secure_response.secure_context.is_secure_environ',
+                 return_value=False)
 
     from pyramid.response import Response
-    from pyramid_secure_response.hsts_support import (
-        apply_path_filter,
-        build_criteria,
+    from pyramid_secure_response.secure_context import (
+        match_path,
+        is_secure_environ,
     )
 
     dummy_request.registry.settings = {
@@ -52,21 +52,21 @@ def test_hsts_support_tween_with_disabled(mocker, dummy_request):
 
     # pylint: disable=no-member
     assert 1 == handler_stub.call_count
-    assert 0 == apply_path_filter.call_count
-    assert 0 == build_criteria.call_count
+    assert 0 == match_path.call_count
+    assert 0 == is_secure_environ.call_count
     assert 'Strict-Transport-Security' not in res.headers
 
 
 def test_hsts_support_tween_with_ignored_path(mocker, dummy_request):
-    mocker.patch('pyramid_secure_response.hsts_support.apply_path_filter',
+    mocker.patch('pyramid_secure_response.secure_context.match_path',
                  return_value=True)
-    mocker.patch('pyramid_secure_response.hsts_support.build_criteria',
-                 return_value=[])
+    mocker.patch('pyramid_secure_response.secure_context.is_secure_environ',
+                 return_value=False)
 
     from pyramid.response import Response
-    from pyramid_secure_response.hsts_support import (
-        apply_path_filter,
-        build_criteria,
+    from pyramid_secure_response.secure_context import (
+        match_path,
+        is_secure_environ,
     )
 
     dummy_request.path = '/humans.txt'
@@ -82,27 +82,31 @@ def test_hsts_support_tween_with_ignored_path(mocker, dummy_request):
 
     # pylint: disable=no-member
     assert 1 == handler_stub.call_count
-    assert 1 == apply_path_filter.call_count
-    apply_path_filter.assert_called_once_with(
-        dummy_request, ('/humans.txt',))
-    assert 0 == build_criteria.call_count
+    assert 1 == match_path.call_count
+    match_path.assert_called_once_with(
+        dummy_request.path, ('/humans.txt',))
+    assert 0 == is_secure_environ.call_count
     assert 'Strict-Transport-Security' not in res.headers
 
 
 def test_hsts_tween_with_none_ssl_request(mocker, dummy_request):
-    from pyramid_secure_response import hsts_support
-    mocker.spy(hsts_support, 'apply_path_filter')
-    mocker.spy(hsts_support, 'build_criteria')
+    from pyramid_secure_response import secure_context
+    mocker.spy(secure_context, 'match_path')
+    mocker.spy(secure_context, 'is_secure_environ')
 
     from pyramid.response import Response
-    from pyramid_secure_response.hsts_support import (
-        apply_path_filter,
-        build_criteria,
+    from pyramid_secure_response.secure_context import (
+        match_path,
+        is_secure_environ,
     )
 
-    from pyramid_secure_response.util import get_config
+    from pyramid_secure_response.util import (
+        get_config,
+        get_proto_environ_key,
+    )
 
     dummy_request.url = 'http://example.org/'
+    dummy_request.environ['wsgi.url_scheme'] = 'http'
     dummy_request.registry.settings = {
         'pyramid_secure_response.hsts_support.enabled': 'True',
         'pyramid_secure_response.hsts_support.max_age': '31536000',
@@ -120,33 +124,40 @@ def test_hsts_tween_with_none_ssl_request(mocker, dummy_request):
     # pylint: disable=no-member
     assert 1 == handler_stub.call_count
 
-    assert 1 == apply_path_filter.call_count
-    apply_path_filter.assert_called_once_with(dummy_request, tuple())
+    assert 1 == match_path.call_count
+    match_path.assert_called_once_with(
+        dummy_request.path, tuple())
 
-    assert 1 == build_criteria.call_count
+    assert 1 == is_secure_environ.call_count
     config = get_config(dummy_request.registry)
-    build_criteria.assert_called_once_with(
-        dummy_request, proto_header=config.hsts_support.proto_header)
+    is_secure_environ.assert_called_once_with(
+        dummy_request.environ,
+        get_proto_environ_key(config.hsts_support.proto_header))
 
     assert 'Strict-Transport-Security' not in res.headers
 
 
 def test_hsts_tween_with_ssl_request_plus_none_ssl_extra_header(
         mocker, dummy_request):
-    from pyramid_secure_response import hsts_support
-    mocker.spy(hsts_support, 'apply_path_filter')
-    mocker.spy(hsts_support, 'build_criteria')
+    from pyramid_secure_response import secure_context
+    mocker.spy(secure_context, 'match_path')
+    mocker.spy(secure_context, 'is_secure_environ')
 
     from pyramid.response import Response
-    from pyramid_secure_response.hsts_support import (
-        apply_path_filter,
-        build_criteria,
+    from pyramid_secure_response.secure_context import (
+        match_path,
+        is_secure_environ,
     )
 
-    from pyramid_secure_response.util import get_config
+    from pyramid_secure_response.util import (
+        get_config,
+        get_proto_environ_key,
+    )
 
     dummy_request.url = 'https://example.org/'
+    dummy_request.environ['wsgi.url_scheme'] = 'https'
     dummy_request.headers['X-Forwarded-Proto'] = 'http'
+    dummy_request.environ['HTTP_X_FORWARDED_PROTO'] = 'http'
     dummy_request.registry.settings = {
         'pyramid_secure_response.hsts_support.enabled': 'True',
         'pyramid_secure_response.hsts_support.max_age': '3600',
@@ -165,31 +176,37 @@ def test_hsts_tween_with_ssl_request_plus_none_ssl_extra_header(
     # pylint: disable=no-member
     assert 1 == handler_stub.call_count
 
-    assert 1 == apply_path_filter.call_count
-    apply_path_filter.assert_called_once_with(dummy_request, tuple())
+    assert 1 == match_path.call_count
+    match_path.assert_called_once_with(
+        dummy_request.path, tuple())
 
-    assert 1 == build_criteria.call_count
+    assert 1 == is_secure_environ.call_count
     config = get_config(dummy_request.registry)
-    build_criteria.assert_called_once_with(
-        dummy_request, proto_header=config.hsts_support.proto_header)
+    is_secure_environ.assert_called_once_with(
+        dummy_request.environ,
+        get_proto_environ_key(config.hsts_support.proto_header))
 
     assert 'Strict-Transport-Security' not in res.headers
 
 
 def test_hsts_tween_with_ssl_request(mocker, dummy_request):
-    from pyramid_secure_response import hsts_support
-    mocker.spy(hsts_support, 'apply_path_filter')
-    mocker.spy(hsts_support, 'build_criteria')
+    from pyramid_secure_response import secure_context
+    mocker.spy(secure_context, 'match_path')
+    mocker.spy(secure_context, 'is_secure_environ')
 
     from pyramid.response import Response
-    from pyramid_secure_response.hsts_support import (
-        apply_path_filter,
-        build_criteria,
+    from pyramid_secure_response.secure_context import (
+        match_path,
+        is_secure_environ,
     )
 
-    from pyramid_secure_response.util import get_config
+    from pyramid_secure_response.util import (
+        get_config,
+        get_proto_environ_key,
+    )
 
     dummy_request.url = 'https://example.org/'
+    dummy_request.environ['wsgi.url_scheme'] = 'https'
     dummy_request.registry.settings = {
         'pyramid_secure_response.hsts_support.enabled': 'True',
         'pyramid_secure_response.hsts_support.max_age': '300',  # 5 minutes.
@@ -207,13 +224,15 @@ def test_hsts_tween_with_ssl_request(mocker, dummy_request):
     # pylint: disable=no-member
     assert 1 == handler_stub.call_count
 
-    assert 1 == apply_path_filter.call_count
-    apply_path_filter.assert_called_once_with(dummy_request, tuple())
+    assert 1 == match_path.call_count
+    match_path.assert_called_once_with(
+        dummy_request.path, tuple())
 
-    assert 1 == build_criteria.call_count
+    assert 1 == is_secure_environ.call_count
     config = get_config(dummy_request.registry)
-    build_criteria.assert_called_once_with(
-        dummy_request, proto_header=config.hsts_support.proto_header)
+    is_secure_environ.assert_called_once_with(
+        dummy_request.environ,
+        get_proto_environ_key(config.hsts_support.proto_header))
 
     assert 'Strict-Transport-Security' in res.headers
     assert 'max-age=300; includeSubDomains; preload' == \
@@ -222,20 +241,25 @@ def test_hsts_tween_with_ssl_request(mocker, dummy_request):
 
 def test_hsts_tween_with_ssl_request_plus_extra_header_check(
         mocker, dummy_request):
-    from pyramid_secure_response import hsts_support
-    mocker.spy(hsts_support, 'apply_path_filter')
-    mocker.spy(hsts_support, 'build_criteria')
+    from pyramid_secure_response import secure_context
+    mocker.spy(secure_context, 'match_path')
+    mocker.spy(secure_context, 'is_secure_environ')
 
     from pyramid.response import Response
-    from pyramid_secure_response.hsts_support import (
-        apply_path_filter,
-        build_criteria,
+    from pyramid_secure_response.secure_context import (
+        match_path,
+        is_secure_environ,
     )
 
-    from pyramid_secure_response.util import get_config
+    from pyramid_secure_response.util import (
+        get_config,
+        get_proto_environ_key,
+    )
 
     dummy_request.url = 'https://example.org/'
+    dummy_request.environ['wsgi.url_scheme'] = 'https'
     dummy_request.headers['X-Forwarded-Proto'] = 'https'
+    dummy_request.environ['HTTP_X_FORWARDED_PROTO'] = 'https'
     dummy_request.registry.settings = {
         'pyramid_secure_response.hsts_support.enabled': 'True',
         'pyramid_secure_response.hsts_support.max_age': '604800',  # 1 week
@@ -254,14 +278,92 @@ def test_hsts_tween_with_ssl_request_plus_extra_header_check(
     # pylint: disable=no-member
     assert 1 == handler_stub.call_count
 
-    assert 1 == apply_path_filter.call_count
-    apply_path_filter.assert_called_once_with(dummy_request, tuple())
+    assert 1 == match_path.call_count
+    match_path.assert_called_once_with(
+        dummy_request.path, tuple())
 
-    assert 1 == build_criteria.call_count
+    assert 1 == is_secure_environ.call_count
     config = get_config(dummy_request.registry)
-    build_criteria.assert_called_once_with(
-        dummy_request, proto_header=config.hsts_support.proto_header)
+    is_secure_environ.assert_called_once_with(
+        dummy_request.environ,
+        get_proto_environ_key(config.hsts_support.proto_header))
 
     assert 'Strict-Transport-Security' in res.headers
     assert 'max-age=604800; includeSubDomains; preload' == \
         res.headers['Strict-Transport-Security']
+
+
+@pytest.mark.parametrize('host,expected', [
+    ('example.org:443', 'max-age=300; includeSubDomains; preload'),
+    ('www.example.com', 'max-age=300'),
+    ('example.com', 'max-age=300; includeSubDomains; preload'),
+    ('legacy.example.net', None),
+])
+def test_hsts_tween_with_host_policies(mocker, dummy_request, host, expected):
+    from pyramid.response import Response
+
+    dummy_request.host = host
+    dummy_request.environ['wsgi.url_scheme'] = 'https'
+    dummy_request.registry.settings = {
+        'pyramid_secure_response.hsts_support.max_age': '300',
+        'pyramid_secure_response.host_policy.a.hosts': '*.example.com',
+        'pyramid_secure_response.host_policy.a.hsts_support.'
+        'include_subdomains': 'False',
+        'pyramid_secure_response.host_policy.a.hsts_support.preload': 'False',
+        'pyramid_secure_response.host_policy.b.hosts': 'legacy.example.net',
+        'pyramid_secure_response.host_policy.b.hsts_support.enabled': 'False',
+    }
+
+    handler_stub = mocker.stub(name='handler_stub')
+    handler_stub.return_value = Response(status=200)
+    res = tween(handler_stub, dummy_request.registry)(dummy_request)
+
+    assert expected == res.headers.get('Strict-Transport-Security')
+
+
+def test_hsts_tween_with_policy_store(dummy_request, tmpdir):
+    from pyramid.response import Response
+
+    tmpdir.join('a.example.com.json').write(
+        '{"hsts_support": {"max_age": 60}}')
+    dummy_request.environ['wsgi.url_scheme'] = 'https'
+    dummy_request.registry.settings = {
+        'pyramid_secure_response.hsts_support.max_age': '300',
+        'pyramid_secure_response.hsts_support.preload': 'False',
+        'pyramid_secure_response.policy_store.path': str(tmpdir),
+        'pyramid_secure_response.host_policy.a.hosts': '*.example.com',
+        'pyramid_secure_response.host_policy.a.hsts_support.enabled': 'False',
+    }
+
+    hsts_support_tween = tween(
+        lambda req: Response(status=200), dummy_request.registry)
+    headers = {}
+    for host in ('a.example.com', 'b.example.com', 'example.org'):
+        dummy_request.host = host
+        headers[host] = hsts_support_tween(dummy_request).headers.get(
+            'Strict-Transport-Security')
+        del dummy_request.secure_context
+
+    assert {
+        'a.example.com': 'max-age=60; includeSubDomains',
+        'b.example.com': None,  # host_policy
+        'example.org': 'max-age=300; includeSubDomains',
+    } == headers
+
+
+@pytest.mark.parametrize('content_type,expected', [
+    ('text/html; charset=UTF-8', True),
+    ('application/json', False),
+    ('image/svg+xml', False),
+])
+def test_hsts_tween_with_content_types(dummy_request, content_type, expected):
+    from pyramid.response import Response
+
+    dummy_request.environ['wsgi.url_scheme'] = 'https'
+    dummy_request.registry.settings = {
+        'pyramid_secure_response.hsts_support.content_types': 'text/html',
+    }
+
+    res = tween(lambda req: Response(content_type=content_type),
+                dummy_request.registry)(dummy_request)
+    assert expected == ('Strict-Transport-Security' in res.headers)
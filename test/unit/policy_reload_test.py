@@ -0,0 +1,181 @@
+import json
+import os
+import time
+
+import pytest
+
+from pyramid_secure_response.policy_reload import (
+    PolicyWatcher,
+    compile_policy,
+    get_policy_watcher,
+)
+
+SETTINGS = {
+    'pyramid_secure_response.hsts_support.max_age': '300',
+    'pyramid_secure_response.csp_coverage.default_src': 'self',
+}
+
+
+@pytest.fixture(autouse=True)
+def setup():
+    import logging
+    from pyramid_secure_response.policy_reload import logger
+    logger.setLevel(logging.CRITICAL)
+
+
+def write_policy(path, policy, mtime=None):
+    path.write(json.dumps(policy) if isinstance(policy, dict) else policy)
+    if mtime is not None:
+        os.utime(str(path), (mtime, mtime))
+
+
+@pytest.fixture
+def policy_file(tmpdir):
+    path = tmpdir.join('policy.json')
+    write_policy(path, {'hsts_support': {'preload': False}}, mtime=1000)
+    return path
+
+
+def test_compile_policy(policy_file):
+    policy = compile_policy(SETTINGS, str(policy_file))
+
+    assert 'max-age=300; includeSubDomains' == \
+        policy.resolve_hsts_header('example.org')
+    assert policy.resolve_csp_header_f('example.org') is not None
+
+    write_policy(policy_file, {
+        'hsts_support': {'enabled': False},
+        'csp_coverage': {'enabled': False},
+    })
+    policy = compile_policy(SETTINGS, str(policy_file))
+    assert policy.resolve_hsts_header('example.org') is None
+    assert policy.resolve_csp_header_f('example.org') is None
+
+
+def test_policy_watcher_check(policy_file):
+    watcher = PolicyWatcher(str(policy_file), SETTINGS)
+    current = watcher.current
+    assert not watcher.check()
+    assert current is watcher.current
+
+    write_policy(policy_file, {'hsts_support': {'max_age': 60}}, mtime=1001)
+    assert watcher.check()
+    assert 'max-age=60; includeSubDomains; preload' == \
+        watcher.resolve_hsts_header('example.org')
+    assert 1 == watcher.reloaded
+
+
+def test_policy_watcher_check_reuses_scan_and_store(mocker, tmpdir,
+                                                    policy_file):
+    from pyramid_secure_response import csp_hashes
+    mocker.patch.object(csp_hashes, 'scan', return_value=(
+        ("'sha256-abc'",), ()))
+
+    settings = dict(SETTINGS, **{
+        'pyramid_secure_response.csp_hashes.enabled': 'True',
+        'pyramid_secure_response.policy_store.path': str(tmpdir),
+    })
+    watcher = PolicyWatcher(str(policy_file), settings)
+    store = watcher.current.config.policy_store
+    assert store is not None
+    mocker.spy(store, 'refresh')
+
+    write_policy(policy_file, {'csp_coverage': {'script_src': 'self'}},
+                 mtime=1001)
+    assert watcher.check()
+    config = watcher.current.config
+    assert store is config.policy_store
+    assert "self 'sha256-abc'" == config.csp_coverage.directives['script_src']
+    # pylint: disable=no-member
+    assert 1 == csp_hashes.scan.call_count
+    # the listing of tenants is refreshed
+    assert 1 == store.refresh.call_count
+
+
+@pytest.mark.parametrize('policy', [
+    '{',
+    {'hsts_support': {'max_age': 'forever'}},
+    {'ssl_redirect': {'enabled': False}},
+])
+def test_policy_watcher_check_keeps_previous_policy(policy_file, policy):
+    watcher = PolicyWatcher(str(policy_file), SETTINGS)
+    current = watcher.current
+
+    write_policy(policy_file, policy, mtime=1001)
+    assert not watcher.check()
+    assert current is watcher.current
+    assert 0 == watcher.reloaded
+
+    # not retried until the file is changed again
+    assert not watcher.check()
+
+    policy_file.remove()
+    assert not watcher.check()
+    assert current is watcher.current
+
+
+def test_policy_watcher_with_invalid_values(tmpdir, policy_file):
+    with pytest.raises(ValueError):
+        PolicyWatcher(str(policy_file), SETTINGS, interval=0)
+    with pytest.raises(IOError):
+        PolicyWatcher(str(tmpdir.join('missing.json')), SETTINGS)
+
+
+def test_policy_watcher_thread(policy_file):
+    watcher = PolicyWatcher(str(policy_file), SETTINGS, interval=0.01)
+    watcher.start()
+    try:
+        write_policy(policy_file, {'hsts_support': {'max_age': 60}},
+                     mtime=1001)
+        deadline = time.time() + 5
+        while not watcher.reloaded and time.time() < deadline:
+            time.sleep(0.01)
+        assert 1 == watcher.reloaded
+    finally:
+        watcher.stop()
+    assert watcher._thread is None  # pylint: disable=protected-access
+
+
+def test_get_policy_watcher(dummy_request, policy_file):
+    registry = dummy_request.registry
+    registry.settings = {}
+    assert get_policy_watcher(registry) is None
+
+    registry.settings = dict(SETTINGS, **{
+        'pyramid_secure_response.policy_reload.path': str(policy_file),
+    })
+    watcher = get_policy_watcher(registry)
+    try:
+        assert isinstance(watcher, PolicyWatcher)
+        assert watcher is get_policy_watcher(registry)
+        assert 2.0 == watcher.interval
+    finally:
+        # stopped by new settings
+        registry.settings = {}
+        assert get_policy_watcher(registry) is None
+    assert watcher._thread is None  # pylint: disable=protected-access
+
+
+@pytest.mark.parametrize('name', ['hsts_support', 'secure_response'])
+def test_tween_with_policy_reload(dummy_request, policy_file, name):
+    from importlib import import_module
+    from pyramid.response import Response
+
+    dummy_request.environ['wsgi.url_scheme'] = 'https'
+    dummy_request.registry.settings = dict(SETTINGS, **{
+        'pyramid_secure_response.policy_reload.path': str(policy_file),
+    })
+    tween = import_module('pyramid_secure_response.{:s}'.format(name)).tween
+    tween = tween(lambda req: Response(), dummy_request.registry)
+    watcher = get_policy_watcher(dummy_request.registry)
+    try:
+        assert 'max-age=300; includeSubDomains' == \
+            tween(dummy_request).headers['Strict-Transport-Security']
+
+        write_policy(policy_file, {'hsts_support': {'enabled': False}},
+                     mtime=1001)
+        watcher.check()
+        assert 'Strict-Transport-Security' not in \
+            tween(dummy_request).headers
+    finally:
+        watcher.stop()
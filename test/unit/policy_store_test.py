@@ -0,0 +1,258 @@
+import json
+
+import pytest
+
+from pyramid_secure_response.policy_store import (
+    PolicyStore,
+    parse_ini_policy,
+    parse_json_policy,
+)
+
+SETTINGS = {
+    'pyramid_secure_response.hsts_support.max_age': '300',
+    'pyramid_secure_response.csp_coverage.default_src': 'self',
+}
+
+
+@pytest.fixture(autouse=True)
+def setup():
+    import logging
+    from pyramid_secure_response.policy_store import logger
+    logger.setLevel(logging.CRITICAL)
+
+
+@pytest.fixture
+def policy_dir(tmpdir):
+    tmpdir.join('a.example.org.json').write(json.dumps({
+        'hsts_support': {'preload': False},
+        'csp_coverage': {'frame_ancestors': 'none'},
+    }))
+    tmpdir.join('b.example.org.ini').write('\n'.join((
+        '[hsts_support]',
+        'enabled = False',
+        '[csp_coverage]',
+        'frame_ancestors = none',
+    )))
+    return tmpdir
+
+
+def test_parse_json_policy():
+    assert {
+        'hsts_support': {'max_age': '300', 'preload': 'False'},
+        'csp_coverage': {'ignore_paths': '\n/a', 'img_src': 'self data:'},
+    } == parse_json_policy(json.dumps({
+        'hsts_support': {'max_age': 300, 'preload': False},
+        'csp_coverage': {
+            'ignore_paths': ['/a'], 'img_src': ['self', 'data:']},
+    }))
+
+    for text in ('[]', '{"hsts_support": "preload"}', '{'):
+        with pytest.raises(ValueError):
+            parse_json_policy(text)
+
+
+def test_parse_ini_policy():
+    assert {
+        'csp_coverage': {'script_src': 'self\nhttps://cdn.example.org'},
+    } == parse_ini_policy(u'\n'.join((
+        u'[csp_coverage]',
+        u'script_src = self',
+        u'    https://cdn.example.org',
+    )))
+
+
+def test_policy_store_get(policy_dir):
+    store = PolicyStore(str(policy_dir), SETTINGS)
+
+    a = store.get('a.example.org:443')
+    assert 'max-age=300; includeSubDomains' == a.hsts_header
+    assert a.set_csp_header is not None
+
+    b = store.get('B.example.org')
+    assert b.hsts_header is None
+    # same CSP is shared
+    assert a.set_csp_header is b.set_csp_header
+
+    assert store.get('c.example.org') is None
+
+
+def test_policy_store_shares_csp_by_content_types(policy_dir):
+    policy_dir.join('c.example.org.json').write(json.dumps({
+        'csp_coverage': {
+            'frame_ancestors': 'none', 'content_types': ['text/html']},
+    }))
+    store = PolicyStore(str(policy_dir), SETTINGS)
+
+    assert store.get('a.example.org').set_csp_header is not \
+        store.get('c.example.org').set_csp_header
+
+
+@pytest.mark.parametrize('host', [
+    '..', '../a.example.org', 'a.example.org/../b', '[::1]', '',
+])
+def test_policy_store_get_with_invalid_host(mocker, policy_dir, host):
+    store = PolicyStore(str(policy_dir), SETTINGS)
+    mocker.spy(store, 'load')
+
+    assert store.get(host) is None
+    # pylint: disable=no-member
+    assert 0 == store.load.call_count
+
+
+@pytest.mark.parametrize('name,text', [
+    ('c.example.org.json', '{"hsts_support": {"max_age": "-1"}}'),
+    ('c.example.org.json', '{"ssl_redirect": {"enabled": false}}'),
+    ('c.example.org.json', '{"csp_coverage": {"scripts_src": "self"}}'),
+    ('c.example.org.json', 'null'),
+    # applied only globally
+    ('c.example.org.json', '{"csp_coverage": {"ignore_paths": ["/a"]}}'),
+    ('c.example.org.json', '{"hsts_support": {"content_types": "text/html"}}'),
+    ('c.example.org.ini', 'max_age = 300'),
+])
+def test_policy_store_get_with_invalid_policy(policy_dir, name, text):
+    policy_dir.join(name).write(text)
+    store = PolicyStore(str(policy_dir), SETTINGS)
+
+    assert store.get('c.example.org') is None
+    assert 1 == store.info().misses
+
+
+def test_policy_store_cache(mocker, policy_dir):
+    policy_dir.join('c.example.org.json').write(json.dumps({
+        'hsts_support': {'max_age': '60'},
+    }))
+    store = PolicyStore(str(policy_dir), SETTINGS, cache_size=2)
+    mocker.spy(store, 'load')
+
+    a = store.get('a.example.org')
+    assert a is store.get('a.example.org')
+    assert store.get('b.example.org') is not None
+    assert (1, 2, 2, 2) == store.info()
+    # pylint: disable=no-member
+    assert 2 == store.load.call_count
+
+    # a.example.org is evicted
+    store.get('c.example.org')
+    assert a is not store.get('a.example.org')
+    assert 4 == store.load.call_count
+
+    store.clear()
+    assert 0 == store.info().currsize
+
+
+def test_policy_store_get_with_unknown_host(mocker, policy_dir):
+    store = PolicyStore(str(policy_dir), SETTINGS, cache_size=2)
+    mocker.spy(store, 'hosts')
+    mocker.spy(store, 'load')
+
+    a = store.get('a.example.org')
+    for i in range(10):
+        assert store.get('{:d}.example.org'.format(i)) is None
+    # not looked up, and tenants are not evicted
+    assert a is store.get('a.example.org')
+    assert (1, 1, 2, 1) == store.info()
+    # pylint: disable=no-member
+    assert 1 == store.load.call_count
+    assert 1 == store.hosts.call_count
+
+
+def test_policy_store_get_with_missing_policy(mocker, policy_dir):
+    policy_dir.join('c.example.org.json').write('null')
+    store = PolicyStore(str(policy_dir), SETTINGS, cache_size=1)
+    mocker.spy(store, 'load')
+
+    a = store.get('a.example.org')
+    assert store.get('c.example.org') is None
+    assert store.get('c.example.org') is None
+    # the host without valid policy is cached apart from tenants
+    assert a is store.get('a.example.org')
+    assert (2, 2, 1, 1) == store.info()
+    # pylint: disable=no-member
+    assert 2 == store.load.call_count
+
+
+def test_policy_store_refresh(policy_dir):
+    store = PolicyStore(str(policy_dir), SETTINGS)
+    assert frozenset(('a.example.org', 'b.example.org')) == store.hosts()
+
+    assert store.get('c.example.org') is None
+    policy_dir.join('c.example.org.json').write('{}')
+    assert store.get('c.example.org') is None
+
+    store.refresh()
+    assert store.get('c.example.org') is not None
+
+    assert frozenset() == PolicyStore(
+        str(policy_dir.join('missing')), SETTINGS).hosts()
+
+
+def test_policy_store_cache_by_normalized_host(mocker, policy_dir):
+    store = PolicyStore(str(policy_dir), SETTINGS, cache_size=2)
+    mocker.spy(store, 'load')
+
+    a = store.get('a.example.org')
+    for host in ('A.Example.org', 'a.example.org:443', 'a.example.org.',
+                 'a.example.org:8080'):
+        assert a is store.get(host)
+    # invalid hosts are not cached
+    for i in range(10):
+        assert store.get('[::{:d}]'.format(i)) is None
+    assert (4, 1, 2, 1) == store.info()
+    # pylint: disable=no-member
+    assert 1 == store.load.call_count
+
+
+def test_policy_store_interns_sources(policy_dir):
+    from pyramid_secure_response.policy_store import _intern_items
+
+    policy_dir.join('c.example.org.json').write(json.dumps({
+        'hsts_support': {'preload': False},
+    }))
+    store = PolicyStore(str(policy_dir), SETTINGS)
+    assert store.get('a.example.org').hsts_header is \
+        store.get('c.example.org').hsts_header
+
+    a = _intern_items({'script_src': 'self ' + 'https://cdn.example.org'})
+    b = _intern_items({'script_src': ('self', 'https://cdn.' + 'example.org')})
+    assert a == b
+    assert a[0][1][1] is b[0][1][1]
+
+
+def test_compile_config_with_policy_store(mocker, policy_dir):
+    from pyramid_secure_response import csp_hashes
+    from pyramid_secure_response.util import compile_config
+    mocker.patch.object(csp_hashes, 'scan', return_value=((), ()))
+
+    assert compile_config(SETTINGS).policy_store is None
+
+    config = compile_config(dict(SETTINGS, **{
+        'pyramid_secure_response.policy_store.path': str(policy_dir),
+        'pyramid_secure_response.policy_store.cache_size': '10',
+        'pyramid_secure_response.csp_hashes.enabled': 'True',
+    }))
+    store = config.policy_store
+    assert isinstance(store, PolicyStore)
+    assert 10 == store.info().maxsize
+
+    assert store.get('a.example.org') is not None
+    # pylint: disable=no-member
+    assert 1 == csp_hashes.scan.call_count
+
+
+class DictPolicyStore(PolicyStore):
+    def load(self, host):
+        return {'a.example.org': {'hsts_support': {'max_age': '60'}}}.get(host)
+
+
+def test_compile_config_with_policy_store_factory():
+    from pyramid_secure_response.util import compile_config
+
+    config = compile_config(dict(SETTINGS, **{
+        'pyramid_secure_response.policy_store.factory':
+            'test.unit.policy_store_test.DictPolicyStore',
+    }))
+    store = config.policy_store
+    assert isinstance(store, DictPolicyStore)
+    assert 'max-age=60; includeSubDomains; preload' == \
+        store.get('a.example.org').hsts_header
+    assert store.get('b.example.org') is None
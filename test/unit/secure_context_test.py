@@ -0,0 +1,123 @@
+import pytest
+
+from pyramid_secure_response.secure_context import (
+    SecureContext,
+    get_secure_context,
+)
+
+
+def build_request(url, headers=None):
+    from pyramid.request import Request
+    return Request.blank(url, headers=headers or {})
+
+
+def test_secure_context_values():
+    req = build_request('https://example.org/humans.txt', headers={
+        'X-Forwarded-Proto': 'https',
+    })
+    ctx = SecureContext(req, 'HTTP_X_FORWARDED_PROTO', ('/humans.txt',))
+
+    assert 'https' == ctx.scheme
+    assert 'https' == ctx.forwarded_proto
+    assert 'example.org:443' == ctx.host
+    assert '/humans.txt' == ctx.path
+    assert ctx.secure
+    assert ctx.ignored
+
+
+@pytest.mark.parametrize('url,proto_key,value,secure', [
+    ('http://example.org/', '', None, False),
+    ('https://example.org/', '', None, True),
+    ('https://example.org/', 'HTTP_X_FORWARDED_PROTO', None, False),
+    ('https://example.org/', 'HTTP_X_FORWARDED_PROTO', 'http', False),
+    ('https://example.org/', 'HTTP_X_FORWARDED_PROTO', 'https', True),
+])
+def test_secure_context_is_secure(url, proto_key, value, secure):
+    headers = {}
+    if value:
+        headers['X-Forwarded-Proto'] = value
+    ctx = SecureContext(build_request(url, headers=headers))
+
+    assert secure is ctx.is_secure(proto_key)
+    assert (url.startswith('https://')) is ctx.secure
+
+
+def test_secure_context_caches_decisions(mocker):
+    from pyramid_secure_response import secure_context
+    from pyramid_secure_response.util import PathFilter
+    mocker.spy(secure_context, 'match_path')
+    mocker.spy(secure_context, 'is_secure_environ')
+
+    paths = PathFilter(('/static/',))
+    ctx = SecureContext(build_request('https://example.org/static/a.css'),
+                        '', paths)
+
+    for _ in range(3):
+        assert ctx.ignored
+        assert ctx.is_ignored(paths)
+        assert not ctx.is_ignored(('/robots.txt',))
+        assert ctx.secure
+        assert not ctx.is_secure('HTTP_X_FORWARDED_PROTO')
+
+    # pylint: disable=no-member
+    assert 2 == secure_context.match_path.call_count
+    assert 2 == secure_context.is_secure_environ.call_count
+
+
+def test_get_secure_context_without_request_method(dummy_request):
+    ctx = get_secure_context(dummy_request)
+    assert isinstance(ctx, SecureContext)
+    assert ctx is get_secure_context(dummy_request)
+
+
+def test_secure_context_request_method():
+    from pyramid.config import Configurator
+    from pyramid.interfaces import IRequestExtensions
+    from pyramid.request import apply_request_extensions
+
+    config = Configurator(settings={
+        'pyramid_secure_response.proto_header': 'X-Forwarded-Proto',
+        'pyramid_secure_response.ignore_paths': '\n/_ah/health\n',
+    })
+    config.include('pyramid_secure_response')
+    config.commit()
+
+    req = build_request('https://example.org/_ah/health', headers={
+        'X-Forwarded-Proto': 'http',
+    })
+    req.registry = config.registry
+    apply_request_extensions(
+        req, config.registry.queryUtility(IRequestExtensions))
+
+    ctx = req.secure_context
+    assert ctx is req.secure_context
+    assert ctx is get_secure_context(req)
+    assert 'http' == ctx.forwarded_proto
+    assert not ctx.secure
+    assert ctx.ignored
+
+
+def test_secure_context_is_shared_by_tweens(mocker):
+    from pyramid.config import Configurator
+    from pyramid.response import Response
+    from pyramid_secure_response import secure_context
+    mocker.spy(secure_context, 'match_path')
+    mocker.spy(secure_context, 'is_secure_environ')
+
+    config = Configurator(settings={
+        'pyramid_secure_response.ignore_paths': '\n/_ah/health\n',
+        'pyramid_secure_response.csp_coverage.default_src': 'self',
+    })
+    config.include('pyramid_secure_response')
+    config.add_route('index', '/')
+    config.add_view(lambda _: Response('OK'), route_name='index')
+    app = config.make_wsgi_app()
+
+    res = build_request('https://example.org/').get_response(app)
+
+    assert 200 == res.status_code
+    assert res.headers['Strict-Transport-Security']
+    assert res.headers['Content-Security-Policy']
+    # pylint: disable=no-member
+    assert 1 == secure_context.match_path.call_count
+    assert 1 == secure_context.is_secure_environ.call_count
@@ -0,0 +1,361 @@
+import json
+
+import pytest
+
+from pyramid_secure_response.secure_response import tween
+
+
+@pytest.fixture(autouse=True)
+def setup():
+    import logging
+    from pyramid_secure_response.secure_response import logger
+    logger.setLevel(logging.ERROR)
+
+
+def test_build_plan_with_shared_values(dummy_request):
+    from pyramid_secure_response.secure_response import build_plan
+    from pyramid_secure_response.util import load_config
+
+    dummy_request.registry.settings = {
+        'pyramid_secure_response.proto_header': 'X-Forwarded-Proto',
+        'pyramid_secure_response.ignore_paths': '\n/humans.txt\n',
+        'pyramid_secure_response.hsts_support.max_age': '3600',
+        'pyramid_secure_response.csp_coverage.default_src': 'self',
+    }
+    config = load_config(dummy_request.registry)
+    plan = build_plan(config)
+
+    assert (('/humans.txt',), 'HTTP_X_FORWARDED_PROTO', 301) == \
+        plan.ssl_redirect
+    assert (('/humans.txt',), 'HTTP_X_FORWARDED_PROTO',
+            'max-age=3600; includeSubDomains; preload') == plan.hsts_support
+    assert (('/humans.txt',), None, "default-src 'self'") == \
+        plan.csp_coverage
+
+    # shares the global ignore paths
+    assert config.ignore_paths is plan.ssl_redirect.ignore_paths
+    assert config.ignore_paths is plan.hsts_support.ignore_paths
+    assert config.ignore_paths is plan.csp_coverage.ignore_paths
+
+
+def test_build_plan_with_separated_values(dummy_request):
+    from pyramid_secure_response.secure_response import build_plan
+    from pyramid_secure_response.util import load_config
+
+    dummy_request.registry.settings = {
+        'pyramid_secure_response.ignore_paths': '\n/humans.txt\n',
+        'pyramid_secure_response.ssl_redirect.enabled': 'False',
+        'pyramid_secure_response.hsts_support.proto_header':
+            'X-Forwarded-Proto',
+        'pyramid_secure_response.csp_coverage.ignore_paths':
+            '\n/robots.txt\n',
+    }
+    plan = build_plan(load_config(dummy_request.registry))
+
+    assert plan.ssl_redirect is None
+    assert (('/humans.txt',), 'HTTP_X_FORWARDED_PROTO') == \
+        plan.hsts_support[:2]
+    # empty policy
+    assert plan.csp_coverage is None
+
+
+def test_secure_response_tween_with_disabled(mocker, dummy_request):
+    dummy_request.registry.settings = {
+        'pyramid_secure_response.ssl_redirect.enabled': 'False',
+        'pyramid_secure_response.hsts_support.enabled': 'False',
+        'pyramid_secure_response.csp_coverage.enabled': 'False',
+    }
+
+    handler_stub = mocker.stub(name='handler_stub')
+    assert handler_stub is tween(handler_stub, dummy_request.registry)
+
+
+def test_secure_response_tween_with_ignored_path(mocker, dummy_request):
+    from pyramid_secure_response import secure_context
+    mocker.spy(secure_context, 'match_path')
+    mocker.spy(secure_context, 'is_secure_environ')
+
+    from pyramid.response import Response
+    from pyramid_secure_response.secure_response import logger
+    mocker.spy(logger, 'info')
+
+    dummy_request.path = '/humans.txt'
+    dummy_request.url = 'http://example.org/humans.txt'
+    dummy_request.registry.settings = {
+        'pyramid_secure_response.ignore_paths': '\n/humans.txt\n',
+        'pyramid_secure_response.csp_coverage.default_src': 'self',
+    }
+
+    handler_stub = mocker.stub(name='handler_stub')
+    handler_stub.return_value = Response(status=200)
+    secure_response_tween = tween(handler_stub, dummy_request.registry)
+    res = secure_response_tween(dummy_request)
+
+    # pylint: disable=no-member
+    assert 1 == handler_stub.call_count
+    assert 1 == secure_context.match_path.call_count
+    assert 0 == secure_context.is_secure_environ.call_count
+    assert 'Strict-Transport-Security' not in res.headers
+    assert 'Content-Security-Policy' not in res.headers
+    # logged per policy as same as the tweens
+    assert [
+        (('(%s) Ignore path %s', name, '/humans.txt'),)
+        for name in ('ssl_redirect', 'hsts_support', 'csp_coverage')
+    ] == [c[:1] for c in logger.info.call_args_list]
+
+
+def test_secure_response_tween_insecure(mocker, dummy_request):
+    dummy_request.path = '/foo'
+    dummy_request.url = 'http://example.org/foo'
+    dummy_request.registry.settings = {
+        'pyramid_secure_response.ssl_redirect.status_code': '308',
+    }
+
+    handler_stub = mocker.stub(name='handler_stub')
+    secure_response_tween = tween(handler_stub, dummy_request.registry)
+    res = secure_response_tween(dummy_request)
+
+    assert 308 == res.status_code
+    assert 'https://example.org:80/foo' == res.location
+    # pylint: disable=no-member
+    assert 0 == handler_stub.call_count
+
+
+def test_secure_response_tween_insecure_without_redirect(
+        mocker, dummy_request):
+    from pyramid.response import Response
+
+    dummy_request.url = 'http://example.org/'
+    dummy_request.registry.settings = {
+        'pyramid_secure_response.ssl_redirect.enabled': 'False',
+        'pyramid_secure_response.csp_coverage.default_src': 'self',
+    }
+
+    handler_stub = mocker.stub(name='handler_stub')
+    handler_stub.return_value = Response(status=200)
+    secure_response_tween = tween(handler_stub, dummy_request.registry)
+    res = secure_response_tween(dummy_request)
+
+    # pylint: disable=no-member
+    assert 1 == handler_stub.call_count
+    assert 'Strict-Transport-Security' not in res.headers
+    assert "default-src 'self'" == res.headers['Content-Security-Policy']
+
+
+def test_secure_response_tween_secure(mocker, dummy_request):
+    from pyramid_secure_response import secure_context
+    mocker.spy(secure_context, 'match_path')
+    mocker.spy(secure_context, 'is_secure_environ')
+
+    from pyramid.response import Response
+
+    dummy_request.url = 'https://example.org/'
+    dummy_request.environ['wsgi.url_scheme'] = 'https'
+    dummy_request.headers['X-Forwarded-Proto'] = 'https'
+    dummy_request.environ['HTTP_X_FORWARDED_PROTO'] = 'https'
+    dummy_request.registry.settings = {
+        'pyramid_secure_response.proto_header': 'X-Forwarded-Proto',
+        'pyramid_secure_response.ignore_paths': '\n/humans.txt\n',
+        'pyramid_secure_response.hsts_support.max_age': '300',
+        'pyramid_secure_response.csp_coverage.default_src': 'self',
+    }
+
+    handler_stub = mocker.stub(name='handler_stub')
+    handler_stub.return_value = Response(status=200)
+    secure_response_tween = tween(handler_stub, dummy_request.registry)
+    res = secure_response_tween(dummy_request)
+
+    # pylint: disable=no-member
+    assert 1 == handler_stub.call_count
+    assert 1 == secure_context.match_path.call_count
+    assert 1 == secure_context.is_secure_environ.call_count
+    assert 'max-age=300; includeSubDomains; preload' == \
+        res.headers['Strict-Transport-Security']
+    assert "default-src 'self'" == res.headers['Content-Security-Policy']
+
+
+def test_secure_response_tween_does_not_override_headers(
+        mocker, dummy_request):
+    from pyramid.response import Response
+
+    dummy_request.url = 'https://example.org/'
+    dummy_request.environ['wsgi.url_scheme'] = 'https'
+    dummy_request.registry.settings = {
+        'pyramid_secure_response.csp_coverage.default_src': 'self',
+    }
+
+    handler_stub = mocker.stub(name='handler_stub')
+    handler_stub.return_value = Response(status=200, headers={
+        'Strict-Transport-Security': 'max-age=0',
+        'Content-Security-Policy': "default-src 'none'",
+    })
+    secure_response_tween = tween(handler_stub, dummy_request.registry)
+    res = secure_response_tween(dummy_request)
+
+    assert 'max-age=0' == res.headers['Strict-Transport-Security']
+    assert "default-src 'none'" == res.headers['Content-Security-Policy']
+
+
+@pytest.mark.parametrize('fused,expected', [
+    ('False', [
+        'pyramid_secure_response.ssl_redirect.tween',
+        'pyramid_secure_response.hsts_support.tween',
+        'pyramid_secure_response.csp_coverage.tween',
+        'pyramid_secure_response.security_headers.tween',
+    ]),
+    ('True', [
+        'pyramid_secure_response.secure_response.tween',
+    ]),
+])
+def test_includeme(fused, expected):
+    from pyramid.config import Configurator
+    from pyramid.interfaces import ITweens
+
+    config = Configurator(settings={
+        'pyramid_secure_response.fused': fused,
+    })
+    config.include('pyramid_secure_response')
+    config.commit()
+
+    names = [name for name, _ in
+             config.registry.queryUtility(ITweens).implicit()]
+    assert sorted(expected) == sorted(
+        name for name in names if name.startswith('pyramid_secure_response'))
+
+
+def test_secure_response_tween_with_nonce(mocker, dummy_request):
+    from pyramid.response import Response
+    from pyramid_secure_response.csp_nonce import get_csp_nonce
+
+    dummy_request.registry.settings = {
+        'pyramid_secure_response.ssl_redirect.enabled': 'False',
+        'pyramid_secure_response.csp_coverage.script_src': 'nonce',
+    }
+
+    handler_stub = mocker.stub(name='handler_stub')
+    handler_stub.side_effect = lambda req: get_csp_nonce(req) and Response()
+    secure_response_tween = tween(handler_stub, dummy_request.registry)
+    res = secure_response_tween(dummy_request)
+
+    assert "script-src 'nonce-{:s}'".format(dummy_request.csp_nonce) == \
+        res.headers['Content-Security-Policy']
+
+
+def test_secure_response_tween_in_report_only_mode(mocker, dummy_request):
+    from pyramid.response import Response
+
+    dummy_request.registry.settings = {
+        'pyramid_secure_response.ssl_redirect.enabled': 'False',
+        'pyramid_secure_response.csp_coverage.default_src': 'self',
+        'pyramid_secure_response.csp_report_only.mode': 'report_only',
+    }
+
+    handler_stub = mocker.stub(name='handler_stub')
+    handler_stub.return_value = Response()
+    secure_response_tween = tween(handler_stub, dummy_request.registry)
+    res = secure_response_tween(dummy_request)
+
+    assert 'Content-Security-Policy' not in res.headers
+    assert "default-src 'self'" == \
+        res.headers['Content-Security-Policy-Report-Only']
+
+
+def test_secure_response_tween_with_security_headers(mocker, dummy_request):
+    from pyramid.response import Response
+
+    dummy_request.registry.settings = {
+        'pyramid_secure_response.ssl_redirect.enabled': 'False',
+        'pyramid_secure_response.security_headers.x_content_type_options':
+            'nosniff',
+        'pyramid_secure_response.security_headers.'
+        'cross_origin_embedder_policy': 'require-corp',
+    }
+
+    handler_stub = mocker.stub(name='handler_stub')
+    handler_stub.return_value = Response(headerlist=[
+        ('cross-origin-embedder-policy', 'credentialless')])
+    secure_response_tween = tween(handler_stub, dummy_request.registry)
+    res = secure_response_tween(dummy_request)
+
+    assert 'nosniff' == res.headers['X-Content-Type-Options']
+    assert ['credentialless'] == \
+        res.headers.getall('Cross-Origin-Embedder-Policy')
+
+
+def test_secure_response_tween_with_host_policies(mocker, dummy_request):
+    from pyramid.response import Response
+
+    dummy_request.environ['wsgi.url_scheme'] = 'https'
+    dummy_request.registry.settings = {
+        'pyramid_secure_response.hsts_support.max_age': '300',
+        'pyramid_secure_response.csp_coverage.default_src': 'self',
+        'pyramid_secure_response.host_policy.a.hosts': 'example.com',
+        'pyramid_secure_response.host_policy.a.hsts_support.enabled': 'False',
+        'pyramid_secure_response.host_policy.a.csp_coverage.default_src':
+            'none',
+    }
+
+    handler_stub = mocker.stub(name='handler_stub')
+    handler_stub.side_effect = lambda req: Response(status=200)
+    secure_response_tween = tween(handler_stub, dummy_request.registry)
+
+    res = secure_response_tween(dummy_request)
+    assert 'max-age=300; includeSubDomains; preload' == \
+        res.headers['Strict-Transport-Security']
+    assert "default-src 'self'" == res.headers['Content-Security-Policy']
+
+    dummy_request.host = 'example.com:443'
+    del dummy_request.secure_context
+    res = secure_response_tween(dummy_request)
+    assert 'Strict-Transport-Security' not in res.headers
+    assert "default-src 'none'" == res.headers['Content-Security-Policy']
+
+
+def test_secure_response_tween_with_policy_store(
+        mocker, dummy_request, tmpdir):
+    from pyramid.response import Response
+
+    tmpdir.join('example.org.json').write(json.dumps({
+        'hsts_support': {'enabled': False},
+        'csp_coverage': {'default_src': 'none'},
+    }))
+    dummy_request.environ['wsgi.url_scheme'] = 'https'
+    dummy_request.registry.settings = {
+        'pyramid_secure_response.csp_coverage.default_src': 'self',
+        'pyramid_secure_response.policy_store.path': str(tmpdir),
+    }
+
+    handler_stub = mocker.stub(name='handler_stub')
+    handler_stub.return_value = Response(status=200)
+    res = tween(handler_stub, dummy_request.registry)(dummy_request)
+
+    assert 'Strict-Transport-Security' not in res.headers
+    assert "default-src 'none'" == res.headers['Content-Security-Policy']
+
+
+@pytest.mark.parametrize('content_type,expected', [
+    ('text/html', ('max-age=300; includeSubDomains; preload',
+                   "default-src 'self'")),
+    ('application/json', (None, "default-src 'none'")),
+    ('text/css', (None, None)),
+])
+def test_secure_response_tween_with_content_types(
+        dummy_request, content_type, expected):
+    from pyramid.response import Response
+
+    dummy_request.environ['wsgi.url_scheme'] = 'https'
+    dummy_request.registry.settings = {
+        'pyramid_secure_response.hsts_support.max_age': '300',
+        'pyramid_secure_response.hsts_support.content_types': 'text/html',
+        'pyramid_secure_response.csp_coverage.default_src': 'self',
+        'pyramid_secure_response.csp_coverage.content_types': 'text/html',
+        'pyramid_secure_response.csp_coverage.minimal_content_types':
+            'application/*',
+        'pyramid_secure_response.csp_coverage.minimal_policy':
+            "default-src 'none'",
+    }
+
+    res = tween(lambda req: Response(content_type=content_type),
+                dummy_request.registry)(dummy_request)
+    assert expected == (res.headers.get('Strict-Transport-Security'),
+                        res.headers.get('Content-Security-Policy'))
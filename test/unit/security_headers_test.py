@@ -0,0 +1,113 @@
+import pytest
+
+from pyramid_secure_response.security_headers import tween
+
+
+@pytest.fixture(autouse=True)
+def setup():
+    import logging
+    from pyramid_secure_response.security_headers import logger
+    logger.setLevel(logging.ERROR)
+
+
+SETTINGS = {
+    'pyramid_secure_response.security_headers.x_content_type_options':
+        'nosniff',
+    'pyramid_secure_response.security_headers.referrer_policy':
+        'strict-origin-when-cross-origin',
+    'pyramid_secure_response.security_headers.reporting_endpoints':
+        '\ncsp="/csp-report"\ndefault="/reports"\n',
+}
+
+
+def test_build_security_headers():
+    from pyramid_secure_response.security_headers import (
+        build_security_headers,
+    )
+    from pyramid_secure_response.util import parse_config
+
+    assert (
+        ('X-Content-Type-Options', 'nosniff'),
+        ('Referrer-Policy', 'strict-origin-when-cross-origin'),
+        ('Reporting-Endpoints', 'csp="/csp-report", default="/reports"'),
+    ) == build_security_headers(parse_config(SETTINGS).security_headers)
+
+    assert () == build_security_headers(parse_config({}).security_headers)
+
+
+@pytest.mark.parametrize('value', [
+    'no-referrer\rSet-Cookie: a=b',
+    u'あ',
+])
+def test_compile_config_with_invalid_header(value):
+    from pyramid_secure_response.util import compile_config
+
+    with pytest.raises(ValueError):
+        compile_config({
+            'pyramid_secure_response.security_headers.referrer_policy': value,
+        })
+
+
+@pytest.mark.parametrize('headerlist,expected', [
+    ([], [('A', '1'), ('B', '2')]),
+    ([('Content-Type', 'text/html')],
+     [('Content-Type', 'text/html'), ('A', '1'), ('B', '2')]),
+    ([('a', '0')], [('a', '0'), ('B', '2')]),
+    ([('B', '0'), ('A', '0')], [('B', '0'), ('A', '0')]),
+])
+def test_build_append_headers_f(headerlist, expected):
+    from pyramid_secure_response.security_headers import (
+        build_append_headers_f,
+    )
+
+    append_headers = build_append_headers_f((('A', '1'), ('B', '2')))
+    for _ in range(2):  # cached
+        actual = list(headerlist)
+        append_headers(actual)
+        assert expected == actual
+
+
+def test_security_headers_tween(mocker, dummy_request):
+    from pyramid.response import Response
+
+    dummy_request.registry.settings = SETTINGS
+
+    handler_stub = mocker.stub(name='handler_stub')
+    handler_stub.return_value = Response(
+        status=200, headerlist=[('Referrer-Policy', 'no-referrer')])
+    res = tween(handler_stub, dummy_request.registry)(dummy_request)
+
+    assert 'nosniff' == res.headers['X-Content-Type-Options']
+    assert ['no-referrer'] == res.headers.getall('Referrer-Policy')
+    assert 'csp="/csp-report", default="/reports"' == \
+        res.headers['Reporting-Endpoints']
+
+
+def test_security_headers_tween_with_ignored_path(mocker, dummy_request):
+    from pyramid.response import Response
+
+    dummy_request.registry.settings = dict(SETTINGS, **{
+        'pyramid_secure_response.security_headers.ignore_paths':
+            '\n/static/\n',
+    })
+    dummy_request.path = '/static/a.js'
+
+    handler_stub = mocker.stub(name='handler_stub')
+    handler_stub.return_value = Response(status=200)
+    res = tween(handler_stub, dummy_request.registry)(dummy_request)
+
+    assert 'X-Content-Type-Options' not in res.headers
+
+
+@pytest.mark.parametrize('settings', [
+    {},
+    dict(SETTINGS, **{
+        'pyramid_secure_response.security_headers.enabled': 'False'}),
+])
+def test_security_headers_tween_returns_handler(dummy_request, settings):
+    dummy_request.registry.settings = settings
+
+    def handler(req):  # pylint: disable=unused-argument
+        return None
+
+    assert handler is tween(handler, dummy_request.registry)
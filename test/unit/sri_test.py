@@ -0,0 +1,128 @@
+from base64 import b64encode
+import hashlib
+import os
+
+import pytest
+
+from pyramid_secure_response.sri import (
+    SRIService,
+    hash_file,
+    resolve_path,
+)
+
+
+def expected_integrity(data, algorithm='sha384'):  # type: (bytes, str) -> str
+    return '{:s}-{:s}'.format(algorithm, b64encode(
+        hashlib.new(algorithm, data).digest()).decode('ascii'))
+
+
+@pytest.mark.parametrize('data', [b'', b'alert(1);', b'x' * (1 << 20)])
+def test_hash_file(tmpdir, data):
+    path = tmpdir.join('app.js')
+    path.write_binary(data)
+
+    assert expected_integrity(data) == hash_file(str(path))
+    assert ' '.join([
+        expected_integrity(data, 'sha384'),
+        expected_integrity(data, 'sha512'),
+    ]) == hash_file(str(path), ('sha384', 'sha512'))
+
+
+def test_resolve_path(tmpdir):
+    import pyramid_secure_response
+
+    assert str(tmpdir) == resolve_path(str(tmpdir))
+    assert os.path.join(
+        os.path.dirname(pyramid_secure_response.__file__), 'sri.py') == \
+        resolve_path('pyramid_secure_response:sri.py')
+
+
+def test_sri_service_caches_digest(mocker, tmpdir):
+    from pyramid_secure_response import sri
+    mocker.spy(sri, 'hash_file')
+
+    path = tmpdir.join('app.js')
+    path.write_binary(b'alert(1);')
+    service = SRIService()
+
+    for _ in range(3):
+        assert expected_integrity(b'alert(1);') == \
+            service.integrity(str(path))
+    # pylint: disable=no-member
+    assert 1 == sri.hash_file.call_count
+
+    # changed (size and mtime)
+    path.write_binary(b'alert(2); // changed')
+    os.utime(str(path), (1, 1))
+    assert expected_integrity(b'alert(2); // changed') == \
+        service.integrity(str(path))
+    assert 2 == sri.hash_file.call_count
+
+
+def test_sri_service_prewarm(mocker, tmpdir):
+    from pyramid_secure_response import sri
+    mocker.spy(sri, 'hash_file')
+
+    for i in range(5):
+        tmpdir.join('static', 'js', '{:d}.js'.format(i)).write_binary(
+            b'alert(1);', ensure=True)
+
+    service = SRIService(cache_size=4)
+    assert 4 == service.prewarm((str(tmpdir.join('static')),), workers=2)
+    # pylint: disable=no-member
+    assert 4 == sri.hash_file.call_count
+
+
+def test_sri_request_method(tmpdir):
+    from pyramid.config import Configurator
+    from pyramid.interfaces import IRequestExtensions
+    from pyramid.request import Request, apply_request_extensions
+
+    tmpdir.join('static', 'app.js').write_binary(b'alert(1);', ensure=True)
+
+    config = Configurator(settings={
+        'pyramid_secure_response.sri.algorithms': 'sha256 sha384',
+        'pyramid_secure_response.sri.prewarm': '\n{:s}\n'.format(
+            str(tmpdir.join('static'))),
+    })
+    config.include('pyramid_secure_response')
+    app = config.make_wsgi_app()
+
+    req = Request.blank('/')
+    req.registry = app.registry
+    apply_request_extensions(
+        req, app.registry.queryUtility(IRequestExtensions))
+
+    from pyramid_secure_response.sri import get_sri_service
+    # pylint: disable=protected-access
+    assert 1 == len(get_sri_service(app.registry)._cache)  # prewarmed
+
+    assert ' '.join([
+        expected_integrity(b'alert(1);', 'sha256'),
+        expected_integrity(b'alert(1);', 'sha384'),
+    ]) == req.sri(str(tmpdir.join('static', 'app.js')))
+
+
+def test_static_sri_request_method(tmpdir):
+    from pyramid.config import Configurator
+    from pyramid.interfaces import IRequestExtensions
+    from pyramid.request import Request, apply_request_extensions
+    from pyramid_secure_response.sri import StaticAsset
+
+    tmpdir.join('static', 'app.js').write_binary(b'alert(1);', ensure=True)
+    spec = str(tmpdir.join('static', 'app.js'))
+
+    config = Configurator(settings={})
+    config.include('pyramid_secure_response')
+    config.add_static_view('static', str(tmpdir.join('static')))
+    app = config.make_wsgi_app()
+
+    req = Request.blank('/')
+    req.registry = app.registry
+    apply_request_extensions(
+        req, app.registry.queryUtility(IRequestExtensions))
+
+    assert StaticAsset(
+        'http://localhost/static/app.js?v=1',
+        expected_integrity(b'alert(1);'),
+    ) == req.static_sri(spec, _query={'v': '1'})
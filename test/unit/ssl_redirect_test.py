@@ -11,14 +11,14 @@ def setup():
 
 
 def test_redirect_tween_ssl_redirect_off(mocker, dummy_request):
-    mocker.patch('pyramid_secure_response.ssl_redirect.apply_path_filter',
+    mocker.patch('pyramid_secure_response.secure_context.match_path',
                  return_value=True)
-    mocker.patch('pyramid_secure_response.ssl_redirect.build_criteria',
-                 return_value=[])
+    mocker.patch('pyramid_secure_response.secure_context.is_secure_environ',
+                 return_value=False)
 
-    from pyramid_secure_response.ssl_redirect import (
-        apply_path_filter,
-        build_criteria,
+    from pyramid_secure_response.secure_context import (
+        match_path,
+        is_secure_environ,
     )
 
     dummy_request.registry.settings = {
@@ -31,19 +31,19 @@ def test_redirect_tween_ssl_redirect_off(mocker, dummy_request):
 
     # pylint: disable=no-member
     assert 1 == handler_stub.call_count
-    assert 0 == apply_path_filter.call_count
-    assert 0 == build_criteria.call_count
+    assert 0 == match_path.call_count
+    assert 0 == is_secure_environ.call_count
 
 
 def test_redirect_tween_ignored_path(mocker, dummy_request):
-    mocker.patch('pyramid_secure_response.ssl_redirect.apply_path_filter',
+    mocker.patch('pyramid_secure_response.secure_context.match_path',
                  return_value=True)
-    mocker.patch('pyramid_secure_response.ssl_redirect.build_criteria',
-                 return_value=[])
+    mocker.patch('pyramid_secure_response.secure_context.is_secure_environ',
+                 return_value=False)
 
-    from pyramid_secure_response.ssl_redirect import (
-        apply_path_filter,
-        build_criteria,
+    from pyramid_secure_response.secure_context import (
+        match_path,
+        is_secure_environ,
     )
 
     dummy_request.path = '/humans.txt'
@@ -58,23 +58,21 @@ def test_redirect_tween_ignored_path(mocker, dummy_request):
 
     # pylint: disable=no-member
     assert 1 == handler_stub.call_count
-    assert 1 == apply_path_filter.call_count
-    apply_path_filter.assert_called_once_with(
-        dummy_request, ('/humans.txt',))
-    assert 0 == build_criteria.call_count
+    assert 1 == match_path.call_count
+    match_path.assert_called_once_with(
+        dummy_request.path, ('/humans.txt',))
+    assert 0 == is_secure_environ.call_count
 
 
 def test_redirect_tween_insecure(mocker, dummy_request):
-    mocker.patch('pyramid_secure_response.ssl_redirect.apply_path_filter',
+    mocker.patch('pyramid_secure_response.secure_context.match_path',
+                 return_value=False)
+    mocker.patch('pyramid_secure_response.secure_context.is_secure_environ',
                  return_value=False)
-    mocker.patch('pyramid_secure_response.ssl_redirect.build_criteria',
-                 return_value=[False])
-
-    from pyramid.httpexceptions import HTTPMovedPermanently
 
-    from pyramid_secure_response.ssl_redirect import (
-        apply_path_filter,
-        build_criteria,
+    from pyramid_secure_response.secure_context import (
+        match_path,
+        is_secure_environ,
     )
 
     dummy_request.url = 'http://example.org/'
@@ -85,25 +83,28 @@ def test_redirect_tween_insecure(mocker, dummy_request):
     handler_stub = mocker.stub(name='handler_stub')
     ssl_redirect_tween = tween(handler_stub, dummy_request.registry)
 
-    with pytest.raises(HTTPMovedPermanently):
-        ssl_redirect_tween(dummy_request)
+    res = ssl_redirect_tween(dummy_request)
+
+    assert 301 == res.status_code
+    assert 'https://example.org:80/' == res.location
 
     # pylint: disable=no-member
     assert 0 == handler_stub.call_count
-    assert 1 == apply_path_filter.call_count
-    apply_path_filter.assert_called_once_with(dummy_request, tuple())
-    assert 1 == build_criteria.call_count
+    assert 1 == match_path.call_count
+    match_path.assert_called_once_with(
+        dummy_request.path, tuple())
+    assert 1 == is_secure_environ.call_count
 
 
 def test_redirect_tween_secure(mocker, dummy_request):
-    mocker.patch('pyramid_secure_response.ssl_redirect.apply_path_filter',
+    mocker.patch('pyramid_secure_response.secure_context.match_path',
                  return_value=False)
-    mocker.patch('pyramid_secure_response.ssl_redirect.build_criteria',
-                 return_value=[True])
+    mocker.patch('pyramid_secure_response.secure_context.is_secure_environ',
+                 return_value=True)
 
-    from pyramid_secure_response.ssl_redirect import (
-        apply_path_filter,
-        build_criteria,
+    from pyramid_secure_response.secure_context import (
+        match_path,
+        is_secure_environ,
     )
 
     dummy_request.url = 'https://example.org/'
@@ -117,6 +118,73 @@ def test_redirect_tween_secure(mocker, dummy_request):
 
     # pylint: disable=no-member
     assert 1 == handler_stub.call_count
-    assert 1 == apply_path_filter.call_count
-    apply_path_filter.assert_called_once_with(dummy_request, tuple())
-    assert 1 == build_criteria.call_count
+    assert 1 == match_path.call_count
+    match_path.assert_called_once_with(
+        dummy_request.path, tuple())
+    assert 1 == is_secure_environ.call_count
+
+
+@pytest.mark.parametrize('status_code,status', [
+    (301, '301 Moved Permanently'),
+    ('302', '302 Found'),
+    ('307', '307 Temporary Redirect'),
+    (308, '308 Permanent Redirect'),
+])
+def test_build_redirect_f(status_code, status):
+    from pyramid_secure_response.ssl_redirect import build_redirect_f
+
+    redirect = build_redirect_f(status_code)
+    res = redirect('example.org', '/foo')
+
+    assert status == res.status
+    assert 'https://example.org/foo' == res.headers['Location']
+    assert '0' == res.headers['Content-Length']
+    assert b'' == res.body
+
+
+@pytest.mark.parametrize('status_code', [
+    200, '303', 'moved',
+])
+def test_build_redirect_f_with_invalid_status_code(status_code):
+    from pyramid_secure_response.ssl_redirect import build_redirect_f
+
+    with pytest.raises(ValueError):
+        build_redirect_f(status_code)
+
+
+def test_build_redirect_f_caches_headers():
+    from pyramid_secure_response.ssl_redirect import build_redirect_f
+
+    redirect = build_redirect_f(cache_size=1)
+
+    res1 = redirect('example.org', '/foo')
+    res1.headers['X-Foo'] = 'foo'
+    res2 = redirect('example.org', '/foo')
+
+    # each response has own headerlist
+    assert res1.headerlist is not res2.headerlist
+    assert 'X-Foo' not in res2.headers
+
+    res3 = redirect('example.org', '/bar')
+    assert 'https://example.org/bar' == res3.location
+    assert 'https://example.org/foo' == redirect(
+        'example.org', '/foo').location
+
+
+def test_redirect_tween_returns_response_through_router():
+    from pyramid.config import Configurator
+    from pyramid.request import Request
+
+    config = Configurator(settings={
+        'pyramid_secure_response.ssl_redirect.status_code': '308',
+    })
+    config.include('pyramid_secure_response')
+    app = config.make_wsgi_app()
+
+    res = Request.blank('http://example.org/foo?q=1', headers={
+        'Host': 'example.org',
+    }).get_response(app)
+
+    assert 308 == res.status_code
+    assert 'https://example.org/foo' == res.location
+    assert 'Strict-Transport-Security' not in res.headers
@@ -4,6 +4,8 @@ from pyramid_secure_response.util import (
     get_config,
     apply_path_filter,
     build_criteria,
+    LRUCache,
+    PathFilter,
 )
 
 
@@ -16,6 +18,15 @@ def test_get_config_keys(dummy_request):
         'ssl_redirect',
         'hsts_support',
         'csp_coverage',
+        # csp_coverage extension
+        'csp_report_only',
+        'csp_hashes',
+        'csp_report',
+        'security_headers',
+        # helpers
+        'sri',
+        'policy_store',
+        'policy_reload',
     )
     assert expected_keys == tuple(config._asdict().keys())
 
@@ -26,9 +37,20 @@ def test_get_config_keys(dummy_request):
     ('ssl_redirect.enabled', True),
     ('ssl_redirect.proto_header', ''),
     ('ssl_redirect.ignore_paths', tuple()),
+    ('ssl_redirect.status_code', '301'),
     ('hsts_support.enabled', True),
     ('hsts_support.proto_header', ''),
     ('hsts_support.ignore_paths', tuple()),
+    ('csp_report_only.mode', 'enforce'),
+    ('csp_report_only.sample_rate', '1'),
+    ('csp_hashes.enabled', False),
+    ('csp_hashes.dirs', tuple()),
+    ('csp_hashes.manifest', ''),
+    ('policy_store.path', ''),
+    ('policy_store.cache_size', '10000'),
+    ('policy_store.factory', ''),
+    ('policy_reload.path', ''),
+    ('policy_reload.interval', '2'),
 ])
 def test_get_config_defaults(dummy_request, config_key, default_value):
     config = get_config(dummy_request.registry)
@@ -59,6 +81,126 @@ def test_apply_path_filter_as_ignored(dummy_request, paths):
     assert apply_path_filter(dummy_request, paths)
 
 
+def test_get_config_ignore_paths_as_path_filter(dummy_request):
+    dummy_request.registry.settings = {
+        'pyramid_secure_response.ignore_paths': '/humans.txt',
+        'pyramid_secure_response.ssl_redirect.ignore_paths':
+            '\n/humans.txt\n/robots.txt\n',
+    }
+    config = get_config(dummy_request.registry)
+
+    assert isinstance(config.ignore_paths, PathFilter)
+    assert ('/humans.txt',) == config.ignore_paths
+    assert ('/humans.txt', '/robots.txt') == config.ssl_redirect.ignore_paths
+    assert tuple() == config.hsts_support.ignore_paths
+
+
+@pytest.mark.parametrize('paths', [
+    tuple(),
+    ('/foo', '/bar'),
+    ('humans.txt', 'robots.txt'),
+    ('/static/humans.txt',),
+    ('/humans.txt',),
+    ('/humans.txt', '/robots.txt'),
+    ('/',),
+    ('',),
+    ('/static/', '/static/img', '/_ah/health', '/api/v1/'),
+])
+@pytest.mark.parametrize('path', [
+    '/',
+    '/humans.txt',
+    '/humans.txt.bak',
+    '/static',
+    '/static/',
+    '/staticfiles/a.css',
+    '/static/img',
+    '/static/images/a.png',
+    '/_ah/health',
+    '/_ah/healthz',
+    '/api/v1',
+    '/api/v1/users',
+])
+def test_path_filter_matches_as_startswith(paths, path):
+    expected = any(path.startswith(p) for p in paths)
+    assert expected == PathFilter(paths).match(path)
+    assert expected == PathFilter(paths, cache_size=0).match(path)
+
+
+@pytest.mark.parametrize('paths,path,expected', [
+    (('glob:/*/hook/*.json',), '/t1/hook/a.json', True),
+    (('glob:/*/hook/*.json',), '/t1/hook/a.json/x', False),
+    (('glob:/static/*.png',), '/static/a.css', False),
+    (('re:/tenant/\\d+/webhook',), '/tenant/42/webhook/x', True),
+    (('re:/tenant/\\d+/webhook',), '/tenant/a/webhook', False),
+    (('/health', 're:/tenant/\\d+/'), '/health', True),
+    (('/health', 're:/tenant/\\d+/'), '/tenant/1/', True),
+    (('/health', 're:/tenant/\\d+/'), '/about', False),
+])
+def test_path_filter_with_patterns(paths, path, expected):
+    assert expected == PathFilter(paths).match(path)
+
+
+def test_path_filter_cache_is_bounded():
+    path_filter = PathFilter(('/static/',), cache_size=2)
+    for path in ('/a', '/static/b', '/c'):
+        path_filter.match(path)
+
+    # pylint: disable=protected-access
+    assert 2 == len(path_filter._cache)
+    assert '/a' not in path_filter._cache
+    assert path_filter._cache.get('/static/b')
+    assert path_filter._cache.get('/c') is False
+
+
+def test_lru_cache():
+    with pytest.raises(ValueError):
+        LRUCache(maxsize=0)
+
+    cache = LRUCache(maxsize=2)
+    cache['a'] = 1
+    cache['b'] = 2
+    assert 1 == cache.get('a')  # 'b' is least recently used
+
+    cache['c'] = 3
+    assert 2 == len(cache)
+    assert 'b' not in cache
+    assert cache.get('b') is None
+    assert 1 == cache.get('a')
+    assert 3 == cache.get('c')
+
+    cache.clear()
+    assert 0 == len(cache)
+
+
+def test_compile_path_filter():
+    from pyramid_secure_response.util import compile_path_filter
+
+    path_filter = compile_path_filter(('/humans.txt', '/robots.txt'))
+    assert isinstance(path_filter, PathFilter)
+    assert path_filter is compile_path_filter(['/humans.txt', '/robots.txt'])
+    assert path_filter is not compile_path_filter(('/humans.txt',))
+    assert ('/humans.txt',) == compile_path_filter('/humans.txt')
+
+
+def test_compile_path_filter_cache(mocker):
+    from pyramid_secure_response import util
+
+    mocker.patch.object(util, '_path_filters', LRUCache(maxsize=2))
+    path_filter = util.compile_path_filter('/a')
+    for i in range(10):
+        util.compile_path_filter('/{:d}'.format(i))
+    # bounded
+    assert 2 == len(util._path_filters)  # pylint: disable=protected-access
+    assert path_filter is not util.compile_path_filter('/a')
+
+
+def test_apply_path_filter_with_path_filter(dummy_request):
+    dummy_request.path = '/humans.txt'
+    assert apply_path_filter(dummy_request, PathFilter(('/humans',)))
+    assert not apply_path_filter(dummy_request, PathFilter(('/robots',)))
+    assert not apply_path_filter(dummy_request, PathFilter())
+
+
 @pytest.mark.parametrize('url,proto_header,header,value', [
     ('http://127.0.0.1/', '', None, None),
     ('http://127.0.0.1/', '', 'X-Forwarded-Proto', 'http'),
@@ -100,3 +242,367 @@ def test_criteria_all_secure(dummy_request, url, proto_header,
 
     criteria = build_criteria(dummy_request, proto_header=config.proto_header)
     assert all(criteria)
+
+
+@pytest.mark.parametrize('proto_header,key', [
+    ('', ''),
+    ('X-Forwarded-Proto', 'HTTP_X_FORWARDED_PROTO'),
+    ('x-forwarded-proto', 'HTTP_X_FORWARDED_PROTO'),
+    ('X-Scheme', 'HTTP_X_SCHEME'),
+])
+def test_get_proto_environ_key(proto_header, key):
+    from pyramid_secure_response.util import get_proto_environ_key
+    assert key == get_proto_environ_key(proto_header)
+
+
+@pytest.mark.parametrize('scheme,proto_header,value,secure', [
+    ('http', '', None, False),
+    ('http', '', 'http', False),
+    ('http', 'X-Forwarded-Proto', None, False),
+    ('http', 'X-Forwarded-Proto', 'http', False),
+    ('http', 'X-Forwarded-Proto', 'https', False),
+    ('https', 'X-Forwarded-Proto', None, False),
+    ('https', 'X-Forwarded-Proto', 'http', False),
+    ('https', '', None, True),
+    ('https', '', 'https', True),
+    ('https', 'X-Forwarded-Proto', 'https', True),
+])
+def test_is_secure_request(scheme, proto_header, value, secure):
+    from pyramid.request import Request
+    from pyramid_secure_response.util import (
+        get_proto_environ_key,
+        is_secure_environ,
+        is_secure_request,
+    )
+
+    headers = {}
+    if value is not None:
+        headers['X-Forwarded-Proto'] = value
+    req = Request.blank('/', base_url='{:s}://example.org'.format(scheme),
+                        headers=headers)
+
+    proto_key = get_proto_environ_key(proto_header)
+    assert secure is is_secure_request(req, proto_key)
+    assert secure is is_secure_environ(req.environ, proto_key)
+    # same as criteria
+    assert secure is all(build_criteria(req, proto_header=proto_header))
+
+
+def test_compile_config_flattens_fallback_values():
+    from pyramid_secure_response.util import compile_config
+
+    config = compile_config({
+        'pyramid_secure_response.proto_header': 'X-Forwarded-Proto',
+        'pyramid_secure_response.ignore_paths': '\n/humans.txt\n',
+        'pyramid_secure_response.hsts_support.proto_header': 'X-Scheme',
+        'pyramid_secure_response.hsts_support.max_age': '3600',
+        'pyramid_secure_response.csp_coverage.ignore_paths': '\n/static/\n',
+        'pyramid_secure_response.csp_coverage.default_src': 'self',
+    })
+
+    assert 'HTTP_X_FORWARDED_PROTO' == config.proto_key
+
+    assert config.ssl_redirect.enabled
+    assert 'X-Forwarded-Proto' == config.ssl_redirect.proto_header
+    assert 'HTTP_X_FORWARDED_PROTO' == config.ssl_redirect.proto_key
+    assert config.ignore_paths is config.ssl_redirect.ignore_paths
+    assert '301' == config.ssl_redirect.status_code
+
+    assert 'HTTP_X_SCHEME' == config.hsts_support.proto_key
+    assert config.ignore_paths is config.hsts_support.ignore_paths
+    assert 3600 == config.hsts_support.max_age
+
+    assert ('/static/',) == config.csp_coverage.ignore_paths
+    assert 'self' == config.csp_coverage.directives['default_src']
+    assert 'enabled' not in config.csp_coverage.directives
+    assert not any(config.csp_coverage.report_only_directives.values())
+
+    # slotted
+    with pytest.raises(AttributeError):
+        config.foo = 'bar'  # pylint: disable=attribute-defined-outside-init
+
+
+@pytest.mark.parametrize('mode,enforced,reported', [
+    ('enforce', 'self', ''),
+    ('report_only', '', 'self'),
+    ('dual', 'self', 'https:'),
+])
+def test_compile_config_with_csp_report_only_mode(mode, enforced, reported):
+    from pyramid_secure_response.util import compile_config
+
+    config = compile_config({
+        'pyramid_secure_response.csp_coverage.default_src': 'self',
+        'pyramid_secure_response.csp_report_only.mode': mode,
+        'pyramid_secure_response.csp_report_only.default_src': 'https:',
+        'pyramid_secure_response.csp_report_only.sample_rate': '0.25',
+    })
+
+    csp_coverage = config.csp_coverage
+    assert enforced == csp_coverage.directives.get('default_src', '')
+    assert reported == csp_coverage.report_only_directives.get(
+        'default_src', '')
+    assert 0.25 == csp_coverage.sample_rate
+
+
+@pytest.mark.parametrize('settings', [
+    {'pyramid_secure_response.hsts_support.max_age': 'one year'},
+    {'pyramid_secure_response.hsts_support.max_age': '-1'},
+    {'pyramid_secure_response.csp_coverage.scripts_src': 'self'},
+    {'pyramid_secure_response.sri.algorithms': 'sha384 md5'},
+    {'pyramid_secure_response.sri.cache_size': 'many'},
+    {'pyramid_secure_response.csp_report.queue_size': '-1'},
+    {'pyramid_secure_response.csp_report.interval': 'soon'},
+    {'pyramid_secure_response.policy_reload.interval': 'often'},
+    {'pyramid_secure_response.csp_report_only.mode': 'enforced'},
+    {'pyramid_secure_response.csp_report_only.sample_rate': '1.5'},
+    {'pyramid_secure_response.csp_report_only.sample_rate': 'half'},
+    {'pyramid_secure_response.csp_report_only.script_scr': 'self'},
+    {'pyramid_secure_response.csp_report_only.mode': 'dual'},
+])
+def test_compile_config_with_invalid_settings(settings):
+    from pyramid_secure_response.util import compile_config
+
+    with pytest.raises(ValueError):
+        compile_config(settings)
+
+
+def test_load_config_is_cached_on_registry(mocker, dummy_request):
+    from pyramid_secure_response import util
+    from pyramid_secure_response.util import load_config
+    mocker.spy(util, 'parse_config')
+
+    dummy_request.registry.settings = {}
+    config = load_config(dummy_request.registry)
+    assert config is load_config(dummy_request.registry)
+    # pylint: disable=no-member
+    assert 1 == util.parse_config.call_count
+
+    # new settings
+    dummy_request.registry.settings = {
+        'pyramid_secure_response.ssl_redirect.enabled': 'False',
+    }
+    assert not load_config(dummy_request.registry).ssl_redirect.enabled
+    assert 2 == util.parse_config.call_count
+
+
+@pytest.mark.parametrize('name', [
+    'ssl_redirect', 'hsts_support', 'csp_coverage', 'secure_response',
+])
+def test_tween_returns_handler_as_is_if_disabled(mocker, dummy_request, name):
+    from importlib import import_module
+
+    dummy_request.registry.settings = dict(
+        ('pyramid_secure_response.{:s}.enabled'.format(n), 'False')
+        for n in ('ssl_redirect', 'hsts_support', 'csp_coverage'))
+
+    handler_stub = mocker.stub(name='handler_stub')
+    tween = import_module('pyramid_secure_response.{:s}'.format(name)).tween
+    assert handler_stub is tween(handler_stub, dummy_request.registry)
+
+
+@pytest.mark.parametrize('host,expected', [
+    ('example.org', 'example.org'),
+    ('Example.ORG:8080', 'example.org'),
+    ('www.example.org.', 'www.example.org'),
+    ('127.0.0.1:6543', '127.0.0.1'),
+    ('[::1]:6543', '[::1]'),
+    ('[::1]', '[::1]'),
+])
+def test_normalize_host(host, expected):
+    from pyramid_secure_response.util import normalize_host
+
+    assert expected == normalize_host(host)
+
+
+def test_host_map():
+    from pyramid_secure_response.util import HostMap
+
+    hosts = HostMap(default='global')
+    hosts.add('example.org', 'apex')
+    hosts.add('*.example.org', 'wildcard')
+    hosts.add('*.api.example.org', 'api')
+    hosts.add('admin.api.example.org', 'admin')
+
+    assert 4 == len(hosts)
+    assert 'apex' == hosts.resolve('example.org')
+    assert 'wildcard' == hosts.resolve('www.example.org:443')
+    assert 'wildcard' == hosts.resolve('api.example.org')
+    # the longest wildcard wins
+    assert 'api' == hosts.resolve('v1.api.example.org')
+    assert 'api' == hosts.resolve('a.b.api.example.org')
+    assert 'admin' == hosts.resolve('Admin.API.example.org.')
+    assert 'global' == hosts.resolve('example.com')
+    assert 'global' == hosts.resolve('org')
+
+    assert 'global' == HostMap(default='global').resolve('example.org')
+    assert HostMap().resolve('example.org') is None
+
+
+def test_host_map_with_invalid_host():
+    from pyramid_secure_response.util import HostMap
+
+    hosts = HostMap()
+    hosts.add('*.example.org', 1)
+    for pattern in ('*.Example.org', '', 'www.*.example.org', '*'):
+        with pytest.raises(ValueError):
+            hosts.add(pattern, 2)
+
+    hosts.add('example.org', 1)
+    with pytest.raises(ValueError):
+        hosts.add('example.org:443', 2)
+
+
+def test_host_map_resolve_is_cached():
+    from pyramid_secure_response.util import HostMap
+
+    hosts = HostMap(default=0, cache_size=2)
+    hosts.add('*.example.org', 1)
+    assert 1 == hosts.resolve('www.example.org')
+    assert 0 == hosts.resolve('example.com')
+    assert 1 == hosts.resolve('static.example.org')
+
+    # pylint: disable=protected-access
+    assert 2 == len(hosts._cache)
+    assert hosts._cache.get('www.example.org') is None
+
+    # cache is cleared by add
+    hosts.add('static.example.org', 2)
+    assert 0 == len(hosts._cache)
+    assert 2 == hosts.resolve('static.example.org')
+
+
+def test_host_map_map():
+    from pyramid_secure_response.util import HostMap
+
+    hosts = HostMap(default=1)
+    hosts.add('example.org', 2)
+    hosts.add('*.example.org', 3)
+
+    doubled = hosts.map(lambda v: v * 2, default=0)
+    assert [('example.org', 4), ('*.example.org', 6)] == doubled.items()
+    assert 6 == doubled.resolve('www.example.org')
+    assert 0 == doubled.resolve('example.com')
+    assert 3 == hosts.resolve('www.example.org')
+
+
+def test_compile_config_with_host_policies():
+    from pyramid_secure_response.util import compile_config
+
+    config = compile_config({
+        'pyramid_secure_response.hsts_support.max_age': '3600',
+        'pyramid_secure_response.csp_coverage.default_src': 'self',
+        'pyramid_secure_response.host_policy.a.hosts':
+            '\nexample.org\n*.example.org\n',
+        'pyramid_secure_response.host_policy.a.hsts_support.preload': 'False',
+        'pyramid_secure_response.host_policy.b.hosts': 'example.com',
+        'pyramid_secure_response.host_policy.b.csp_coverage.frame_ancestors':
+            'none',
+    })
+    assert config.host_policies.resolve('example.net') is None
+    assert config.host_policies.resolve('example.com').host_policies is None
+
+    a = config.host_policies.resolve('www.example.org')
+    assert a is config.host_policies.resolve('example.org')
+    assert not a.hsts_support.preload
+    assert 3600 == a.hsts_support.max_age  # inherited
+    assert config.hsts_support.preload
+
+    b = config.host_policies.resolve('example.com')
+    assert {'default_src': 'self', 'frame_ancestors': 'none'} == dict(
+        (k, v) for k, v in b.csp_coverage.directives.items() if v)
+    assert not config.csp_coverage.directives['frame_ancestors']
+
+    assert compile_config({}).host_policies is None
+
+
+@pytest.mark.parametrize('settings', [
+    {'pyramid_secure_response.host_policy.a.hsts_support.preload': 'False'},
+    {'pyramid_secure_response.host_policy.a.hosts': 'example.org',
+     'pyramid_secure_response.host_policy.a.ssl_redirect.enabled': 'False'},
+    {'pyramid_secure_response.host_policy.a.hosts': 'example.org',
+     'pyramid_secure_response.host_policy.b.hosts': 'example.org'},
+    {'pyramid_secure_response.host_policy.a.hosts': 'www.*.example.org'},
+    {'pyramid_secure_response.host_policy.a.hosts': 'example.org',
+     'pyramid_secure_response.host_policy.a.hsts_support.max_age': '-1'},
+    # applied only globally
+    {'pyramid_secure_response.host_policy.a.hosts': 'example.org',
+     'pyramid_secure_response.host_policy.a.csp_coverage.ignore_paths': '/a'},
+    {'pyramid_secure_response.host_policy.a.hosts': 'example.org',
+     'pyramid_secure_response.host_policy.a.hsts_support.proto_header':
+         'X-Forwarded-Proto'},
+    {'pyramid_secure_response.host_policy.a.hosts': 'example.org',
+     'pyramid_secure_response.host_policy.a.hsts_support.content_types':
+         'text/html'},
+])
+def test_compile_config_with_invalid_host_policies(settings):
+    from pyramid_secure_response.util import compile_config
+
+    with pytest.raises(ValueError):
+        compile_config(settings)
+
+
+def test_compile_config_scans_once_for_host_policies(mocker):
+    from pyramid_secure_response import csp_hashes
+    from pyramid_secure_response.util import compile_config
+    mocker.patch.object(csp_hashes, 'scan', return_value=((), ()))
+
+    compile_config({
+        'pyramid_secure_response.csp_coverage.script_src': 'self',
+        'pyramid_secure_response.csp_hashes.enabled': 'True',
+        'pyramid_secure_response.csp_hashes.dirs': 'static',
+        'pyramid_secure_response.host_policy.a.hosts': 'example.org',
+        'pyramid_secure_response.host_policy.a.csp_coverage.script_src':
+            'none',
+    })
+    # pylint: disable=no-member
+    assert 1 == csp_hashes.scan.call_count
+
+
+def test_content_type_map():
+    from pyramid_secure_response.util import ContentTypeMap
+
+    types = ContentTypeMap(cache_size=2)
+    types.add('text/html', 'document')
+    types.add('Application/*', 'api')
+    types.add('application/manifest+json', 'manifest')
+
+    assert 3 == len(types)
+    assert 'document' == types.resolve('text/html; charset=UTF-8')
+    assert 'document' == types.resolve('TEXT/HTML')
+    assert 'api' == types.resolve('application/json')
+    assert 'manifest' == types.resolve('application/manifest+json')
+    assert types.resolve('image/png') is None
+    assert types.resolve('') is None
+
+    # pylint: disable=protected-access
+    assert 2 == len(types._cache)
+
+    for pattern in ('text/html', 'html', '*/*', 'text/html; charset=UTF-8'):
+        with pytest.raises(ValueError):
+            types.add(pattern, 'other')
+
+
+@pytest.mark.parametrize('settings,expected', [
+    ({}, None),
+    ({'pyramid_secure_response.csp_coverage.content_types': 'text/html'},
+     (None, [('text/html', True)])),
+    ({'pyramid_secure_response.csp_coverage.minimal_content_types':
+      '\napplication/json\napplication/problem+json\n'},
+     (True, [('application/json', "default-src 'none'; frame-ancestors "
+                                  "'none'"),
+             ('application/problem+json', "default-src 'none'; "
+                                          "frame-ancestors 'none'")])),
+    ({'pyramid_secure_response.csp_coverage.content_types': 'text/*',
+      'pyramid_secure_response.csp_coverage.minimal_content_types':
+      'application/json',
+      'pyramid_secure_response.csp_coverage.minimal_policy': ''},
+     (None, [('text/*', True), ('application/json', None)])),
+])
+def test_compile_config_with_content_types(settings, expected):
+    from pyramid_secure_response.util import compile_config
+
+    content_types = compile_config(settings).csp_coverage.content_types
+    if expected is None:
+        assert content_types is None
+    else:
+        assert expected == (content_types.default, content_types.items())
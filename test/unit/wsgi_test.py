@@ -0,0 +1,233 @@
+import pytest
+
+from pyramid_secure_response.wsgi import SecureResponseMiddleware
+
+
+@pytest.fixture(autouse=True)
+def setup():
+    import logging
+    from pyramid_secure_response.wsgi import logger
+    logger.setLevel(logging.ERROR)
+
+
+def build_app(headers=None, body=(b'OK',)):
+    calls = []
+
+    def app(environ, start_response):
+        calls.append(environ)
+        start_response('200 OK', list(headers or []))
+        return iter(body)
+
+    app.calls = calls
+    return app
+
+
+def get_response(app, url, headers=None):
+    from webob import Request
+    return Request.blank(url, headers=headers or {}).get_response(app)
+
+
+@pytest.mark.parametrize('environ,host,path', [
+    ({'HTTP_HOST': 'example.org', 'PATH_INFO': '/foo'},
+     'example.org', '/foo'),
+    ({'SERVER_NAME': 'example.org', 'SERVER_PORT': '8080',
+      'SCRIPT_NAME': '/app', 'PATH_INFO': '/foo bar'},
+     'example.org:8080', '/app/foo%20bar'),
+    # native string (UTF-8 bytes, decoded as latin-1 on Python 3)
+    ({'HTTP_HOST': 'example.org', 'PATH_INFO': '/caf\xc3\xa9'},
+     'example.org', '/caf%C3%A9'),
+])
+def test_get_host_and_path(environ, host, path):
+    from webob import Request
+    from pyramid_secure_response.wsgi import get_host, get_path
+
+    assert host == get_host(environ)
+    assert path == get_path(environ)
+
+    environ.setdefault('REQUEST_METHOD', 'GET')
+    req = Request(environ)
+    assert req.host == get_host(environ)
+    assert req.path == get_path(environ)
+
+
+def test_middleware_with_disabled():
+    app = build_app()
+    middleware = SecureResponseMiddleware(app, {
+        'pyramid_secure_response.ssl_redirect.enabled': 'False',
+        'pyramid_secure_response.hsts_support.enabled': 'False',
+        'pyramid_secure_response.csp_coverage.enabled': 'False',
+    })
+    res = get_response(middleware, 'http://example.org/')
+
+    assert 1 == len(app.calls)
+    assert 200 == res.status_code
+    assert 'Strict-Transport-Security' not in res.headers
+
+
+def test_middleware_with_ignored_path():
+    app = build_app()
+    middleware = SecureResponseMiddleware(app, {
+        'pyramid_secure_response.ignore_paths': '\n/humans.txt\n',
+        'pyramid_secure_response.csp_coverage.default_src': 'self',
+    })
+    res = get_response(middleware, 'http://example.org/humans.txt')
+
+    assert 1 == len(app.calls)
+    assert 200 == res.status_code
+    assert 'Content-Security-Policy' not in res.headers
+
+
+def test_middleware_insecure():
+    app = build_app()
+    middleware = SecureResponseMiddleware(app, {})
+    res = get_response(middleware, 'http://example.org/foo?q=1',
+                       headers={'Host': 'example.org'})
+
+    assert 0 == len(app.calls)
+    assert 301 == res.status_code
+    assert 'https://example.org/foo' == res.headers['Location']
+    assert b'' == res.body
+
+
+def test_middleware_insecure_with_proto_header():
+    app = build_app()
+    middleware = SecureResponseMiddleware(app, {
+        'pyramid_secure_response.proto_header': 'X-Forwarded-Proto',
+        'pyramid_secure_response.ssl_redirect.status_code': '308',
+    })
+    res = get_response(middleware, 'https://example.org/foo',
+                       headers={'X-Forwarded-Proto': 'http'})
+
+    assert 0 == len(app.calls)
+    assert 308 == res.status_code
+
+
+def test_middleware_secure():
+    app = build_app()
+    middleware = SecureResponseMiddleware(app, {
+        'pyramid_secure_response.proto_header': 'X-Forwarded-Proto',
+        'pyramid_secure_response.hsts_support.max_age': '300',
+        'pyramid_secure_response.csp_coverage.default_src': 'self',
+    })
+    res = get_response(middleware, 'https://example.org/',
+                       headers={'X-Forwarded-Proto': 'https'})
+
+    assert 1 == len(app.calls)
+    assert 200 == res.status_code
+    assert b'OK' == res.body
+    assert 'max-age=300; includeSubDomains; preload' == \
+        res.headers['Strict-Transport-Security']
+    assert "default-src 'self'" == res.headers['Content-Security-Policy']
+
+
+def test_middleware_does_not_enforce_report_only_policy():
+    app = build_app()
+    middleware = SecureResponseMiddleware(app, {
+        'pyramid_secure_response.csp_coverage.default_src': 'self',
+        'pyramid_secure_response.csp_report_only.mode': 'report_only',
+    })
+    res = get_response(middleware, 'https://example.org/')
+
+    assert 'Content-Security-Policy' not in res.headers
+
+
+def test_middleware_does_not_override_headers():
+    app = build_app(headers=[
+        ('strict-transport-security', 'max-age=0'),
+    ])
+    middleware = SecureResponseMiddleware(app, {
+        'pyramid_secure_response.csp_coverage.default_src': 'self',
+    })
+    res = get_response(middleware, 'https://example.org/')
+
+    assert ['max-age=0'] == res.headers.getall('Strict-Transport-Security')
+    assert "default-src 'self'" == res.headers['Content-Security-Policy']
+
+
+def test_middleware_streams_app_iter():
+    consumed = []
+
+    class AppIter(object):
+        closed = False
+
+        def __iter__(self):
+            for chunk in (b'a', b'b'):
+                consumed.append(chunk)
+                yield chunk
+
+        def close(self):
+            self.closed = True
+
+    app_iter = AppIter()
+
+    def app(environ, start_response):  # pylint: disable=unused-argument
+        start_response('200 OK', [])
+        return app_iter
+
+    middleware = SecureResponseMiddleware(app, {})
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': '/',
+        'HTTP_HOST': 'example.org',
+        'wsgi.url_scheme': 'https',
+    }
+    headers = []
+
+    def start_response(status, response_headers, exc_info=None):
+        # pylint: disable=unused-argument
+        headers.extend(response_headers)
+
+    result = middleware(environ, start_response)
+
+    assert result is app_iter
+    assert [] == consumed
+    assert ('Strict-Transport-Security',
+            'max-age=31536000; includeSubDomains; preload') in headers
+
+
+@pytest.mark.parametrize('settings', [
+    {},
+    {'pyramid_secure_response.ssl_redirect.enabled': 'False'},
+    {'pyramid_secure_response.proto_header': 'X-Forwarded-Proto'},
+    {'pyramid_secure_response.hsts_support.ignore_paths': '\n/foo\n',
+     'pyramid_secure_response.csp_coverage.default_src': 'self https:'},
+    {'pyramid_secure_response.ignore_paths': '\n/foo\n',
+     'pyramid_secure_response.csp_coverage.default_src': 'self'},
+    {'pyramid_secure_response.security_headers.ignore_paths': '\n/foo\n',
+     'pyramid_secure_response.security_headers.x_content_type_options':
+         'nosniff',
+     'pyramid_secure_response.security_headers.cross_origin_opener_policy':
+         'same-origin'},
+])
+@pytest.mark.parametrize('url,headers', [
+    ('http://example.org/', {}),
+    ('http://example.org/foo', {'Host': 'example.org'}),
+    ('https://example.org/', {}),
+    ('https://example.org/foo', {}),
+    ('https://example.org/', {'X-Forwarded-Proto': 'http'}),
+    ('https://example.org/foo', {'X-Forwarded-Proto': 'https'}),
+])
+def test_middleware_works_as_same_as_tweens(settings, url, headers):
+    from pyramid.config import Configurator
+    from pyramid.response import Response
+
+    def make_app(with_tweens):
+        config = Configurator(settings=settings)
+        if with_tweens:
+            config.include('pyramid_secure_response')
+        config.add_route('index', '/{path:.*}')
+        config.add_view(lambda _: Response('OK'), route_name='index')
+        return config.make_wsgi_app()
+
+    expected = get_response(make_app(True), url, headers=headers)
+    actual = get_response(
+        SecureResponseMiddleware(make_app(False), settings), url,
+        headers=headers)
+
+    assert expected.status == actual.status
+    for key in ('Location',
+                'Strict-Transport-Security',
+                'Content-Security-Policy',
+                'X-Content-Type-Options',
+                'Cross-Origin-Opener-Policy'):
+        assert expected.headers.get(key) == actual.headers.get(key)